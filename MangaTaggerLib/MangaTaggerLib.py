@@ -1,15 +1,17 @@
+import hashlib
 import logging
-import time
 import re
-import requests
 import unicodedata
 import shutil
 import json
+import time
 
+from collections import namedtuple
 from datetime import datetime
 from os import path
 from pathlib import Path
 from PIL import Image
+from typing import List, Tuple
 from requests.exceptions import ConnectionError
 from xml.etree.ElementTree import SubElement, Element, Comment, tostring
 from xml.dom.minidom import parseString
@@ -17,8 +19,9 @@ from zipfile import ZipFile
 from bs4 import BeautifulSoup
 
 from MangaTaggerLib._version import __version__
-from MangaTaggerLib.api import AniList, AniListRateLimit
-from MangaTaggerLib.database import MetadataTable, ProcFilesTable, ProcSeriesTable
+from MangaTaggerLib.api import AniList, AniListRequestError
+from MangaTaggerLib.concurrency import KeyedLock, SingleFlight
+from MangaTaggerLib.database import MetadataTable, ProcFilesTable, ProcSeriesTable, UnmatchedSeriesTable
 from MangaTaggerLib.errors import FileAlreadyProcessedError, FileUpdateNotRequiredError, UnparsableFilenameError, \
     MangaNotFoundError, MangaMatchedException
 from MangaTaggerLib.models import Metadata
@@ -28,7 +31,22 @@ from MangaTaggerLib.utils import AppSettings, compare
 # Global Variable Declaration
 LOG = logging.getLogger('MangaTaggerLib.MangaTaggerLib')
 
-CURRENTLY_PENDING_RENAME = set()
+RENAME_LOCKS = KeyedLock()
+
+# Series lookups that are running, so threads handling chapters of the same series share one lookup
+SERIES_LOOKUPS = SingleFlight()
+# Speculative lookups of the series whose chapters are still downloading, by title and format
+SERIES_PREFETCHES = SingleFlight()
+
+# Modification time and contents of the last exceptions.json that was read
+_exceptions_cache = (None, {})
+
+ResolvedSeries = namedtuple('ResolvedSeries', ['series_title', 'metadata'])
+
+# Anilist results of the series found by prefetch_series(), by search, with the time they were looked up. Entries
+# are removed once used, and ignored after PREFETCH_TTL seconds in case their chapters are never processed.
+PREFETCH_TTL = 3600
+_prefetched = {}
 
 
 def main():
@@ -47,6 +65,55 @@ def main():
 
 
 def process_manga_chapter(file_path: Path, event_id):
+    process_manga_batch([(file_path, event_id)])
+
+
+def process_manga_batch(chapters: List[Tuple[Path, object]]):
+    """
+    Processes chapters that were queued together. Chapters are grouped by series so that the metadata of each series
+    is resolved once for the whole group.
+    """
+    series_chapters = {}
+
+    for file_path, event_id in chapters:
+        chapter_details = parse_chapter(file_path, event_id)
+        if chapter_details is None:
+            continue
+
+        manga_title, chapter_number, format, volume, logging_info = chapter_details
+        series_chapters.setdefault((manga_title, format), []).append((file_path, chapter_number, volume,
+                                                                       logging_info))
+
+    for (manga_title, format), series_group in series_chapters.items():
+        try:
+            series = resolve_series_once(manga_title, format, series_group[0][3])
+        except Exception as e:
+            LOG.exception(e, extra=series_group[0][3])
+            LOG.warning(f'{len(series_group)} chapter(s) of "{manga_title}" could not be processed.',
+                        extra=series_group[0][3])
+            continue
+
+        if len(series_group) > 1:
+            LOG.info(f'Metadata for "{manga_title}" was resolved once for {len(series_group)} chapters.',
+                     extra=series_group[0][3])
+
+        for file_path, chapter_number, volume, logging_info in series_group:
+            try:
+                tag_manga_chapter(file_path, series, chapter_number, logging_info, volume)
+            except Exception as e:
+                LOG.exception(e, extra=logging_info)
+                LOG.warning('Manga Tagger is unfamiliar with this error. Please log an issue for investigation.',
+                            extra=logging_info)
+
+    for directory_path in {file_path.parent for file_path, _ in chapters}:
+        remove_download_directory(directory_path)
+
+
+def parse_chapter(file_path: Path, event_id):
+    """
+    Returns the series title, chapter number, format, volume and logging details of a downloaded chapter, or None if
+    its filename cannot be parsed.
+    """
     filename = file_path.name
     directory_path = file_path.parent
     directory_name = file_path.parent.name
@@ -64,12 +131,16 @@ def process_manga_chapter(file_path: Path, event_id):
     LOG.debug(f'directory_name: {directory_name}')
 
     manga_details = filename_parser(filename, logging_info)
+    if manga_details is None:
+        LOG.warning(f'Manga Tagger was unable to process "{file_path}"', extra=logging_info)
+        return None
+
+    return manga_details + (logging_info,)
 
-    metadata_tagger(file_path, manga_details[0], manga_details[1], manga_details[2], logging_info, manga_details[3])
 
+def remove_download_directory(directory_path: Path):
     # Remove manga directory if empty
     try:
-        LOG.info(f'Deleting {directory_path}...')
         if directory_path != AppSettings.download_dir:
             LOG.info(f'Deleting {directory_path}...')
             directory_path.rmdir()
@@ -233,7 +304,27 @@ def rename_action(current_file_path: Path, new_file_path: Path, manga_title, cha
                 raise FileAlreadyProcessedError(current_file_path.name)
 
     LOG.info(f'"{new_file_path.name}" will be unlocked for any pending processes.', extra=logging_info)
-    CURRENTLY_PENDING_RENAME.remove(new_file_path)
+
+
+def locked_rename_action(current_file_path: Path, new_file_path: Path, manga_title, chapter_number, logging_info):
+    # Multithreading Optimization
+    if RENAME_LOCKS.acquire(new_file_path, blocking=False):
+        LOG.info(f'No files currently currently being processed under the filename '
+                 f'"{new_file_path.name}". Locking new filename for processing...', extra=logging_info)
+    else:
+        LOG.info(f'A file is currently being renamed under the filename "{new_file_path.name}". Locking '
+                 f'{current_file_path} from further processing until this rename action is complete...',
+                 extra=logging_info)
+
+        RENAME_LOCKS.acquire(new_file_path)
+
+        LOG.info(f'The file being renamed to "{new_file_path}" has been completed. Unlocking '
+                 f'"{new_file_path.name}" for file rename processing.', extra=logging_info)
+
+    try:
+        rename_action(current_file_path, new_file_path, manga_title, chapter_number, logging_info)
+    finally:
+        RENAME_LOCKS.release(new_file_path)
 
 
 def compare_versions(old_filename: str, new_filename: str):
@@ -272,19 +363,57 @@ def compare_versions(old_filename: str, new_filename: str):
         return False
 
 
+def load_exceptions():
+    """
+    Returns the manga specific configuration from exceptions.json. The file is only parsed again once it has been
+    modified.
+    """
+    global _exceptions_cache
+
+    exceptions_path = Path(f'{AppSettings.data_dir}/exceptions.json')
+    try:
+        modified_time = exceptions_path.stat().st_mtime
+    except FileNotFoundError:
+        return {}
+
+    if _exceptions_cache[0] != modified_time:
+        with open(exceptions_path, 'r') as exceptions_json:
+            _exceptions_cache = (modified_time, json.load(exceptions_json))
+    return _exceptions_cache[1]
+
+
+def is_series_cached(manga_title):
+    """
+    Returns whether the series can be resolved from manga_metadata without a request to Anilist.
+    """
+    if manga_title in ProcSeriesTable.processed_series:
+        return True
+
+    exception = load_exceptions().get(manga_title, {})
+    if 'anilist_id' in exception:
+        return MetadataTable.search_by_search_id(exception['anilist_id']) is not None
+
+    return MetadataTable.search_by_search_value(exception.get('anilist_title', manga_title)) is not None
+
+
 def metadata_tagger(file_path, manga_title, manga_chapter_number, format, logging_info, volume):
-    manga_search = None
-    db_exists = True
-    retries = 0
+    series = resolve_series_once(manga_title, format, logging_info)
+    return tag_manga_chapter(file_path, series, manga_chapter_number, logging_info, volume)
+
+
+def apply_exceptions(manga_title, format, logging_info):
+    """
+    Returns the search title, format, adult flag and Anilist id to use for a series, taking exceptions.json into
+    account.
+    """
     isadult = False
     anilist_id = None
 
     if AppSettings.adult_result:
         isadult = True
 
-    if Path(f'{AppSettings.data_dir}/exceptions.json').exists():
-        with open(f'{AppSettings.data_dir}/exceptions.json', 'r') as exceptions_json:
-            exceptions = json.load(exceptions_json)
+    exceptions = load_exceptions()
+    if exceptions:
         if manga_title in exceptions:
             LOG.info('Manga_title found in exceptions.json, using manga specific configuration...', extra=logging_info)
             if exceptions[manga_title]['format'] == "MANGA" or exceptions[manga_title]['format'] == "ONE_SHOT":
@@ -296,201 +425,334 @@ def metadata_tagger(file_path, manga_title, manga_chapter_number, format, loggin
             if "anilist_title" in exceptions[manga_title]:
                 manga_title = exceptions[manga_title]['anilist_title']
 
+    return manga_title, format, isadult, anilist_id
+
+
+def search_anilist(api, manga_title, format, isadult, anilist_id, logging_info):
+    """
+    Runs the Anilist search that matches the series configuration. With AsyncAniList as the api, the returned value
+    is awaitable.
+    """
+    if anilist_id:
+        LOG.info('Searching based on id given in exception file. ')
+        return api.search_for_manga_title_by_id(anilist_id, logging_info)
+    elif isadult:  # enable adult result in Anilist
+        LOG.info('Adult result enabled')
+        return api.search_for_manga_title_by_manga_title_with_adult(manga_title, format, logging_info)
+    else:
+        return api.search_for_manga_title_by_manga_title(manga_title, format, logging_info)
+
+
+def prefetch_series(file_paths):
+    """
+    Looks up the series of the given chapters that are not in manga_metadata yet with batched Anilist requests, so a
+    backlog of new series costs one request per AniList.batch_size series rather than one per series.
+    """
+    searches = []
+    unmatched = []
+    series = {(parsed[0], parsed[2]) for parsed in map(_parse_series, file_paths) if parsed is not None}
+    for manga_title, format in sorted(series):
+        search = apply_exceptions(manga_title, format, {})
+        fingerprint = exception_fingerprint(manga_title)
+        if prefetched_series(*search, remove=False)[0] or search in searches or is_series_cached(manga_title) \
+                or UnmatchedSeriesTable.search(manga_title, format, fingerprint):
+            continue
+        searches.append(search)
+        unmatched.append((manga_title, format, fingerprint))
+
+    if not searches:
+        return
+
+    LOG.info(f'Looking up {len(searches)} new series on Anilist in batches of {AniList.batch_size}...')
+    try:
+        results = AniList.search_batch(searches, {})
+    except AniListRequestError:
+        LOG.warning('The batched lookup failed; the series will be looked up one at a time.')
+        return
+    except Exception as e:
+        # Such as AniListRateLimit once the retries are used up, or a response that is not JSON
+        LOG.exception(e)
+        LOG.warning('The batched lookup failed; the series will be looked up one at a time.')
+        return
+
+    now = time.monotonic()
+    for expired in [search for search, (looked_up, _) in list(_prefetched.items()) if now - looked_up >= PREFETCH_TTL]:
+        _prefetched.pop(expired, None)
+
+    for search, series, anilist_details in zip(searches, unmatched, results):
+        if anilist_details is not None:
+            _prefetched[search] = (now, anilist_details)
+        else:
+            # Recorded like any other failed lookup, so the TTL and exceptions.json changes apply
+            remember_unmatched(*series, {})
+
+
+def prefetch_chapter_series(file_path):
+    """
+    Looks up the series of a chapter as soon as it starts downloading, so that its metadata is ready by the time the
+    file has settled and is processed.
+    """
+    parsed = _parse_series(file_path)
+    if parsed is None:
+        return
+
+    try:
+        SERIES_PREFETCHES.do((parsed[0], parsed[2]), prefetch_series, [file_path])
+    except Exception as e:
+        LOG.exception(e)
+        LOG.warning(f'The series of "{file_path}" could not be prefetched; it will be looked up when processed.')
+
+
+def _parse_series(file_path):
+    file_path = Path(file_path)
+    logging_info = {
+        'event_id': None,
+        'manga_title': file_path.parent.name,
+        'original_filename': file_path.name
+    }
+    return filename_parser(file_path.name, logging_info)
+
+
+def prefetched_series(manga_title, format, isadult, anilist_id, remove=True):
+    """
+    Returns whether prefetch_series() found the series, and its Anilist details if it did. The result is only used
+    once unless remove is False.
+    """
+    search = (manga_title, format, isadult, anilist_id)
+    entry = _prefetched.pop(search, None) if remove else _prefetched.get(search)
+    if entry is None or time.monotonic() - entry[0] >= PREFETCH_TTL:
+        return False, None
+    return True, entry[1]
+
+
+def resolve_series_once(manga_title, format, logging_info):
+    """
+    Resolves a series, waiting for the lookup another thread is already running for it instead of repeating it.
+    """
+    key = (manga_title, format)
+    if SERIES_LOOKUPS.running(key):
+        LOG.info(f'Waiting for the metadata lookup of "{manga_title}" that is already running.', extra=logging_info)
+    return SERIES_LOOKUPS.do(key, resolve_series, manga_title, format, logging_info)
+
+
+def exception_fingerprint(manga_title):
+    """
+    Returns a digest of the exceptions.json entry of a series, which changes whenever the entry is added or edited.
+    """
+    exception = json.dumps(load_exceptions().get(manga_title), sort_keys=True)
+    return hashlib.sha1(exception.encode('utf-8')).hexdigest()
+
+
+def resolve_series(manga_title, format, logging_info):
+    # The lookup started when the chapter began downloading is joined instead of repeated
+    SERIES_PREFETCHES.wait((manga_title, format))
+
+    fingerprint = exception_fingerprint(manga_title)
+    if UnmatchedSeriesTable.search(manga_title, format, fingerprint):
+        LOG.info(f'"{manga_title}" was recently not found on Anilist; skipping the lookup. Add it to exceptions.json '
+                 f'to look it up again.', extra=logging_info)
+        raise MangaNotFoundError(manga_title)
+
+    try:
+        return _resolve_series(manga_title, format, logging_info)
+    except MangaNotFoundError:
+        remember_unmatched(manga_title, format, fingerprint, logging_info)
+        raise
+
+
+def remember_unmatched(manga_title, format, fingerprint, logging_info):
+    if database_insert_enabled():
+        UnmatchedSeriesTable.insert(manga_title, format, fingerprint, logging_info)
+
+
+def _resolve_series(manga_title, format, logging_info):
+    manga_title, format, isadult, anilist_id = apply_exceptions(manga_title, format, logging_info)
+
     LOG.info(f'Table search value is "{manga_title}"', extra=logging_info)
-    while manga_search is None:
-        if retries == 0:
-            if anilist_id is not None:
-                LOG.info('Searching manga_metadata for anilist id.', extra=logging_info)
-                manga_search = MetadataTable.search_by_search_id(anilist_id)
-            else:
-                LOG.info('Searching manga_metadata for manga title by search value...', extra=logging_info)
-                manga_search = MetadataTable.search_by_search_value(manga_title)
-            retries = 1
-        else:  # The manga is not in the database, so ping the API and create the database
-            LOG.info('Manga was not found in the database; resorting to Anilist API.', extra=logging_info)
+    if anilist_id is not None:
+        LOG.info('Searching manga_metadata for anilist id.', extra=logging_info)
+        manga_search = MetadataTable.search_by_search_id(anilist_id)
+    else:
+        LOG.info('Searching manga_metadata for manga title by search value...', extra=logging_info)
+        manga_search = MetadataTable.search_by_search_value(manga_title)
+
+    if manga_search is not None:
+        if cover_missing(manga_search['series_title']) and not manga_search.get('cover_url'):
+            LOG.info(f'Image directory configured but cover not found. Send request to Anilist for necessary data.',
+                     extra=logging_info)
             try:
-                if anilist_id:
-                    LOG.info('Searching based on id given in exception file. ')
-                    manga_search = AniList.search_for_manga_title_by_id(anilist_id, logging_info)
-                elif isadult:  # enable adult result in Anilist
-                    LOG.info('Adult result enabled')
-                    manga_search = AniList.search_for_manga_title_by_manga_title_with_adult(manga_title, format, logging_info)
-                else:
-                    manga_search = AniList.search_for_manga_title_by_manga_title(manga_title, format, logging_info)
-            except AniListRateLimit as e:
-                LOG.warning(e, extra=logging_info)
-                LOG.warning('Manga Tagger has unintentionally breached the API limits on Anilist. Waiting 60s to clear '
-                            'all rate limiting limits...')
-                time.sleep(60)
-                if anilist_id:
-                    LOG.info('Searching based on id given in exception file: ')
-                    manga_search = AniList.search_for_manga_title_by_id(anilist_id, logging_info)
-                elif isadult:  # enable adult result in Anilist
-                    LOG.info('Adult result enabled')
-                    manga_search = AniList.search_for_manga_title_by_manga_title_with_adult(manga_title, format, logging_info)
-                else:
-                    manga_search = AniList.search_for_manga_title_by_manga_title(manga_title, format, logging_info)
-            if manga_search is None:
-                raise MangaNotFoundError(manga_title)
-            db_exists = False
-
-    if db_exists:
-        series_title = MetadataTable.search_series_title(manga_title)
-        series_title_legal = slugify(series_title)
-        manga_library_dir = Path(AppSettings.library_dir, series_title_legal)
-        try:
-            if volume is not None:
-                new_filename = f"{series_title_legal} Vol.{volume} {manga_chapter_number}.cbz"
+                anilist_details = AniList.search_details_by_series_id(manga_search['_id'], format, logging_info)
+            except AniListRequestError:
+                LOG.warning('The cover could not be looked up on Anilist.', extra=logging_info)
             else:
-                new_filename = f"{series_title_legal} {manga_chapter_number}.cbz"
-            LOG.debug(f'new_filename: {new_filename}')
-        except TypeError:
-            LOG.warning(f'Manga Tagger was unable to process "{file_path}"', extra=logging_info)
-            return None
-        new_file_path = Path(manga_library_dir, new_filename)
-
-        if AppSettings.mode_settings is None or AppSettings.mode_settings['rename_file']:
-            if not manga_library_dir.exists():
-                LOG.info(
-                    f'A directory for "{series_title}" in "{AppSettings.library_dir}" does not exist; creating now.')
-                manga_library_dir.mkdir()
-            try:
-                # Multithreading Optimization
-                if new_file_path in CURRENTLY_PENDING_RENAME:
-                    LOG.info(f'A file is currently being renamed under the filename "{new_filename}". Locking '
-                             f'{file_path} from further processing until this rename action is complete...',
-                             extra=logging_info)
+                store_cover_url(manga_search, anilist_details, logging_info)
+        return series_from_database(manga_title, manga_search, logging_info)
+
+    # The manga is not in the database, so ping the API and create the database
+    LOG.info('Manga was not found in the database; resorting to Anilist API.', extra=logging_info)
+    # Rate limiting is handled by AniList, which paces and retries every request. The search returns every detail
+    # of the series, so no second request is needed.
+    prefetched, anilist_details = prefetched_series(manga_title, format, isadult, anilist_id)
+    if prefetched:
+        LOG.info('Using the Anilist result of the batched lookup.', extra=logging_info)
+    else:
+        anilist_details = search_anilist(AniList, manga_title, format, isadult, anilist_id, logging_info)
+    if anilist_details is None:
+        raise MangaNotFoundError(manga_title)
+    LOG.debug(f'anilist_details: {anilist_details}')
 
-                    while new_file_path in CURRENTLY_PENDING_RENAME:
-                        time.sleep(1)
+    series, is_new = series_from_anilist(manga_title, anilist_details, logging_info)
+    if is_new:
+        if database_insert_enabled():
+            MetadataTable.insert(series.metadata, logging_info)
+        mark_series_processed(series.series_title, logging_info)
+    return series
 
-                    LOG.info(f'The file being renamed to "{new_file_path}" has been completed. Unlocking '
-                             f'"{new_filename}" for file rename processing.', extra=logging_info)
-                else:
-                    LOG.info(f'No files currently currently being processed under the filename '
-                             f'"{new_filename}". Locking new filename for processing...', extra=logging_info)
-                    CURRENTLY_PENDING_RENAME.add(new_file_path)
 
-                rename_action(file_path, new_file_path, series_title, manga_chapter_number, logging_info)
-            except (FileExistsError, FileUpdateNotRequiredError, FileAlreadyProcessedError) as e:
-                LOG.exception(e, extra=logging_info)
-                CURRENTLY_PENDING_RENAME.remove(new_file_path)
-                return
+def cover_missing(series_title):
+    """
+    Returns whether covers are enabled but the cover of the series has not been downloaded yet.
+    """
+    return AppSettings.image and not Path(f'{AppSettings.image_dir}/{series_title}_cover.jpg').exists()
 
-        if manga_title in ProcSeriesTable.processed_series:
-            LOG.info(f'Found an entry in manga_metadata for "{manga_title}".', extra=logging_info)
-        else:
-            LOG.info(f'Found an entry in manga_metadata for "{manga_title}"; unlocking series for processing.',
-                     extra=logging_info)
-            ProcSeriesTable.processed_series.add(manga_title)
 
-        if AppSettings.image:
-            if not Path(f'{AppSettings.image_dir}/{series_title}_cover.jpg').exists():
-                LOG.info(f'Image directory configured but cover not found. Send request to Anilist for necessary data.',extra=logging_info)
-                manga_id = MetadataTable.search_by_series_title(series_title)['_id']
-                anilist_details = AniList.search_details_by_series_id(manga_id, format, logging_info)
-                LOG.info('Downloading series cover image...', extra=logging_info)
-                download_cover_image(series_title, anilist_details['coverImage']['extraLarge'])
-            else:
-                LOG.info('Series cover image already exist, not downloading.', extra=logging_info)
-        else:
-            LOG.info('Image flag not set, not downloading series cover image.', extra=logging_info)
+def database_insert_enabled():
+    return AppSettings.mode_settings is None or ('database_insert' in AppSettings.mode_settings.keys()
+                                                 and AppSettings.mode_settings['database_insert'])
 
 
+def store_cover_url(manga_search, anilist_details, logging_info):
+    """
+    Adds the cover URL to a manga_metadata document that was stored before cover URLs were kept, so the series does
+    not have to be looked up again.
+    """
+    if anilist_details is None:
+        return
+
+    manga_search['cover_url'] = anilist_details['coverImage']['extraLarge']
+    if database_insert_enabled():
+        MetadataTable.update({'_id': manga_search['_id']}, {'$set': {'cover_url': manga_search['cover_url']}},
+                             logging_info)
+
 
-        manga_metadata = Metadata(series_title, logging_info, details=manga_search)
-        logging_info['metadata'] = manga_metadata.__dict__
+def series_from_database(manga_title, manga_search, logging_info):
+    """
+    Builds the series of a manga_metadata document, downloading the cover from the stored URL when it is missing.
+    """
+    series_title = manga_search['series_title']
+
+    if manga_title in ProcSeriesTable.processed_series:
+        LOG.info(f'Found an entry in manga_metadata for "{manga_title}".', extra=logging_info)
     else:
+        LOG.info(f'Found an entry in manga_metadata for "{manga_title}"; unlocking series for processing.',
+                 extra=logging_info)
+        ProcSeriesTable.add(manga_title)
 
-        anilist_titles = construct_anilist_titles(manga_search['title'])
-        logging_info['anilist_titles'] = anilist_titles
+    manga_metadata = Metadata(series_title, logging_info, details=manga_search)
+    logging_info['metadata'] = manga_metadata.__dict__
 
-        if not anilist_titles == 'None' or anilist_titles is not None:
-            manga_found = True
+    if AppSettings.image:
+        if cover_missing(series_title) and manga_metadata.cover_url is not None:
+            LOG.info('Downloading series cover image...', extra=logging_info)
+            download_cover_image(series_title, manga_metadata.cover_url)
+        else:
+            LOG.info('Series cover image already exist, not downloading.', extra=logging_info)
+    else:
+        LOG.info('Image flag not set, not downloading series cover image.', extra=logging_info)
 
-        series_title = anilist_titles.get('romaji')
-        series_title_legal = slugify(series_title)
-        LOG.info(f'Manga title found for "{manga_title}" found as "{series_title}".', extra=logging_info)
+    return ResolvedSeries(series_title, manga_metadata)
 
-        series_id = manga_search['id']
-        anilist_details = AniList.search_details_by_series_id(series_id, format, logging_info)
-        LOG.debug(f'anilist_details: {anilist_details}')
 
-        try:
-            if volume is not None:
-                new_filename = f"{series_title_legal} Vol.{volume} {manga_chapter_number}.cbz"
-            else:
-                new_filename = f"{series_title_legal} {manga_chapter_number}.cbz"
-            LOG.debug(f'new_filename: {new_filename}')
-        except TypeError:
-            LOG.warning(f'Manga Tagger was unable to process "{file_path}"', extra=logging_info)
-            return None
+def series_from_anilist(manga_title, anilist_details, logging_info):
+    """
+    Builds the series of an Anilist search result. Returns the series and whether it still has to be inserted into
+    manga_metadata and marked as processed.
+    """
+    anilist_titles = construct_anilist_titles(anilist_details['title'])
+    logging_info['anilist_titles'] = anilist_titles
 
-        manga_library_dir = Path(AppSettings.library_dir, series_title_legal)
-        LOG.debug(f'Manga Library Directory: {manga_library_dir}')
+    series_title = anilist_titles.get('romaji')
+    LOG.info(f'Manga title found for "{manga_title}" found as "{series_title}".', extra=logging_info)
 
-        new_file_path = Path(manga_library_dir, new_filename)
-        LOG.debug(f'new_file_path: {new_file_path}')
+    manga_metadata = Metadata(series_title, logging_info, anilist_details)
+    logging_info['metadata'] = manga_metadata.__dict__
 
-        LOG.info(f'Checking for current and previously processed files with filename "{new_filename}"...',
-                 extra=logging_info)
+    is_new = series_title not in ProcSeriesTable.processed_series
+    if not is_new:
+        LOG.info(
+            f'Found an entry in manga_metadata for "{series_title}". Filename was probably not perfectly named according to MAL. Not adding metadata to MetadataTable.',
+            extra=logging_info)
+    return ResolvedSeries(series_title, manga_metadata), is_new
 
-        if AppSettings.mode_settings is None or AppSettings.mode_settings['rename_file']:
-            if not manga_library_dir.exists():
-                LOG.info(
-                    f'A directory for "{series_title}" in "{AppSettings.library_dir}" does not exist; creating now.')
-                manga_library_dir.mkdir()
-            try:
-                # Multithreading Optimization
-                if new_file_path in CURRENTLY_PENDING_RENAME:
-                    LOG.info(f'A file is currently being renamed under the filename "{new_filename}". Locking '
-                             f'{file_path} from further processing until this rename action is complete...',
-                             extra=logging_info)
 
-                    while new_file_path in CURRENTLY_PENDING_RENAME:
-                        time.sleep(1)
+def mark_series_processed(series_title, logging_info):
+    LOG.info(f'Retrieved metadata for "{series_title}" from the Anilist and MyAnimeList APIs; '
+             f'now unlocking series for processing!', extra=logging_info)
+    ProcSeriesTable.add(series_title)
 
-                    LOG.info(f'The file being renamed to "{new_file_path}" has been completed. Unlocking '
-                             f'"{new_filename}" for file rename processing.', extra=logging_info)
-                else:
-                    LOG.info(f'No files currently currently being processed under the filename '
-                             f'"{new_filename}". Locking new filename for processing...', extra=logging_info)
-                    CURRENTLY_PENDING_RENAME.add(new_file_path)
 
-                rename_action(file_path, new_file_path, series_title, manga_chapter_number, logging_info)
+def tag_manga_chapter(file_path, series: ResolvedSeries, manga_chapter_number, logging_info, volume):
+    series_title = series.series_title
+    manga_metadata = series.metadata
+    logging_info['metadata'] = manga_metadata.__dict__
 
-            except (FileExistsError, FileUpdateNotRequiredError, FileAlreadyProcessedError) as e:
-                LOG.exception(e, extra=logging_info)
-                CURRENTLY_PENDING_RENAME.remove(new_file_path)
-                return
+    series_title_legal = slugify(series_title)
+    try:
+        if volume is not None:
+            new_filename = f"{series_title_legal} Vol.{volume} {manga_chapter_number}.cbz"
+        else:
+            new_filename = f"{series_title_legal} {manga_chapter_number}.cbz"
+        LOG.debug(f'new_filename: {new_filename}')
+    except TypeError:
+        LOG.warning(f'Manga Tagger was unable to process "{file_path}"', extra=logging_info)
+        return None
+
+    manga_library_dir = Path(AppSettings.library_dir, series_title_legal)
+    LOG.debug(f'Manga Library Directory: {manga_library_dir}')
+
+    new_file_path = Path(manga_library_dir, new_filename)
+    LOG.debug(f'new_file_path: {new_file_path}')
 
-        manga_metadata = Metadata(series_title, logging_info, anilist_details)
-        logging_info['metadata'] = manga_metadata.__dict__
+    LOG.info(f'Checking for current and previously processed files with filename "{new_filename}"...',
+             extra=logging_info)
 
-        if series_title in ProcSeriesTable.processed_series:
+    if AppSettings.mode_settings is None or AppSettings.mode_settings['rename_file']:
+        if not manga_library_dir.exists():
             LOG.info(
-                f'Found an entry in manga_metadata for "{series_title}". Filename was probably not perfectly named according to MAL. Not adding metadata to MetadataTable.',
-                extra=logging_info)
-        else:
-            if AppSettings.mode_settings is None or ('database_insert' in AppSettings.mode_settings.keys()
-                                                     and AppSettings.mode_settings['database_insert']):
-                MetadataTable.insert(manga_metadata, logging_info)
-            LOG.info(f'Retrieved metadata for "{series_title}" from the Anilist and MyAnimeList APIs; '
-                     f'now unlocking series for processing!', extra=logging_info)
-            ProcSeriesTable.processed_series.add(series_title)
+                f'A directory for "{series_title}" in "{AppSettings.library_dir}" does not exist; creating now.')
+            manga_library_dir.mkdir(exist_ok=True)
+        try:
+            locked_rename_action(file_path, new_file_path, series_title, manga_chapter_number, logging_info)
+        except (FileExistsError, FileUpdateNotRequiredError, FileAlreadyProcessedError) as e:
+            LOG.exception(e, extra=logging_info)
+            return
 
     if AppSettings.mode_settings is None or ('write_comicinfo' in AppSettings.mode_settings.keys()
                                              and AppSettings.mode_settings['write_comicinfo']):
         if AppSettings.image:
-            if not Path(f'{AppSettings.image_dir}/{series_title}_cover.jpg').exists():
+            if not Path(f'{AppSettings.image_dir}/{series_title}_cover.jpg').exists() \
+                    and manga_metadata.cover_url is not None:
                 LOG.info(f'Image directory configured but cover not found. Downloading series cover image...', extra=logging_info)
-                download_cover_image(series_title, anilist_details['coverImage']['extraLarge'])
+                download_cover_image(series_title, manga_metadata.cover_url)
             else:
                 LOG.info('Series cover image already exist, not downloading.', extra=logging_info)
-        comicinfo_xml = construct_comicinfo_xml(manga_metadata, manga_chapter_number, logging_info, volume)
-        reconstruct_manga_chapter(series_title, comicinfo_xml, new_file_path, logging_info)
+
+        cover_path = None
         if AppSettings.image and (not AppSettings.image_first or (AppSettings.image_first and int(float(manga_chapter_number))==1)):
-            add_cover_to_manga_chapter(series_title, new_file_path, logging_info)
+            if Path(f'{AppSettings.image_dir}/{series_title}_cover.jpg').exists():
+                cover_path = f'{AppSettings.image_dir}/{series_title}_cover.jpg'
+
+        try:
+            QueueWorker.run_cpu_bound(write_chapter_tags, manga_metadata, manga_chapter_number, volume, new_file_path,
+                                      cover_path, logging_info)
+        except Exception as e:
+            LOG.exception(e, extra=logging_info)
+            LOG.warning('Manga Tagger is unfamiliar with this error. Please log an issue for investigation.',
+                        extra=logging_info)
+        else:
+            LOG.info(f'ComicInfo.xml has been created and appended to "{new_file_path}".', extra=logging_info)
+            if cover_path is not None:
+                LOG.info(f'Cover Image has been added to "{new_file_path}".', extra=logging_info)
 
     LOG.info(f'Processing on "{new_file_path}" has finished.', extra=logging_info)
     return manga_metadata
@@ -597,31 +859,20 @@ def construct_comicinfo_xml(metadata: Metadata, chapter_number, logging_info, vo
     return parseString(tostring(comicinfo)).toprettyxml(indent="   ")
 
 
-def reconstruct_manga_chapter(manga_title, comicinfo_xml, manga_file_path, logging_info):
-    try:
-        with ZipFile(manga_file_path, 'a') as zipfile:
-            zipfile.writestr('ComicInfo.xml', comicinfo_xml)
-    except Exception as e:
-        LOG.exception(e, extra=logging_info)
-        LOG.warning('Manga Tagger is unfamiliar with this error. Please log an issue for investigation.',
-                    extra=logging_info)
-        return
-    LOG.info(f'ComicInfo.xml has been created and appended to "{manga_file_path}".', extra=logging_info)
+def write_chapter_tags(metadata: Metadata, chapter_number, volume, manga_file_path, cover_path, logging_info):
+    """
+    Builds ComicInfo.xml and appends it, along with the series cover when one is given, to the chapter archive. This
+    is the CPU-bound part of tagging and may run in a separate process, so it only relies on its arguments.
+    """
+    comicinfo_xml = construct_comicinfo_xml(metadata, chapter_number, logging_info, volume)
+    with ZipFile(manga_file_path, 'a') as zipfile:
+        zipfile.writestr('ComicInfo.xml', comicinfo_xml)
+        if cover_path is not None:
+            zipfile.write(cover_path, '000_cover.jpg')
 
-def add_cover_to_manga_chapter(manga_title, manga_file_path, logging_info):
-    try:
-        with ZipFile(manga_file_path, 'a') as zipfile:
-            if AppSettings.image and Path(f'{AppSettings.image_dir}/{manga_title}_cover.jpg').exists():
-                zipfile.write(f'{AppSettings.image_dir}/{manga_title}_cover.jpg', '000_cover.jpg')
-    except Exception as e:
-        LOG.exception(e, extra=logging_info)
-        LOG.warning('Manga Tagger is unfamiliar with this error. Please log an issue for investigation.',
-                    extra=logging_info)
-        return
-    LOG.info(f'Cover Image has been added to "{manga_file_path}".', extra=logging_info)
 
 def download_cover_image(manga_title, image_url):
-    image = requests.get(image_url)
+    image = AniList.session().get(image_url, timeout=AniList.timeout())
     with open(f'{AppSettings.image_dir}/{manga_title}_cover.jpg', 'wb') as image_file:
         image_file.write(image.content)
 
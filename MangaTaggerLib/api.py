@@ -1,51 +1,280 @@
+import asyncio
 import logging
 import requests
 import time
 from datetime import datetime
+from threading import Lock
 from typing import Optional, Dict, Mapping, Union, Any
 
+from requests.adapters import HTTPAdapter
+
+from MangaTaggerLib.cache import ResponseCache
+
+
+class RateLimiter:
+    """
+    Token bucket shared by every thread that queries Anilist. Tokens refill at limit requests per period, the bucket is
+    kept in line with the X-RateLimit-Limit and X-RateLimit-Remaining headers of every response, and a 429 pauses all
+    callers until Retry-After has passed. Callers reserve their token up front and wait out their own delay, so they
+    are released one at a time at the sustained rate instead of all at once.
+    """
+
+    def __init__(self, limit=90, period=60.0, clock=time.monotonic, sleep=time.sleep):
+        self.period = period
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = Lock()
+        self._tokens = float(limit)
+        self._updated = clock()
+        self._paused_until = 0.0
+        self.set_limit(limit)
+
+    def set_limit(self, limit):
+        with self._lock:
+            self.limit = limit
+            self.rate = limit / self.period
+            self._tokens = min(self._tokens, float(limit))
+
+    def reserve(self) -> float:
+        """
+        Takes a token and returns how many seconds the caller has to wait before sending its request.
+        """
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            self._tokens -= 1
+            # Tokens only start to refill once a pause is over
+            delay = max(0.0, self._paused_until - now)
+            if self._tokens < 0:
+                delay += -self._tokens / self.rate
+            return delay
+
+    def acquire(self) -> float:
+        """
+        Waits until the caller may send its request and returns how long that took. A pause that began while waiting,
+        because another caller was answered with a 429, is waited out as well, with a new token.
+        """
+        waited = 0.0
+        while True:
+            pause_end = self.pause_end()
+            delay = self.reserve()
+            if delay > 0:
+                self._sleep(delay)
+                waited += delay
+            if self.pause_end() == pause_end:
+                return waited
+
+    def update(self, status_code, headers: Mapping[str, str]):
+        """
+        Adjusts the bucket to the rate limit headers of a response.
+        """
+        limit = self._header(headers, 'X-RateLimit-Limit')
+        if limit is not None and limit > 0 and limit != self.limit:
+            self.set_limit(limit)
+
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+
+            remaining = self._header(headers, 'X-RateLimit-Remaining')
+            if remaining is not None:
+                self._tokens = min(self._tokens, remaining)
+
+            if status_code == 429:
+                retry_after = self._header(headers, 'Retry-After')
+                if retry_after is None:
+                    reset = self._header(headers, 'X-RateLimit-Reset')
+                    retry_after = reset - time.time() if reset is not None else self.period
+                self._paused_until = max(self._paused_until, now + max(retry_after, 0))
+                # One request may go as soon as the pause is over; the rest follow at the sustained rate
+                self._tokens = 1.0
+
+    def paused_for(self) -> float:
+        with self._lock:
+            return max(0.0, self._paused_until - self._clock())
+
+    def pause_end(self) -> float:
+        """
+        Returns when the latest pause ends, which changes whenever a 429 starts a new one.
+        """
+        with self._lock:
+            return self._paused_until
+
+    def _refill(self, now):
+        # Nothing accrues while paused, as Anilist only resets the window once Retry-After has passed
+        start = max(self._updated, self._paused_until)
+        if now > start:
+            self._tokens = min(float(self.limit), self._tokens + (now - start) * self.rate)
+        self._updated = max(self._updated, now)
+
+    @staticmethod
+    def _header(headers, name) -> Optional[float]:
+        try:
+            return float(headers[name])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+
+# Every field Metadata and the cover download need, so a search result can be used without a second request
+MEDIA_DETAILS = '''
+        fragment details on Media {
+          id
+          status
+          volumes
+          siteUrl
+          title {
+            romaji
+            english
+            native
+          }
+          type
+          genres
+          synonyms
+          startDate {
+            day
+            month
+            year
+          }
+          coverImage {
+            extraLarge
+          }
+          staff {
+            edges {
+              node{
+                name {
+                  first
+                  last
+                  full
+                  alternative
+                }
+                siteUrl
+              }
+              role
+            }
+          }
+          description
+        }
+        '''
+
+
 class AniList:
     _log = None
+    _session = None
+    _session_lock = Lock()
+
+    url = 'https://graphql.anilist.co'
+    pool_size = 10
+    connect_timeout = 5
+    read_timeout = 30
+    max_retries = 3
+    batch_size = 10
+    rate_limiter = RateLimiter()
+    cache: Optional[ResponseCache] = None
 
     @classmethod
     def initialize(cls):
         cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
 
+    @classmethod
+    def session(cls) -> requests.Session:
+        """
+        Returns the HTTP session shared by every thread, so connections to Anilist are kept alive and reused.
+        """
+        if cls._session is None:
+            with cls._session_lock:
+                if cls._session is None:
+                    session = requests.Session()
+                    # Threads wait for a free connection rather than opening connections that are thrown away
+                    adapter = HTTPAdapter(pool_maxsize=cls.pool_size, pool_block=True)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    session.headers.update({'Accept': 'application/json', 'Accept-Encoding': 'gzip, deflate'})
+                    cls._session = session
+        return cls._session
+
+    @classmethod
+    def timeout(cls):
+        return cls.connect_timeout, cls.read_timeout
+
+    @classmethod
+    def close(cls):
+        with cls._session_lock:
+            if cls._session is not None:
+                cls._session.close()
+                cls._session = None
+
+        if cls.cache is not None:
+            stats = cls.cache.stats()
+            cls._log.info(f'Anilist response cache: {stats["hits"]} hit(s), {stats["misses"]} miss(es), '
+                          f'{stats["entries"]} response(s) stored in {stats["size"]} bytes')
+            cls.cache.close()
+            cls.cache = None
+
     @classmethod
     def _post(cls, query, variables, logging_info):
-        try:
-            response = requests.post('https://graphql.anilist.co', json={'query': query, 'variables': variables})
-            if response.status_code == 429:  # Anilist rate-limit code
-                raise AniListRateLimit()
-        except Exception as e:
-            cls._log.exception(e, extra=logging_info)
-            cls._log.warning('Manga Tagger is unfamiliar with this error. Please log an issue for investigation.',
-                             extra=logging_info)
-            return None
+        data = cls._query(query, variables, logging_info)
+        if data is None:
+            raise AniListRequestError()
+        return data.get('Media')
+
+    @classmethod
+    def _query(cls, query, variables, logging_info):
+        """
+        Returns the data of the response to a query, from the response cache if it holds a fresh copy, or None if the
+        request failed. Searches raise AniListRequestError instead, so a failure is not taken for a series that does
+        not exist. Responses in which a series was not found are not cached.
+        """
+        if cls.cache is not None:
+            hit, data = cls.cache.get(query, variables)
+            if hit:
+                cls._log.debug(f'Cached response for variables {variables}', extra=logging_info)
+                return data
+
+        data = cls._request(query, variables, logging_info)
+        if cls.cache is not None and cls._cacheable(data):
+            cls.cache.put(query, variables, data)
+        return data
+
+    @staticmethod
+    def _cacheable(data):
+        # Series that were not found are remembered by UnmatchedSeriesTable for its own ttl instead
+        return data is not None and all(media is not None for media in data.values())
+
+    @classmethod
+    def _request(cls, query, variables, logging_info):
+        for _ in range(cls.max_retries + 1):
+            cls.rate_limiter.acquire()
+            try:
+                response = cls.session().post(cls.url, json={'query': query, 'variables': variables},
+                                              timeout=cls.timeout())
+            except Exception as e:
+                cls._log.exception(e, extra=logging_info)
+                cls._log.warning('Manga Tagger is unfamiliar with this error. Please log an issue for investigation.',
+                                 extra=logging_info)
+                return None
+
+            cls.rate_limiter.update(response.status_code, response.headers)
+            if response.status_code != 429:  # Anilist rate-limit code
+                break
+            cls._log.warning(f'Anilist rate limit was reached; every request is paused for '
+                             f'{cls.rate_limiter.paused_for():.0f}s', extra=logging_info)
+        else:
+            raise AniListRateLimit()
 
         cls._log.debug(f'Query: {query}')
         cls._log.debug(f'Variables: {variables}')
         cls._log.debug(f'Response JSON: {response.json()}')
-        try:
-            return response.json()['data']['Media']
-        except TypeError:
-            return None
+        return response.json()['data']
 
     @classmethod
     def search_for_manga_title_by_id(cls, manga_id, logging_info):
         query = '''
         query search_for_manga_title_by_id ($manga_id: Int) {
           Media (id: $manga_id, type: MANGA) {
-            id
-            title {
-              romaji
-              english
-              native
-            }
-            synonyms
+            ...details
           }
         }
-        '''
+        ''' + MEDIA_DETAILS
 
         variables = {
             'manga_id': manga_id,
@@ -58,16 +287,10 @@ class AniList:
         query = '''
         query search_manga_by_manga_title ($manga_title: String, $format: MediaFormat) {
           Media (search: $manga_title, type: MANGA, format: $format, isAdult: false) {
-            id
-            title {
-              romaji
-              english
-              native
-            }
-            synonyms
+            ...details
           }
         }
-        '''
+        ''' + MEDIA_DETAILS
 
         variables = {
             'manga_title': manga_title,
@@ -81,16 +304,10 @@ class AniList:
         query = '''
         query search_manga_by_manga_title ($manga_title: String, $format: MediaFormat) {
           Media (search: $manga_title, type: MANGA, format: $format) {
-            id
-            title {
-              romaji
-              english
-              native
-            }
-            synonyms
+            ...details
           }
         }
-        '''
+        ''' + MEDIA_DETAILS
 
         variables = {
             'manga_title': manga_title,
@@ -104,54 +321,149 @@ class AniList:
         query = '''
         query search_details_by_series_id ($series_id: Int, $format: MediaFormat) {
           Media (id: $series_id, type: MANGA, format: $format) {
-            id
-            status
-            volumes
-            siteUrl
-            title {
-              romaji
-              english
-              native
-            }
-            type
-            genres
-            synonyms
-            startDate {
-              day
-              month
-              year
-            }
-            coverImage {
-              extraLarge
-            }
-            staff {
-              edges {
-                node{
-                  name {
-                    first
-                    last
-                    full
-                    alternative
-                  }
-                  siteUrl
-                }
-                role
-              }
-            }
-            description
+            ...details
           }
         }
-        '''
+        ''' + MEDIA_DETAILS
 
         variables = {
             'series_id': series_id,
             'format': format
         }
-        
+
         return cls._post(query, variables, logging_info)
 
+    @classmethod
+    def search_batch(cls, searches, logging_info):
+        """
+        Looks up several series with one request per batch_size of them. Each search is a (manga_title, format,
+        isadult, anilist_id) tuple as returned by apply_exceptions(); the results are returned in the same order, with
+        None for every series that was not found. Raises AniListRequestError if a request fails.
+        """
+        results = []
+        for start in range(0, len(searches), cls.batch_size):
+            batch = searches[start:start + cls.batch_size]
+            data = cls._query(*cls._batch_query(batch), logging_info)
+            results.extend(cls._batch_results(data, len(batch)))
+        return results
+
+    @staticmethod
+    def _batch_query(searches):
+        """
+        Builds a query holding one aliased Media search per series, with the same filters as the single searches.
+        """
+        parameters = []
+        fields = []
+        variables = {}
+        for i, (manga_title, format, isadult, anilist_id) in enumerate(searches):
+            if anilist_id:
+                parameters.append(f'$id{i}: Int')
+                fields.append(f'media{i}: Media (id: $id{i}, type: MANGA) {{ ...details }}')
+                variables[f'id{i}'] = anilist_id
+            else:
+                adult_filter = '' if isadult else ', isAdult: false'
+                parameters.extend([f'$title{i}: String', f'$format{i}: MediaFormat'])
+                fields.append(f'media{i}: Media (search: $title{i}, type: MANGA, format: $format{i}{adult_filter}) '
+                              f'{{ ...details }}')
+                variables[f'title{i}'] = manga_title
+                variables[f'format{i}'] = format
+
+        query = f'query search_batch ({", ".join(parameters)}) {{\n' + '\n'.join(fields) + '\n}\n' + MEDIA_DETAILS
+        return query, variables
+
+    @staticmethod
+    def _batch_results(data, count):
+        # Series that were not found are null
+        if data is None:
+            raise AniListRequestError()
+        return [data.get(f'media{i}') for i in range(count)]
+
+
+class AsyncAniList(AniList):
+    """
+    AniList client used by the asyncio engine. The queries are inherited from AniList, so every search method returns
+    a coroutine. The engine provides the aiohttp session.
+    """
+    _session = None
+
+    @classmethod
+    def session(cls):
+        return cls._session
+
+    @classmethod
+    async def _post(cls, query, variables, logging_info):
+        data = await cls._query(query, variables, logging_info)
+        if data is None:
+            raise AniListRequestError()
+        return data.get('Media')
+
+    @classmethod
+    async def search_batch(cls, searches, logging_info):
+        results = []
+        for start in range(0, len(searches), cls.batch_size):
+            batch = searches[start:start + cls.batch_size]
+            data = await cls._query(*cls._batch_query(batch), logging_info)
+            results.extend(cls._batch_results(data, len(batch)))
+        return results
+
+    @classmethod
+    async def _query(cls, query, variables, logging_info):
+        if cls.cache is not None:
+            hit, data = cls.cache.get(query, variables)
+            if hit:
+                cls._log.debug(f'Cached response for variables {variables}', extra=logging_info)
+                return data
+
+        data = await cls._request(query, variables, logging_info)
+        if cls.cache is not None and cls._cacheable(data):
+            cls.cache.put(query, variables, data)
+        return data
+
+    @classmethod
+    async def _acquire(cls):
+        # The asynchronous counterpart of RateLimiter.acquire()
+        while True:
+            pause_end = cls.rate_limiter.pause_end()
+            delay = cls.rate_limiter.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if cls.rate_limiter.pause_end() == pause_end:
+                return
+
+    @classmethod
+    async def _request(cls, query, variables, logging_info):
+        for _ in range(cls.max_retries + 1):
+            await cls._acquire()
+            try:
+                async with cls._session.post(cls.url, json={'query': query, 'variables': variables}) as response:
+                    cls.rate_limiter.update(response.status, response.headers)
+                    if response.status == 429:  # Anilist rate-limit code
+                        cls._log.warning(f'Anilist rate limit was reached; every request is paused for '
+                                         f'{cls.rate_limiter.paused_for():.0f}s', extra=logging_info)
+                        continue
+                    response_json = await response.json()
+                    break
+            except Exception as e:
+                cls._log.exception(e, extra=logging_info)
+                cls._log.warning('Manga Tagger is unfamiliar with this error. Please log an issue for investigation.',
+                                 extra=logging_info)
+                return None
+        else:
+            raise AniListRateLimit()
+
+        cls._log.debug(f'Query: {query}')
+        cls._log.debug(f'Variables: {variables}')
+        cls._log.debug(f'Response JSON: {response_json}')
+        return response_json['data']
+
 
 class AniListRateLimit(Exception):
     """
     Exception raised when AniList rate-limit is breached.
-    """
\ No newline at end of file
+    """
+
+
+class AniListRequestError(Exception):
+    """
+    Exception raised when a request to AniList fails, as opposed to AniList not finding the series.
+    """
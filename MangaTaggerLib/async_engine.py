@@ -0,0 +1,239 @@
+import asyncio
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Thread
+from typing import Callable, Dict, List
+
+import aiohttp
+
+from MangaTaggerLib import MangaTaggerLib
+from MangaTaggerLib.api import AniListRequestError, AsyncAniList
+from MangaTaggerLib.database import AsyncMetadataTable, UnmatchedSeriesTable
+from MangaTaggerLib.errors import MangaNotFoundError
+
+
+class AsyncEngine:
+    """
+    Runs the chapter pipeline on an asyncio event loop instead of a fixed set of worker threads. Anilist is queried
+    through aiohttp, while database lookups, renaming and tagging run on small thread pools, so a large number of
+    chapters can wait on the network at once. Concurrent chapters of the same series share one metadata lookup.
+    """
+    _log = None
+
+    @classmethod
+    def fully_qualified_class_name(cls):
+        return f'{cls.__module__}.{cls.__name__}'
+
+    def __init__(self, concurrency: int, max_queue_size: int, io_threads: int, dequeued: Callable, started: Callable,
+                 completed: Callable):
+        self._log = logging.getLogger(self.fully_qualified_class_name())
+        self.concurrency = concurrency
+        self.max_queue_size = max_queue_size
+        self.dequeued = dequeued
+        self.started = started
+        self.completed = completed
+
+        self._executor = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix='MTT-IO')
+        self._database_executor = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix='MTT-DB')
+        self._resolving: Dict[tuple, asyncio.Task] = {}
+        self._consumers: List[asyncio.Task] = []
+        self._queue: asyncio.PriorityQueue = None
+
+        # The loop runs from the start so that events can be queued before the consumers are started
+        self._loop = asyncio.new_event_loop()
+        self._thread = Thread(target=self._loop.run_forever, name='MTT-Async', daemon=True)
+        self._thread.start()
+        self._call(self._setup())
+        self._log.debug(f'Event loop with {concurrency} consumers has been initialized')
+
+    def start(self):
+        self._call(self._start_consumers())
+
+    def put(self, item):
+        """
+        Queues a (priority, sequence, event) item, blocking the calling thread while the queue is full.
+        """
+        self._call(self._queue.put(item))
+
+    def join(self):
+        self._call(self._queue.join())
+
+    def drain(self):
+        """
+        Removes and returns every queued event that has not been picked up yet.
+        """
+        return self._call(self._drain())
+
+    def stop(self, sentinel: Callable):
+        """
+        Lets the consumers finish their current chapters, then closes the connections and stops the event loop.
+        sentinel() returns the queue item that stops one consumer.
+        """
+        self._call(self._stop(sentinel))
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._executor.shutdown()
+        self._database_executor.shutdown()
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _setup(self):
+        self._queue = asyncio.PriorityQueue(maxsize=self.max_queue_size)
+
+        AsyncAniList.initialize()
+        AsyncAniList._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=AsyncAniList.pool_size),
+            timeout=aiohttp.ClientTimeout(sock_connect=AsyncAniList.connect_timeout,
+                                          sock_read=AsyncAniList.read_timeout))
+        AsyncMetadataTable.initialize(self._database_executor)
+
+    async def _start_consumers(self):
+        self._consumers = [self._loop.create_task(self._consume()) for _ in range(self.concurrency)]
+
+    async def _drain(self):
+        events = []
+        while True:
+            try:
+                priority, _, event = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            self.dequeued(priority)
+            events.append(event)
+            self._queue.task_done()
+        return events
+
+    async def _stop(self, sentinel):
+        # Each consumer exits once it pulls a sentinel, which sorts after every event
+        for _ in self._consumers:
+            await self._queue.put(sentinel())
+        await asyncio.gather(*self._consumers)
+
+        await AsyncAniList._session.close()
+        AsyncAniList._session = None
+
+    async def _consume(self):
+        while True:
+            priority, _, event = await self._queue.get()
+
+            if event is None:
+                self._queue.task_done()
+                break
+
+            self.dequeued(priority)
+            self.started([event])
+            try:
+                await self._process_event(event)
+            except Exception as e:
+                self._log.exception(e)
+                self._log.warning('Manga Tagger is unfamiliar with this error. Please log an issue for '
+                                  'investigation.')
+            finally:
+                self.completed([event])
+                self._queue.task_done()
+
+    async def _process_event(self, event):
+        if event.event_type not in ('created', 'existing', 'moved'):
+            self._log.error('Event was passed, but Manga Tagger does not know how to handle it. Please open an '
+                            'issue for further investigation.')
+            return
+
+        self._log.info(f'Pulling "file {event.event_type}" event from the queue for "{event.file_path}"')
+        file_path = Path(event.file_path)
+
+        chapter_details = MangaTaggerLib.parse_chapter(file_path, uuid.uuid1())
+        if chapter_details is not None:
+            manga_title, chapter_number, format, volume, logging_info = chapter_details
+            try:
+                series = await self._resolve(manga_title, format, logging_info)
+            except Exception as e:
+                self._log.exception(e, extra=logging_info)
+                self._log.warning(f'"{file_path}" could not be processed.', extra=logging_info)
+            else:
+                await self._run_blocking(MangaTaggerLib.tag_manga_chapter, file_path, series, chapter_number,
+                                         logging_info, volume)
+
+        await self._run_blocking(MangaTaggerLib.remove_download_directory, file_path.parent)
+
+    async def _resolve(self, manga_title, format, logging_info):
+        """
+        Resolves the metadata of a series, joining the lookup that is already running for it if there is one.
+        """
+        key = (manga_title, format)
+        task = self._resolving.get(key)
+        if task is None:
+            task = self._loop.create_task(self._resolve_series(manga_title, format, logging_info))
+            self._resolving[key] = task
+            task.add_done_callback(lambda _: self._resolving.pop(key, None))
+        else:
+            self._log.info(f'Waiting for the metadata lookup of "{manga_title}" that is already running.',
+                           extra=logging_info)
+        return await task
+
+    async def _resolve_series(self, manga_title, format, logging_info):
+        """
+        The asynchronous counterpart of MangaTaggerLib.resolve_series().
+        """
+        if MangaTaggerLib.SERIES_PREFETCHES.running((manga_title, format)):
+            await self._run_blocking(MangaTaggerLib.SERIES_PREFETCHES.wait, (manga_title, format))
+
+        # exceptions.json is read and unmatched_series may be written to, so neither happens on the event loop
+        fingerprint = await self._run_blocking(MangaTaggerLib.exception_fingerprint, manga_title)
+        if await self._run_blocking(UnmatchedSeriesTable.search, manga_title, format, fingerprint):
+            self._log.info(f'"{manga_title}" was recently not found on Anilist; skipping the lookup.',
+                           extra=logging_info)
+            raise MangaNotFoundError(manga_title)
+
+        try:
+            return await self._search_series(manga_title, format, logging_info)
+        except MangaNotFoundError:
+            await self._run_blocking(MangaTaggerLib.remember_unmatched, manga_title, format, fingerprint,
+                                     logging_info)
+            raise
+
+    async def _search_series(self, manga_title, format, logging_info):
+        manga_title, format, isadult, anilist_id = await self._run_blocking(MangaTaggerLib.apply_exceptions,
+                                                                            manga_title, format, logging_info)
+
+        self._log.info(f'Table search value is "{manga_title}"', extra=logging_info)
+        if anilist_id is not None:
+            manga_search = await AsyncMetadataTable.search_by_search_id(anilist_id)
+        else:
+            manga_search = await AsyncMetadataTable.search_by_search_value(manga_title)
+
+        if manga_search is not None:
+            cover_missing = await self._run_blocking(MangaTaggerLib.cover_missing, manga_search['series_title'])
+            if cover_missing and not manga_search.get('cover_url'):
+                try:
+                    anilist_details = await AsyncAniList.search_details_by_series_id(manga_search['_id'], format,
+                                                                                     logging_info)
+                except AniListRequestError:
+                    self._log.warning('The cover could not be looked up on Anilist.', extra=logging_info)
+                else:
+                    await self._run_blocking(MangaTaggerLib.store_cover_url, manga_search, anilist_details,
+                                             logging_info)
+            # Downloads the cover when it is missing
+            return await self._run_blocking(MangaTaggerLib.series_from_database, manga_title, manga_search,
+                                            logging_info)
+
+        self._log.info('Manga was not found in the database; resorting to Anilist API.', extra=logging_info)
+        prefetched, anilist_details = MangaTaggerLib.prefetched_series(manga_title, format, isadult, anilist_id)
+        if not prefetched:
+            anilist_details = await MangaTaggerLib.search_anilist(AsyncAniList, manga_title, format, isadult,
+                                                                  anilist_id, logging_info)
+        if anilist_details is None:
+            raise MangaNotFoundError(manga_title)
+        self._log.debug(f'anilist_details: {anilist_details}')
+
+        series, is_new = MangaTaggerLib.series_from_anilist(manga_title, anilist_details, logging_info)
+        if is_new:
+            if MangaTaggerLib.database_insert_enabled():
+                await AsyncMetadataTable.insert(series.metadata, logging_info)
+            MangaTaggerLib.mark_series_processed(series.series_title, logging_info)
+        return series
+
+    async def _run_blocking(self, function, *args):
+        return await self._loop.run_in_executor(self._executor, function, *args)
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, Tuple
+
+
+class ResponseCache:
+    """
+    Persistent cache of Anilist responses in an SQLite file, keyed by query and variables. Entries expire after ttl
+    seconds, and once the stored responses grow past max_size bytes the least recently used ones are evicted. Hits and
+    misses are counted for the lifetime of the cache.
+    """
+    _log = None
+
+    @classmethod
+    def fully_qualified_class_name(cls):
+        return f'{cls.__module__}.{cls.__name__}'
+
+    def __init__(self, path: Path, ttl: float, max_size: int, clock=time.time):
+        self._log = logging.getLogger(self.fully_qualified_class_name())
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+
+        # The connection is shared by every thread, one statement at a time
+        self._lock = Lock()
+        self._connection = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, data TEXT NOT NULL, '
+                                 'stored REAL NOT NULL, accessed REAL NOT NULL, size INTEGER NOT NULL)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+
+        with self._lock:
+            self._connection.execute('DELETE FROM responses WHERE stored <= ?', (self.clock() - self.ttl,))
+            self._size = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    @staticmethod
+    def key(query, variables) -> str:
+        document = json.dumps({'query': ' '.join(query.split()), 'variables': variables}, sort_keys=True)
+        return hashlib.sha256(document.encode('utf-8')).hexdigest()
+
+    def get(self, query, variables) -> Tuple[bool, Any]:
+        """
+        Returns whether a fresh response is cached for the query, and its data if it is.
+        """
+        key = self.key(query, variables)
+        now = self.clock()
+        with self._lock:
+            row = self._connection.execute('SELECT data, stored FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None or row[1] <= now - self.ttl:
+                self.misses += 1
+                return False, None
+
+            self._connection.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+            self.hits += 1
+        return True, json.loads(row[0])
+
+    def put(self, query, variables, data):
+        key = self.key(query, variables)
+        document = json.dumps(data)
+        now = self.clock()
+        with self._lock:
+            previous = self._connection.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            self._connection.execute('INSERT OR REPLACE INTO responses (key, data, stored, accessed, size) '
+                                     'VALUES (?, ?, ?, ?, ?)', (key, document, now, now, len(document)))
+            self._size += len(document) - (previous[0] if previous else 0)
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        # Expired entries go first, then the least recently used until the cache is back under 90% of its size
+        self._connection.execute('DELETE FROM responses WHERE stored <= ?', (self.clock() - self.ttl,))
+        self._size = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+        evicted = 0
+        target = self.max_size * 0.9
+        for key, size in self._connection.execute('SELECT key, size FROM responses ORDER BY accessed').fetchall():
+            if self._size <= target:
+                break
+            self._connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self._size -= size
+            evicted += 1
+        self._log.debug(f'Evicted {evicted} cached response(s); {self._size} bytes remain')
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries = self._connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+            return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'size': self._size}
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
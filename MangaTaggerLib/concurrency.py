@@ -0,0 +1,115 @@
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+
+class KeyedLock:
+    """
+    A set of locks addressed by key. Threads holding different keys never block each other, and a thread waiting on
+    a key wakes as soon as the holder releases it. Locks are discarded once no thread holds or waits on them.
+    """
+
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._locks: Dict[Hashable, List] = {}
+
+    def acquire(self, key, blocking=True):
+        with self._mutex:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+
+        acquired = entry[0].acquire(blocking)
+
+        if not acquired:
+            self._discard(key, entry)
+        return acquired
+
+    def release(self, key):
+        with self._mutex:
+            entry = self._locks[key]
+            entry[0].release()
+        self._discard(key, entry)
+
+    def locked(self, key):
+        with self._mutex:
+            entry = self._locks.get(key)
+            return entry is not None and entry[0].locked()
+
+    @contextmanager
+    def hold(self, key):
+        self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release(key)
+
+    def _discard(self, key, entry):
+        with self._mutex:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def __len__(self):
+        with self._mutex:
+            return len(self._locks)
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time. Threads that ask for a key while its call is running wait for that call
+    and share its result, or its exception, instead of making the same call again.
+    """
+
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key, function: Callable, *args):
+        with self._mutex:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.exception is not None:
+                raise call.exception
+            return call.result
+
+        try:
+            call.result = function(*args)
+        except BaseException as e:
+            call.exception = e
+            raise
+        finally:
+            with self._mutex:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def wait(self, key):
+        """
+        Waits for the running call of key to finish, if there is one, without making a call.
+        """
+        with self._mutex:
+            call = self._calls.get(key)
+        if call is not None:
+            call.done.wait()
+
+    def running(self, key) -> bool:
+        with self._mutex:
+            return key in self._calls
+
+    def __len__(self):
+        with self._mutex:
+            return len(self._calls)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.exception: Optional[BaseException] = None
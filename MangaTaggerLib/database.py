@@ -1,12 +1,21 @@
+import asyncio
+import copy
 import logging
+import re
 import sys
-from datetime import datetime
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
 from pathlib import Path
 from queue import Queue
+from threading import Condition, Lock, Thread
+from typing import Callable
 
 from bson.errors import InvalidDocument
-from pymongo import MongoClient
-from pymongo.errors import ServerSelectionTimeoutError, DuplicateKeyError
+from pymongo import ASCENDING, DeleteOne, IndexModel, InsertOne, MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure, ServerSelectionTimeoutError, DuplicateKeyError, \
+    PyMongoError
 
 
 class Database:
@@ -18,6 +27,9 @@ class Database:
     auth_source = None
     server_selection_timeout_ms = None
 
+    # Indexes a table's queries rely on, created at startup if they do not exist yet
+    indexes = []
+
     _client = None
     _database = None
     _log = None
@@ -55,13 +67,36 @@ class Database:
         ProcFilesTable.initialize()
         ProcSeriesTable.initialize()
         TaskQueueTable.initialize()
+        UnmatchedSeriesTable.initialize()
+
+        for table in (MetadataTable, ProcFilesTable, ProcSeriesTable, TaskQueueTable, UnmatchedSeriesTable):
+            table.ensure_indexes()
+        MetadataTable.migrate_search_keys()
 
         cls._log.info('Database connection established!')
         cls._log.debug(f'{cls.__name__} class has been initialized')
 
+    @classmethod
+    def ensure_indexes(cls):
+        """
+        Creates the declared indexes of the table. Existing indexes are left as they are, and a failure only costs
+        performance, so it is logged rather than raised.
+        """
+        if not cls.indexes:
+            return
+
+        try:
+            names = cls._database.create_indexes(cls.indexes)
+            cls._log.debug(f'Ensured indexes: {", ".join(names)}')
+        except PyMongoError as e:
+            cls._log.exception(e)
+            cls._log.warning(f'The indexes of {cls.__name__} could not be created; its lookups will scan the whole '
+                             f'collection.')
+
     @classmethod
     def load_database_tables(cls):
         ProcSeriesTable.load()
+        UnmatchedSeriesTable.load()
 
     @classmethod
     def save_database_tables(cls):
@@ -69,6 +104,10 @@ class Database:
 
     @classmethod
     def close_connection(cls):
+        TaskQueueTable.close()
+        ProcFilesTable.close()
+        ProcSeriesTable.close()
+        MetadataTable.log_cache_stats()
         cls._log.info('Closing database connection...')
         cls._client.close()
 
@@ -81,6 +120,7 @@ class Database:
         cls._log.debug(f'Password: {Database.password}')
         cls._log.debug(f'Authentication Source: {Database.auth_source}')
         cls._log.debug(f'Server Selection Timeout (ms): {Database.server_selection_timeout_ms}')
+        cls._log.debug(f'Metadata Cache: {MetadataTable.cache_size} series for {MetadataTable.cache_ttl}s')
 
     @classmethod
     def insert(cls, data, logging_info=None):
@@ -130,29 +170,150 @@ class Database:
 
 
 class MetadataTable(Database):
+    indexes = [
+        IndexModel([('search_keys', ASCENDING)]),
+        IndexModel([('scrape_time', ASCENDING)])
+    ]
+
+    # Documents looked up recently, so the chapters of a series being processed do not each query the database
+    cache_size = 1024
+    cache_ttl = 600
+    _cache = None
+
+    # Fields whose titles a series can be found by
+    _title_fields = ('search_value', 'series_title', 'series_title_eng', 'series_title_jap', 'synonyms')
+
     @classmethod
     def initialize(cls):
         cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
         cls._database = super()._database['manga_metadata']
+        cls._cache = _DocumentCache(cls.cache_size, cls.cache_ttl)
         cls._log.debug(f'{cls.__name__} class has been initialized')
 
+    @classmethod
+    def insert(cls, data, logging_info=None):
+        super(MetadataTable, cls).insert(data, logging_info)
+        cls._cache.invalidate(data['_id'] if type(data) is dict else data._id)
+
+    @classmethod
+    def update(cls, search_filter, data, logging_info):
+        super(MetadataTable, cls).update(search_filter, data, logging_info)
+        cls._cache.invalidate(search_filter.get('_id'))
+
+    @classmethod
+    def delete_all(cls, logging_info):
+        super(MetadataTable, cls).delete_all(logging_info)
+        cls._cache.invalidate()
+
+    @classmethod
+    def cache_stats(cls):
+        return cls._cache.stats()
+
+    @classmethod
+    def log_cache_stats(cls):
+        if cls._cache is None:
+            return
+        stats = cls._cache.stats()
+        lookups = stats['hits'] + stats['misses']
+        hit_rate = stats['hits'] / lookups if lookups else 0
+        cls._log.info(f'Metadata cache: {stats["hits"]} hit(s), {stats["misses"]} miss(es) '
+                      f'({hit_rate:.0%} hit rate), {stats["entries"]} series cached')
+
+    @staticmethod
+    def search_key(title):
+        """
+        Returns the form of a title that series are looked up by: NFKC-normalized and casefolded, without punctuation
+        or whitespace, so "Kaguya-sama: Love Is War" and "kaguya sama love is war" find the same series.
+        """
+        title = unicodedata.normalize('NFKC', title).casefold()
+        return re.sub(r'[\W_]+', '', title) or ' '.join(title.split())
+
+    @classmethod
+    def search_keys(cls, document) -> list:
+        """
+        Returns the search keys of every title and synonym of a metadata document.
+        """
+        titles = []
+        for field in cls._title_fields:
+            value = document.get(field)
+            titles.extend(value if isinstance(value, list) else [value])
+
+        keys = []
+        for title in titles:
+            if title:
+                key = cls.search_key(title)
+                if key not in keys:
+                    keys.append(key)
+        return keys
+
+    @classmethod
+    def migrate_search_keys(cls, chunk_size=1000):
+        """
+        Adds search_keys to the documents stored before series were looked up by them.
+        """
+        try:
+            cursor = cls._database.find({'search_keys': {'$exists': False}}, dict.fromkeys(cls._title_fields, 1))
+            operations = []
+            migrated = 0
+            for document in cursor:
+                operations.append(UpdateOne({'_id': document['_id']},
+                                            {'$set': {'search_keys': cls.search_keys(document)}}))
+                if len(operations) == chunk_size:
+                    cls._database.bulk_write(operations, ordered=False)
+                    migrated += len(operations)
+                    operations = []
+            if operations:
+                cls._database.bulk_write(operations, ordered=False)
+                migrated += len(operations)
+        except PyMongoError as e:
+            cls._log.exception(e)
+            cls._log.warning('Search keys could not be added to every series; the series without them will be '
+                             'looked up on Anilist again.')
+            return
+
+        if migrated:
+            cls._log.info(f'Added search keys to {migrated} series stored by a previous version.')
+
+    @classmethod
+    def _search_value_filter(cls, manga_title):
+        return {'search_keys': cls.search_key(manga_title)}
+
     @classmethod
     def search_by_search_id(cls, manga_id):
+        document = cls._cache.get_by_id(manga_id)
+        if document is not None:
+            return document
+
         cls._log.debug(f'Searching manga_metadata cls by key "_id" using value "{manga_id}"')
-        return cls._database.find_one({
+        document = cls._database.find_one({
             '_id': manga_id
         })
+        if document is not None:
+            cls._cache.put(document)
+        return document
 
     @classmethod
     def search_by_search_value(cls, manga_title):
+        key = cls.search_key(manga_title)
+        document = cls._cache.get(key)
+        if document is not None:
+            return document
+
         cls._log.debug(f'Searching manga_metadata cls by key "search_value" using value "{manga_title}"')
-        return cls._database.find_one({'$or': [
-            {'search_value': manga_title},
-            {'series_title': manga_title},
-            {'series_title_eng': manga_title},
-            {'series_title_jap': manga_title},
-            {'synonyms': manga_title}
-        ]})
+        document = cls._database.find_one(cls._search_value_filter(manga_title))
+        if document is not None:
+            cls._cache.put(document, key)
+        return document
+
+    @classmethod
+    def search_stale(cls, cutoff: datetime, limit):
+        """
+        Returns up to limit series last scraped before cutoff, oldest first. Series stored before scrape times were
+        recorded come first.
+        """
+        cursor = cls._database.find({'$or': [{'scrape_time': {'$lt': cutoff}}, {'scrape_time': {'$exists': False}}]},
+                                    {'_id': 1, 'search_value': 1, 'series_title': 1})
+        return list(cursor.sort('scrape_time', ASCENDING).limit(limit))
 
     @classmethod
     def search_id_by_search_value(cls, manga_title):
@@ -163,24 +324,72 @@ class MetadataTable(Database):
     @classmethod
     def search_series_title(cls, manga_title):
         cls._log.debug(f'Searching "series_title" using value "{manga_title}"')
-        return cls._database.find_one({"$or": [
-            {'search_value': manga_title},
-            {'series_title': manga_title},
-            {'series_title_eng': manga_title},
-            {'series_title_jap': manga_title},
-            {'synonyms': manga_title}
-        ]}, {'series_title': 1})['series_title']
+        return cls.search_by_search_value(manga_title)['series_title']
+
+
+class AsyncMetadataTable(MetadataTable):
+    """
+    manga_metadata access for the asyncio engine. The PyMongo calls of MetadataTable run on the thread pool given by
+    the engine, which is how Motor drives PyMongo as well, so every method returns a coroutine.
+    """
+    _executor = None
+
+    @classmethod
+    def initialize(cls, executor=None):
+        cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
+        cls._executor = executor
+        cls._log.debug(f'{cls.__name__} class has been initialized')
+
+    @classmethod
+    async def _run(cls, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(cls._executor, function, *args)
+
+    @classmethod
+    async def search_by_search_id(cls, manga_id):
+        return await cls._run(MetadataTable.search_by_search_id, manga_id)
+
+    @classmethod
+    async def search_by_search_value(cls, manga_title):
+        return await cls._run(MetadataTable.search_by_search_value, manga_title)
+
+    @classmethod
+    async def insert(cls, data, logging_info=None):
+        return await cls._run(MetadataTable.insert, data, logging_info)
 
 
 class ProcFilesTable(Database):
+    """
+    Records of the chapters that have been renamed. Records are written behind: inserts and updates are buffered and
+    sent in bulk every flush_interval seconds, off the worker threads. Records that have not been written yet are kept
+    in memory and returned by the searches, so lookups see every chapter processed so far.
+    """
+    flush_interval = 1
+    indexes = [
+        IndexModel([('series_title', ASCENDING), ('chapter_number', ASCENDING)]),
+        IndexModel([('old_filename', ASCENDING)])
+    ]
+    _writer = None
+    # (series_title, chapter_number) -> (record, the operation that writes it)
+    _pending = {}
+    _pending_lock = Lock()
+
     @classmethod
     def initialize(cls):
         cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
         cls._database = super()._database['processed_files']
+        cls._pending = {}
+        cls._writer = _BulkWriter(cls._database, cls.__name__, flush_interval=cls.flush_interval,
+                                  flushed=cls._flushed, rejected=cls._flushed)
+        cls._writer.start()
         cls._log.debug(f'{cls.__name__} class has been initialized')
 
     @classmethod
     def search(cls, manga_title, chapter_number):
+        with cls._pending_lock:
+            pending = cls._pending.get((manga_title, chapter_number))
+        if pending is not None:
+            return dict(pending[0])
+
         cls._log.debug(f'Searching processed_files cls by keys "series_title" and "chapter_number" '
                        f'using values "{manga_title}" and {chapter_number}')
         return cls._database.find_one({
@@ -188,6 +397,22 @@ class ProcFilesTable(Database):
             'chapter_number': chapter_number
         })
 
+    @classmethod
+    def search_old_filenames(cls, filenames, chunk_size=1000):
+        """
+        Returns which of the given download filenames already have a processed_files record.
+        """
+        found = set()
+        for i in range(0, len(filenames), chunk_size):
+            chunk = filenames[i:i + chunk_size]
+            cls._log.debug(f'Searching processed_files for {len(chunk)} original filename(s)')
+            for record in cls._database.find({'old_filename': {'$in': chunk}}, {'old_filename': 1, '_id': 0}):
+                found.add(record['old_filename'])
+
+        with cls._pending_lock:
+            pending = {record['old_filename'] for record, _ in cls._pending.values()}
+        return found | pending.intersection(filenames)
+
     @classmethod
     def insert_record(cls, old_file_path: Path, new_file_path: Path, manga_title, chapter, logging_info):
         record = {
@@ -201,7 +426,7 @@ class ProcFilesTable(Database):
         cls._log.debug(f'Record: {record}')
 
         logging_info['inserted_processed_record'] = record
-        cls._database.insert(record, logging_info)
+        cls._write(record, InsertOne(dict(record)))
 
     @classmethod
     def update_record(cls, results, old_file_path: Path, new_file_path: Path, logging_info):
@@ -214,53 +439,199 @@ class ProcFilesTable(Database):
         cls._log.debug(f'Record: {record}')
 
         logging_info['updated_processed_record'] = record
-        cls._database.update(results, record, logging_info)
+        # A record that has not been written yet has no _id, but is found by its chapter once it has been
+        if '_id' in results:
+            search_filter = {'_id': results['_id']}
+        else:
+            search_filter = {'series_title': results['series_title'], 'chapter_number': results['chapter_number']}
+        cls._write(dict(results, **record['$set']), UpdateOne(search_filter, record))
+
+    @classmethod
+    def flush(cls):
+        if cls._writer is not None:
+            cls._writer.flush()
+
+    @classmethod
+    def close(cls):
+        if cls._writer is not None:
+            cls._writer.stop()
+
+    @classmethod
+    def _write(cls, record, operation):
+        with cls._pending_lock:
+            cls._pending[(record['series_title'], record['chapter_number'])] = (record, operation)
+        cls._writer.append(operation)
+
+    @classmethod
+    def _flushed(cls, operations):
+        # Records that were written, or that the server refused, are read from the database from now on, unless they
+        # have been changed again since
+        written = {id(operation) for operation in operations}
+        with cls._pending_lock:
+            for key, (_, operation) in list(cls._pending.items()):
+                if id(operation) in written:
+                    del cls._pending[key]
 
 
 class ProcSeriesTable(Database):
+    """
+    Series whose metadata has been stored, one document per series keyed by its title. Newly processed series are
+    buffered and upserted together every flush_interval seconds, so saving costs one write per new series rather than
+    rewriting the whole set.
+    """
     processed_series = set()
+    flush_interval = 5
+    _writer = None
 
     @classmethod
     def initialize(cls):
         cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
         cls._database = super()._database['processed_series']
-        cls._id = None
-        cls._last_save_time = None
+        cls._writer = _BulkWriter(cls._database, cls.__name__, flush_interval=cls.flush_interval)
+        cls._writer.start()
         cls._log.debug(f'{cls.__name__} class has been initialized')
 
+    @classmethod
+    def add(cls, series_title):
+        if series_title in cls.processed_series:
+            return
+        cls.processed_series.add(series_title)
+        if cls._writer is not None:
+            cls._writer.append(cls._upsert(series_title))
+
     @classmethod
     def save(cls):
-        cls._log.info('Saving processed series...')
-        cls._database.delete_one({
-            '_id': cls._id
-        })
-        super(ProcSeriesTable, cls).insert(dict.fromkeys(cls.processed_series, True))
+        if cls._writer is not None:
+            cls._log.info('Saving processed series...')
+            cls._writer.flush()
+
+    @classmethod
+    def close(cls):
+        if cls._writer is not None:
+            cls._writer.stop()
 
     @classmethod
     def load(cls):
         cls._log.info('Loading processed series...')
-        results = cls._database.find_one()
-        if results is not None:
-            cls._id = results.pop('_id')
-            cls.processed_series = set(results.keys())
+        processed_series = set()
+        legacy_documents = []
+        for document in cls._database.find():
+            if isinstance(document['_id'], str):
+                processed_series.add(document['_id'])
+            else:
+                # Saved by a version that kept every series as a key of a single document
+                legacy_documents.append(document)
+                processed_series.update(key for key in document if key != '_id')
+        cls.processed_series = processed_series
+
+        for document in legacy_documents:
+            cls._migrate(document)
+
+    @classmethod
+    def _migrate(cls, document):
+        """
+        Splits a document saved by a previous version into one document per series. The old document is only deleted
+        once every series has been written.
+        """
+        titles = [key for key in document if key != '_id']
+        cls._log.info(f'Migrating {len(titles)} processed series saved by a previous version...')
+        try:
+            for i in range(0, len(titles), 1000):
+                cls._database.bulk_write([cls._upsert(title) for title in titles[i:i + 1000]], ordered=False)
+            cls._database.delete_one({'_id': document['_id']})
+        except PyMongoError as e:
+            cls._log.exception(e)
+            cls._log.warning('The processed series could not be migrated; this will be retried at the next start.')
+
+    @staticmethod
+    def _upsert(series_title):
+        return UpdateOne({'_id': series_title}, {'$setOnInsert': {'processed_date': datetime.utcnow()}}, upsert=True)
+
+
+class UnmatchedSeriesTable(Database):
+    """
+    Series that Anilist could not find, so that their other chapters are not looked up again until ttl seconds have
+    passed. Every entry records a fingerprint of the exceptions.json entry of its series at the time, and is ignored
+    once that entry changes. Entries are kept in memory; MongoDB removes expired documents through a TTL index.
+    """
+    ttl = 86400
+    indexes = [IndexModel([('expires', ASCENDING)], expireAfterSeconds=0)]
+    _entries = {}
+    _lock = Lock()
+
+    @classmethod
+    def initialize(cls):
+        cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
+        cls._database = super()._database['unmatched_series']
+        cls._log.debug(f'{cls.__name__} class has been initialized')
 
     @classmethod
-    def save_while_running(cls):
-        if cls._last_save_time is not None:
-            last_save_delta = (datetime.now() - cls._last_save_time).total_seconds()
+    def load(cls):
+        cls._log.info('Loading unmatched series...')
+        now = datetime.utcnow()
+        with cls._lock:
+            cls._entries = {document['_id']: (document['exception'], document['expires'])
+                            for document in cls._database.find({'expires': {'$gt': now}})}
 
-            # Save every hour
-            if last_save_delta > 3600:
-                cls._last_save_time = datetime.now()
-                cls.save()
+    @classmethod
+    def search(cls, manga_title, format, fingerprint):
+        """
+        Returns whether the series was not found on Anilist recently, with the same exceptions.json entry.
+        """
+        key = cls._key(manga_title, format)
+        with cls._lock:
+            entry = cls._entries.get(key)
+            if entry is None:
+                return False
+            if entry[0] == fingerprint and entry[1] > datetime.utcnow():
+                return True
+            del cls._entries[key]
+
+        cls._delete(key)
+        return False
+
+    @classmethod
+    def insert(cls, manga_title, format, fingerprint, logging_info=None):
+        key = cls._key(manga_title, format)
+        expires = datetime.utcnow() + timedelta(seconds=cls.ttl)
+        with cls._lock:
+            cls._entries[key] = (fingerprint, expires)
+
+        try:
+            cls._database.update_one({'_id': key}, {'$set': {'manga_title': manga_title, 'format': format,
+                                                             'exception': fingerprint, 'expires': expires}},
+                                     upsert=True)
+        except Exception as e:
+            cls._log.exception(e, extra=logging_info)
+
+    @classmethod
+    def _delete(cls, key):
+        try:
+            cls._database.delete_one({'_id': key})
+        except Exception as e:
+            cls._log.exception(e)
+
+    @staticmethod
+    def _key(manga_title, format):
+        return f'{format}:{manga_title}'
 
 
 class TaskQueueTable(Database):
+    """
+    Journal of the chapters Manga Tagger has accepted but not finished yet. Every chapter is recorded as pending when
+    it is queued, as started when a worker picks it up, and its record is removed once it has been processed, so the
+    journal always holds exactly the work that a restart has to resume.
+    """
+    flush_interval = 0.5
+    _writer = None
+
     @classmethod
     def initialize(cls):
         cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
         cls._database = super()._database['task_queue']
         cls.queue = Queue()
+        cls._writer = _BulkWriter(cls._database, cls.__name__, flush_interval=cls.flush_interval)
+        cls._writer.start()
         cls._log.debug(f'{cls.__name__} class has been initialized')
 
     @classmethod
@@ -269,17 +640,258 @@ class TaskQueueTable(Database):
         results = cls._database.find()
 
         if results is not None:
+            legacy_ids = []
             for result in results:
-                task_list[result['manga_chapter']] = result
+                if 'state' not in result:
+                    # Saved by a version that wrote the whole queue on exit; re-key it as a journal record
+                    legacy_ids.append(result.pop('_id'))
+                    key = cls._record_key(result)
+                else:
+                    key = result['_id']
+                # Keyed by path, as chapters of different series may share a file name
+                task_list[key] = result
+
+            if legacy_ids:
+                cls._log.info(f'Migrating {len(legacy_ids)} task(s) saved by a previous version to the journal...')
+                cls._writer.append(*[DeleteOne({'_id': legacy_id}) for legacy_id in legacy_ids])
+
+    @classmethod
+    def record_pending(cls, events):
+        cls._writer.append(*[UpdateOne({'_id': cls._key(event)},
+                                       {'$set': dict(event.dictionary(), state='pending')},
+                                       upsert=True)
+                             for event in events])
+
+    @classmethod
+    def record_started(cls, events):
+        cls._writer.append(*[UpdateOne({'_id': cls._key(event)}, {'$set': {'state': 'started'}})
+                             for event in events])
 
     @classmethod
-    def save(cls, queue):
-        if not queue.empty():
-            cls._log.info('Saving task queue...')
-            while not queue.empty():
-                event = queue.get()
-                super(TaskQueueTable, cls).insert(event.dictionary())
+    def record_completed(cls, events):
+        cls._writer.append(*[DeleteOne({'_id': cls._key(event)}) for event in events])
+
+    @classmethod
+    def flush(cls) -> bool:
+        """
+        Writes the journal records recorded so far, and returns whether all of them have been saved.
+        """
+        return cls._writer.flush()
+
+    @classmethod
+    def close(cls):
+        if cls._writer is not None:
+            cls._writer.stop()
 
     @classmethod
     def delete_all(cls):
         super(TaskQueueTable, cls).delete_all(None)
+
+    @classmethod
+    def _key(cls, event):
+        return str(event.file_path.absolute())
+
+    @classmethod
+    def _record_key(cls, record):
+        # The key _key() gives the event a record was saved from
+        path = record['dest_path'] if record['event_type'] == 'moved' else record['src_path']
+        return str(Path(path).absolute())
+
+
+class _DocumentCache:
+    """
+    Bounded LRU cache of documents by _id, which can also be found by the lookup keys they were stored under. Entries
+    expire ttl seconds after they were stored, and hits and misses are counted. Documents are copied in and out, so
+    callers are free to modify what they get.
+    """
+    def __init__(self, max_entries, ttl, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = Lock()
+        # _id -> (document, time stored, lookup keys)
+        self._documents = OrderedDict()
+        self._keys = {}
+
+    def get(self, key):
+        with self._lock:
+            return self._get(self._keys.get(key))
+
+    def get_by_id(self, document_id):
+        with self._lock:
+            return self._get(document_id)
+
+    def _get(self, document_id):
+        entry = self._documents.get(document_id) if document_id is not None else None
+        if entry is None or self.clock() - entry[1] >= self.ttl:
+            if entry is not None:
+                self._remove(document_id)
+            self.misses += 1
+            return None
+
+        self._documents.move_to_end(document_id)
+        self.hits += 1
+        return copy.deepcopy(entry[0])
+
+    def put(self, document, key=None):
+        if self.max_entries <= 0:
+            return
+
+        document_id = document['_id']
+        with self._lock:
+            keys = self._documents[document_id][2] if document_id in self._documents else set()
+            if key is not None:
+                keys.add(key)
+                self._keys[key] = document_id
+            self._documents[document_id] = (copy.deepcopy(document), self.clock(), keys)
+            self._documents.move_to_end(document_id)
+
+            while len(self._documents) > self.max_entries:
+                self._remove(next(iter(self._documents)))
+
+    def invalidate(self, document_id=None):
+        """
+        Forgets a document, or every document if no _id is given.
+        """
+        with self._lock:
+            if document_id is None:
+                self._documents.clear()
+                self._keys.clear()
+            elif document_id in self._documents:
+                self._remove(document_id)
+
+    def _remove(self, document_id):
+        for key in self._documents.pop(document_id)[2]:
+            if self._keys.get(key) == document_id:
+                del self._keys[key]
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._documents)}
+
+
+class _BulkWriter:
+    """
+    Buffers write operations for a collection and sends them in order with a single bulk_write() once max_operations
+    have been buffered or flush_interval seconds have passed. flushed, if given, is called with the operations that
+    have been saved, and rejected with the operations the server refused.
+
+    When the server rejects an operation, only that operation is dropped and the ones after it are written again. When
+    the connection to the server fails, the operations are put back at the front of the buffer and retried once
+    flush_interval seconds have passed.
+    """
+    def __init__(self, collection, name, max_operations=500, flush_interval=0.5, flushed: Callable = None,
+                 rejected: Callable = None):
+        self._log = logging.getLogger(f'{__name__}.{name}')
+        self.collection = collection
+        self.max_operations = max_operations
+        self.flush_interval = flush_interval
+        self.flushed = flushed
+        self.rejected = rejected
+
+        self._operations = []
+        self._condition = Condition()
+        # Serializes bulk writes so operations on the same document are applied in the order they were buffered
+        self._flush_lock = Lock()
+        self._running = False
+        self._retrying = False
+        self._thread = Thread(target=self._run, name=f'MTT-{name}', daemon=True)
+
+    def start(self):
+        self._running = True
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.flush()
+
+        with self._condition:
+            if self._operations:
+                self._log.warning(f'{len(self._operations)} buffered write(s) could not be saved to the database.')
+
+    def append(self, *operations):
+        if not operations:
+            return
+
+        with self._condition:
+            self._operations.extend(operations)
+            if len(self._operations) >= self.max_operations:
+                self._condition.notify()
+
+    def flush(self) -> bool:
+        """
+        Writes the buffered operations, and returns whether all of them have been saved.
+        """
+        saved = True
+        with self._flush_lock:
+            with self._condition:
+                operations = self._operations
+                self._operations = []
+
+            while operations:
+                try:
+                    self.collection.bulk_write(operations, ordered=True)
+                except BulkWriteError as e:
+                    write_errors = e.details.get('writeErrors') or []
+                    if not write_errors:
+                        # Only the write concern was not satisfied; every operation has been applied
+                        self._log.warning(f'{len(operations)} buffered write(s) were saved, but not acknowledged as '
+                                          f'requested: {e.details.get("writeConcernErrors")}')
+                        self._saved(operations)
+                        return saved
+
+                    # An ordered bulk write stops at the first rejected operation; the ones before it have been saved
+                    index = write_errors[0]['index']
+                    self._log.warning(f'A buffered write could not be saved to the database: '
+                                      f'{write_errors[0].get("errmsg")}')
+                    self._saved(operations[:index])
+                    if self.rejected is not None:
+                        self.rejected(operations[index:index + 1])
+                    operations = operations[index + 1:]
+                    saved = False
+                except ConnectionFailure as e:
+                    self._log.warning(f'{len(operations)} buffered write(s) will be retried: {e}')
+                    with self._condition:
+                        self._operations[:0] = operations
+                        self._retrying = True
+                    return False
+                except Exception as e:
+                    self._log.exception(e)
+                    self._log.warning(f'{len(operations)} buffered write(s) could not be saved to the database.')
+                    return False
+                else:
+                    self._saved(operations)
+                    return saved
+            return saved
+
+    def _saved(self, operations):
+        with self._condition:
+            self._retrying = False
+        if not operations:
+            return
+
+        self._log.debug(f'{len(operations)} buffered write(s) have been saved to the database')
+        if self.flushed is not None:
+            self.flushed(operations)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if self._running and (self._retrying or len(self._operations) < self.max_operations):
+                    self._condition.wait(self.flush_interval)
+                running = self._running
+
+            try:
+                self.flush()
+            except Exception as e:
+                # Never let an unexpected error stop the writes that follow
+                self._log.exception(e)
+            if not running:
+                return
@@ -2,6 +2,7 @@ import logging
 from datetime import datetime
 from pytz import timezone
 
+from MangaTaggerLib.database import MetadataTable
 from MangaTaggerLib.errors import MetadataNotCompleteError
 from MangaTaggerLib.utils import AppSettings, compare
 
@@ -53,6 +54,7 @@ class Metadata:
         self.type = anilist_details['type']
         self.description = anilist_details['description']
         self.anilist_url = anilist_details['siteUrl']
+        self.cover_url = (anilist_details.get('coverImage') or {}).get('extraLarge')
         self.publish_date = None
         self.genres = []
         self.synonyms = []
@@ -64,6 +66,9 @@ class Metadata:
         self._parse_staff(anilist_details['staff']['edges'], logging_info)
 
         self.scrape_date = timezone(AppSettings.timezone).localize(datetime.now()).strftime('%Y-%m-%d %I:%M %p %Z')
+        # Sortable counterpart of scrape_date, used to find the series that are due for a refresh
+        self.scrape_time = datetime.utcnow()
+        self.search_keys = MetadataTable.search_keys(self.__dict__)
 
     def _construct_database_metadata(self, details):
         self._id = details['_id']
@@ -75,12 +80,16 @@ class Metadata:
         self.type = details['type']
         self.description = details['description']
         self.anilist_url = details['anilist_url']
+        # Documents stored before cover URLs were kept have none
+        self.cover_url = details.get('cover_url')
         self.publish_date = details['publish_date']
         self.genres = details['genres']
         self.synonyms = details['synonyms']
         self.staff = details['staff']
         self.publish_date = details['publish_date']
         self.scrape_date = details['scrape_date']
+        self.scrape_time = details.get('scrape_time')
+        self.search_keys = details.get('search_keys')
 
     def _construct_publish_date(self, date):
         if date['month'] == 'None' or date['day'] == 'None' or date['day'] is None or date['month'] is None:
@@ -0,0 +1,162 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List, Optional, Set, Tuple
+
+from watchdog.events import DirDeletedEvent, FileCreatedEvent, FileDeletedEvent
+from watchdog.observers.api import BaseObserver, EventEmitter, DEFAULT_EMITTER_TIMEOUT
+
+
+class DirectoryPollingEmitter(EventEmitter):
+    """
+    Polls a download directory laid out as one directory per series. Each cycle only stats the series directories and
+    lists those whose modification time changed, reading nothing but the names of their .cbz files, where watchdog's
+    PollingEmitter lists and stats the whole tree. Directories nested below the series directories are not watched.
+    """
+    _log = None
+
+    @classmethod
+    def fully_qualified_class_name(cls):
+        return f'{cls.__module__}.{cls.__name__}'
+
+    def __init__(self, event_queue, watch, timeout=DEFAULT_EMITTER_TIMEOUT, workers=4):
+        super().__init__(event_queue, watch, timeout)
+        self._log = logging.getLogger(self.fully_qualified_class_name())
+        self.workers = workers
+        self._executor: ThreadPoolExecutor = None
+
+        # Modification time and chapter names of every directory as of the last cycle
+        self._mtimes: Dict[str, int] = {}
+        self._chapters: Dict[str, Set[str]] = {}
+        # Directories that changed in the last cycle, listed once more in case a file was added within the same
+        # mtime tick right after the listing
+        self._recheck: Set[str] = set()
+
+    def on_thread_start(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='MTT-Poll')
+        self._poll(emit=False)
+
+    def on_thread_stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def queue_events(self, timeout):
+        # The timeout is the polling interval
+        if self.stopped_event.wait(timeout):
+            return
+        if self.should_keep_running():
+            self._poll(emit=True)
+
+    def _poll(self, emit):
+        start = time.perf_counter()
+        root = self.watch.path
+        stat_calls = 0
+        listed = []
+
+        try:
+            root_mtime = os.stat(root).st_mtime_ns
+        except OSError:
+            self.queue_event(DirDeletedEvent(root))
+            self.stop()
+            return
+        stat_calls += 1
+
+        if root_mtime != self._mtimes.get(root) or root in self._recheck:
+            listing = self._list(root)
+            if listing is None:
+                return
+            series_directories, chapters, entries = listing
+            listed.append((root, root_mtime, chapters, entries))
+
+            for directory in set(self._mtimes) - set(series_directories) - {root}:
+                self._forget(directory, emit)
+        else:
+            series_directories = [directory for directory in self._mtimes if directory != root]
+
+        changed = []
+        for directory, mtime in zip(series_directories, self._executor.map(self._stat, series_directories)):
+            stat_calls += 1
+            if mtime is None:
+                self._forget(directory, emit)
+            elif mtime != self._mtimes.get(directory) or directory in self._recheck:
+                changed.append((directory, mtime))
+
+        for (directory, mtime), listing in zip(changed, self._executor.map(self._list, [c[0] for c in changed])):
+            if listing is None:
+                self._forget(directory, emit)
+            else:
+                listed.append((directory, mtime, listing[1], listing[2]))
+
+        recheck = set()
+        for directory, mtime, chapters, _ in listed:
+            if mtime != self._mtimes.get(directory):
+                recheck.add(directory)
+            self._mtimes[directory] = mtime
+            self._update(directory, chapters, emit)
+        self._recheck = recheck
+
+        entries = sum(entry_count for _, _, _, entry_count in listed)
+        message = (f'Poll cycle took {(time.perf_counter() - start) * 1000:.1f}ms: {stat_calls} stat call(s), '
+                   f'{len(listed)} of {len(self._mtimes)} directories listed, {entries} entries read')
+        if listed and emit:
+            self._log.info(message)
+        else:
+            self._log.debug(message)
+
+    def _update(self, directory, chapters: Set[str], emit):
+        previous = self._chapters.get(directory, set())
+        self._chapters[directory] = chapters
+        if not emit:
+            return
+
+        for name in sorted(previous - chapters):
+            self.queue_event(FileDeletedEvent(os.path.join(directory, name)))
+        for name in sorted(chapters - previous):
+            self.queue_event(FileCreatedEvent(os.path.join(directory, name)))
+
+    def _forget(self, directory, emit):
+        self._mtimes.pop(directory, None)
+        self._recheck.discard(directory)
+        chapters = self._chapters.pop(directory, set())
+        if emit:
+            for name in sorted(chapters):
+                self.queue_event(FileDeletedEvent(os.path.join(directory, name)))
+            self.queue_event(DirDeletedEvent(directory))
+
+    @staticmethod
+    def _stat(directory) -> Optional[int]:
+        try:
+            return os.stat(directory).st_mtime_ns
+        except OSError:
+            return None
+
+    @staticmethod
+    def _list(directory) -> Optional[Tuple[List[str], Set[str], int]]:
+        """
+        Returns the subdirectories, .cbz file names and number of entries of a directory.
+        """
+        directories = []
+        chapters = set()
+        entries = 0
+        try:
+            with os.scandir(directory) as iterator:
+                for entry in iterator:
+                    entries += 1
+                    if entry.name.endswith('.cbz'):
+                        chapters.add(entry.name)
+                    elif entry.is_dir():
+                        directories.append(entry.path)
+        except OSError:
+            return None
+        return directories, chapters, entries
+
+
+class DirectoryPollingObserver(BaseObserver):
+    """
+    Observer for download directories on network shares, where inotify-style events are not available.
+    """
+
+    def __init__(self, interval=5, workers=4):
+        super().__init__(emitter_class=partial(DirectoryPollingEmitter, workers=workers), timeout=interval)
@@ -0,0 +1,116 @@
+import logging
+from datetime import datetime, timedelta
+from threading import Event, Thread
+from typing import Callable
+
+from MangaTaggerLib import models
+from MangaTaggerLib.api import AniList, AniListRateLimit, AniListRequestError
+from MangaTaggerLib.database import MetadataTable
+
+
+class MetadataRefresher:
+    """
+    Background thread that keeps manga_metadata up to date. Every interval it refreshes up to series_per_interval of
+    the series that were scraped longest ago, once they are older than max_age. Requests are spaced so that refreshing
+    uses no more than quota_share of the Anilist rate limit, and the thread waits while chapters are queued, so the
+    foreground processing always comes first.
+
+    The titles of a series are not refreshed, as they decide where its chapters are filed in the library.
+    """
+    _log = None
+
+    # Fields that identify a series and its library directory
+    _kept_fields = {'_id', 'search_value', 'series_title'}
+
+    @classmethod
+    def fully_qualified_class_name(cls):
+        return f'{cls.__module__}.{cls.__name__}'
+
+    def __init__(self, busy: Callable[[], bool], interval=3600, series_per_interval=20, max_age=timedelta(days=30),
+                 quota_share=0.1, idle_check=5):
+        self._log = logging.getLogger(self.fully_qualified_class_name())
+        self.busy = busy
+        self.interval = interval
+        self.series_per_interval = series_per_interval
+        self.max_age = max_age
+        self.quota_share = quota_share
+        self.idle_check = idle_check
+
+        self._stopped = Event()
+        self._thread = Thread(target=self._run, name='MTT-Refresh', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def request_spacing(self) -> float:
+        """
+        Returns the seconds between two refresh requests that keep refreshing within its share of the rate limit.
+        """
+        return 60.0 / max(AniList.rate_limiter.limit * self.quota_share, 1e-3)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.refresh_stale()
+            except Exception as e:
+                self._log.exception(e)
+
+    def refresh_stale(self) -> int:
+        """
+        Refreshes the oldest series that are due. Returns the number of series that were refreshed.
+        """
+        cutoff = datetime.utcnow() - self.max_age
+        documents = MetadataTable.search_stale(cutoff, self.series_per_interval)
+        if not documents:
+            return 0
+
+        self._log.info(f'Refreshing the metadata of {len(documents)} series...')
+        refreshed = 0
+        for index, document in enumerate(documents):
+            if index > 0 and self._stopped.wait(self.request_spacing()):
+                break
+            if not self._wait_until_idle():
+                break
+
+            try:
+                if self.refresh(document):
+                    refreshed += 1
+            except (AniListRateLimit, AniListRequestError):
+                self._log.warning('Anilist is unavailable; refreshing will resume at the next interval.')
+                break
+
+        self._log.info(f'Refreshed the metadata of {refreshed} series.')
+        return refreshed
+
+    def refresh(self, document) -> bool:
+        logging_info = {'manga_title': document['series_title']}
+        anilist_details = AniList.search_for_manga_title_by_id(document['_id'], logging_info)
+        if anilist_details is None:
+            self._log.warning(f'"{document["series_title"]}" is no longer on Anilist; keeping its metadata.',
+                              extra=logging_info)
+            # Not looked at again until it is due once more
+            MetadataTable.update({'_id': document['_id']}, {'$set': {'scrape_time': datetime.utcnow()}},
+                                 logging_info)
+            return False
+
+        metadata = models.Metadata(document['search_value'], logging_info, anilist_details)
+        fields = {key: value for key, value in metadata.__dict__.items() if key not in self._kept_fields}
+        # The kept titles must still find the series
+        fields['search_keys'] = MetadataTable.search_keys({key: document.get(key, value)
+                                                           for key, value in metadata.__dict__.items()})
+        MetadataTable.update({'_id': document['_id']}, {'$set': fields}, logging_info)
+        return True
+
+    def _wait_until_idle(self) -> bool:
+        """
+        Waits while chapters are queued. Returns False if the refresher was stopped in the meantime.
+        """
+        while self.busy():
+            if self._stopped.wait(self.idle_check):
+                return False
+        return not self._stopped.is_set()
@@ -0,0 +1,114 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from MangaTaggerLib.database import ProcFilesTable
+
+
+class DownloadScanner:
+    """
+    Finds the chapters in the download directory that still have to be processed. Series directories are listed in
+    parallel with os.scandir(), and the modification time and chapters of every directory are kept in a state file so
+    that later startups only list the directories whose contents changed since. The chapters an unchanged directory
+    held are checked against the task journal and processed_files like listed ones, so a chapter that failed, and left
+    its directory unchanged, is still found again. Without a state path every directory is listed.
+    """
+    _log = None
+
+    @classmethod
+    def fully_qualified_class_name(cls):
+        return f'{cls.__module__}.{cls.__name__}'
+
+    def __init__(self, download_dir: Path, state_path: Optional[Path], workers=8):
+        self._log = logging.getLogger(self.fully_qualified_class_name())
+        self.download_dir = download_dir
+        self.state_path = state_path
+        self.workers = workers
+        self._directory_mtimes: Dict[str, int] = {}
+        self._directory_chapters: Dict[str, List[str]] = {}
+
+    def scan(self, known_paths: Set[str]) -> List[Path]:
+        """
+        Returns the chapters of new or changed series directories that are neither in known_paths nor recorded in
+        processed_files. Call save_state() once they have been queued.
+        """
+        start = time.perf_counter()
+        previous_mtimes, previous_chapters = self._load_state()
+        self._directory_mtimes = {}
+        self._directory_chapters = {}
+
+        changed = []
+        chapters = []
+        with os.scandir(self.download_dir) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    continue
+                # Taken before the directory is listed, so files added during the scan change it again
+                mtime = entry.stat().st_mtime_ns
+                self._directory_mtimes[entry.path] = mtime
+                if previous_mtimes.get(entry.path) != mtime:
+                    changed.append(entry.path)
+                elif entry.path in previous_chapters:
+                    # Unchanged, so it still holds the chapters it held when it was last listed
+                    self._directory_chapters[entry.path] = previous_chapters[entry.path]
+                    chapters.extend(Path(entry.path, name) for name in previous_chapters[entry.path])
+
+        if changed:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='MTT-Scan') as executor:
+                for directory_chapters in executor.map(self._list_chapters, changed):
+                    chapters.extend(directory_chapters)
+
+        chapters = [chapter for chapter in chapters if str(chapter.absolute()) not in known_paths]
+        processed = ProcFilesTable.search_old_filenames([chapter.name for chapter in chapters])
+        for chapter in chapters:
+            if chapter.name in processed:
+                self._log.info(f'"{chapter}" has already been processed and will not be added to the queue')
+        chapters = [chapter for chapter in chapters if chapter.name not in processed]
+
+        self._log.info(f'Scanned {len(changed)} of {len(self._directory_mtimes)} series directories in '
+                       f'{time.perf_counter() - start:.2f}s; {len(chapters)} chapter(s) found')
+        return chapters
+
+    def save_state(self):
+        if self.state_path is None:
+            return
+
+        temporary_path = self.state_path.with_name(f'{self.state_path.name}.tmp')
+        with open(temporary_path, 'w', encoding='utf-8') as state_file:
+            json.dump({'download_dir': str(self.download_dir.absolute()), 'directories': self._directory_mtimes,
+                       'chapters': self._directory_chapters}, state_file)
+        os.replace(temporary_path, self.state_path)
+
+    def _load_state(self) -> Tuple[Dict[str, int], Dict[str, List[str]]]:
+        if self.state_path is None:
+            return {}, {}
+
+        try:
+            with open(self.state_path, encoding='utf-8') as state_file:
+                state = json.load(state_file)
+        except FileNotFoundError:
+            return {}, {}
+        except (OSError, ValueError) as e:
+            self._log.warning(f'Scan state "{self.state_path}" could not be read ({e}); scanning every directory')
+            return {}, {}
+
+        if state.get('download_dir') != str(self.download_dir.absolute()):
+            return {}, {}
+        return state.get('directories', {}), state.get('chapters', {})
+
+    def _list_chapters(self, directory: str) -> List[Path]:
+        try:
+            with os.scandir(directory) as entries:
+                chapters = [Path(entry.path) for entry in entries if entry.name.endswith('.cbz') and entry.is_file()]
+            if chapters:
+                self._directory_chapters[directory] = [chapter.name for chapter in chapters]
+            return chapters
+        except OSError as e:
+            self._log.warning(f'"{directory}" could not be scanned: {e}')
+            # Forget the directory so that the next startup tries again
+            self._directory_mtimes.pop(directory, None)
+            return []
@@ -1,18 +1,25 @@
+import heapq
+import itertools
 import logging
+import math
+import multiprocessing
 import time
 import uuid
-from enum import Enum
+import zlib
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from enum import Enum, IntEnum
 from pathlib import Path
-from queue import Queue
-from threading import Thread
-from typing import List
+from queue import PriorityQueue, Empty
+from threading import Thread, Condition, Lock
+from typing import Callable, Dict, List
 
 from watchdog.events import PatternMatchingEventHandler
 from watchdog.observers import Observer
-from watchdog.observers.polling import PollingObserver
 
 from MangaTaggerLib import MangaTaggerLib
-from MangaTaggerLib.database import TaskQueueTable
+from MangaTaggerLib.database import ProcFilesTable, TaskQueueTable
+from MangaTaggerLib.polling import DirectoryPollingObserver
 
 
 class QueueEventOrigin(Enum):
@@ -21,6 +28,17 @@ class QueueEventOrigin(Enum):
     SCAN = 3
 
 
+class EventPriority(IntEnum):
+    # The series is already in manga_metadata, so the chapter only needs local work
+    CACHED = 0
+    # The series has to be looked up on Anilist first
+    NETWORK = 1
+
+
+# Sorts after every event so that workers only stop once their queue is empty
+_SHUTDOWN_PRIORITY = max(EventPriority) + 1
+
+
 class QueueEvent:
     def __init__(self, event, origin=QueueEventOrigin.WATCHDOG):
         if origin == QueueEventOrigin.WATCHDOG:
@@ -41,6 +59,19 @@ class QueueEvent:
             self.event_type = 'existing'
             self.src_path = event
 
+    @property
+    def file_path(self) -> Path:
+        if self.event_type == 'moved':
+            return self.dest_path
+        return self.src_path
+
+    @property
+    def series_title(self) -> str:
+        # Same split as filename_parser(); fall back to the directory name for unparsable filenames
+        if ' -.- ' in self.file_path.name:
+            return self.file_path.name.split(' -.- ')[0].strip()
+        return self.file_path.parent.name
+
     def __str__(self):
         if self.event_type in ('created', 'existing'):
             return f'File {self.event_type} event at {self.src_path.absolute()}'
@@ -51,7 +82,7 @@ class QueueEvent:
         ret_dict = {
             'event_type': self.event_type,
             'src_path': str(self.src_path.absolute()),
-            'manga_chapter': str(self.src_path.name.strip('.cbz'))
+            'manga_chapter': self.src_path.stem
         }
 
         try:
@@ -62,8 +93,185 @@ class QueueEvent:
         return ret_dict
 
 
+class _SettlingEntry:
+    __slots__ = ('event', 'path', 'size', 'mtime', 'rounds', 'cancelled')
+
+    def __init__(self, event, path, size, mtime):
+        self.event = event
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.rounds = 0
+        self.cancelled = False
+
+
+class FileSettler:
+    """
+    Holds files that may still be written to until their size and modification time stop changing, then hands them to
+    the worker queues. Every pending file is tracked in a single timer wheel serviced by one thread, so a slow copy
+    never occupies a worker thread.
+    """
+    _log = None
+
+    @classmethod
+    def fully_qualified_class_name(cls):
+        return f'{cls.__module__}.{cls.__name__}'
+
+    def __init__(self, release: Callable[[QueueEvent], None], settle_interval=1.0, tick=0.25, slots=64):
+        self._log = logging.getLogger(self.fully_qualified_class_name())
+        self.release = release
+        self.settle_interval = settle_interval
+        self.tick = tick
+
+        self._wheel: List[List[_SettlingEntry]] = [[] for _ in range(slots)]
+        self._cursor = 0
+        self._next_tick = 0.0
+        self._entries: Dict[Path, _SettlingEntry] = {}
+        self._condition = Condition()
+        self._running = False
+        self._thread = Thread(target=self._run, name='MTT-Settler', daemon=True)
+
+    def start(self):
+        self._running = True
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def add(self, event):
+        path = event.file_path
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            self._log.warning(f'"{path}" no longer exists; it will not be processed')
+            return
+
+        with self._condition:
+            if path in self._entries:
+                self._log.debug(f'"{path}" is already waiting for its size to settle')
+                return
+
+            if not self._entries:
+                # The wheel was idle, so restart the clock from now
+                self._next_tick = time.monotonic() + self.tick
+                self._condition.notify()
+
+            entry = _SettlingEntry(event, path, stat.st_size, stat.st_mtime)
+            self._entries[path] = entry
+            self._schedule(entry)
+        self._log.debug(f'"{path}" is waiting for its size to settle')
+
+    def mark_stable(self, path: Path):
+        """
+        Releases a pending file immediately, e.g. once the writer has closed it.
+        """
+        with self._condition:
+            entry = self._entries.pop(path, None)
+            if entry is None:
+                return
+            entry.cancelled = True
+
+        self._log.debug(f'"{path}" was closed by its writer')
+        self._release(entry)
+
+    def pending(self):
+        """
+        Removes and returns the events of every file that has not settled yet.
+        """
+        with self._condition:
+            events = [entry.event for entry in self._entries.values()]
+            for entry in self._entries.values():
+                entry.cancelled = True
+            self._entries.clear()
+        return events
+
+    def _schedule(self, entry):
+        ticks = max(1, math.ceil(self.settle_interval / self.tick))
+        entry.rounds = (ticks - 1) // len(self._wheel)
+        self._wheel[(self._cursor + ticks) % len(self._wheel)].append(entry)
+
+    def _advance(self):
+        self._cursor = (self._cursor + 1) % len(self._wheel)
+        slot = self._wheel[self._cursor]
+
+        due = []
+        remaining = []
+        for entry in slot:
+            if entry.cancelled:
+                continue
+            if entry.rounds > 0:
+                entry.rounds -= 1
+                remaining.append(entry)
+            else:
+                due.append(entry)
+        self._wheel[self._cursor] = remaining
+        return due
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and not self._entries:
+                    # Nothing to watch; sleep until add() or stop() wakes the thread
+                    self._condition.wait()
+
+                if not self._running:
+                    return
+
+                timeout = self._next_tick - time.monotonic()
+                if timeout > 0:
+                    self._condition.wait(timeout)
+                    continue
+
+                self._next_tick += self.tick
+                due = self._advance()
+
+            for entry in due:
+                self._check(entry)
+
+    def _check(self, entry):
+        try:
+            stat = entry.path.stat()
+        except FileNotFoundError:
+            with self._condition:
+                if self._entries.get(entry.path) is entry:
+                    del self._entries[entry.path]
+            self._log.warning(f'"{entry.path}" was removed before it finished writing; it will not be processed')
+            return
+
+        with self._condition:
+            if entry.cancelled:
+                return
+
+            if stat.st_size != entry.size or stat.st_mtime != entry.mtime:
+                entry.size = stat.st_size
+                entry.mtime = stat.st_mtime
+                self._schedule(entry)
+                return
+
+            del self._entries[entry.path]
+
+        self._release(entry)
+
+    def _release(self, entry):
+        self._log.info(f'"{entry.path}" has finished writing and will be added to the queue')
+        self.release(entry.event)
+
+
 class QueueWorker:
-    _queue: Queue = None
+    _queues: List[PriorityQueue] = None
+    _sequence = itertools.count()
+    _depths: Counter = None
+    _depth_lock: Lock = None
+    # Priority, number of events and worker queue index of every series with events queued or being processed, by
+    # casefolded title
+    _queued_series: Dict[str, list] = None
+    _process_pool: ProcessPoolExecutor = None
+    _engine = None
+    _settler: FileSettler = None
     _observer: Observer = None
     _log: logging = None
     _worker_list: List[Thread] = None
@@ -72,58 +280,245 @@ class QueueWorker:
 
     max_queue_size = None
     threads = None
+    processes = 0
+    engine = 'threads'
+    async_concurrency = 64
+    batch_size = 100
+    settle_interval = 1
     is_library_network_path = False
+    poll_interval = 5
+    poll_workers = 4
     download_dir: Path = None
+    speculative_prefetch = True
     task_list = {}
 
     @classmethod
     def initialize(cls):
         cls._log = logging.getLogger(f'{cls.__module__}.{cls.__name__}')
-        cls._queue = Queue(maxsize=cls.max_queue_size)
+        cls._settler = FileSettler(cls.enqueue, cls.settle_interval)
         cls._worker_list = []
         cls._running = True
+        cls._depths = Counter()
+        cls._depth_lock = Lock()
+        cls._queued_series = {}
+
+        if cls.engine == 'asyncio':
+            # Imported here so that aiohttp is only needed by the asyncio engine
+            from MangaTaggerLib.async_engine import AsyncEngine
+
+            # Threads are only used for disk work, so the queue is shared by the event loop's consumers
+            cls._queues = []
+            cls._engine = AsyncEngine(cls.async_concurrency, cls.max_queue_size, cls.threads, cls._dequeued,
+                                      TaskQueueTable.record_started, cls._completed)
+        else:
+            cls._engine = None
+            # Each worker owns a queue so that chapters of the same series always land on the same worker
+            cls._queues = [PriorityQueue(maxsize=math.ceil(cls.max_queue_size / cls.threads))
+                           for _ in range(cls.threads)]
 
-        for i in range(cls.threads):
+        for i in range(len(cls._queues)):
             if not cls._debug_mode:
-                worker = Thread(target=cls.process, name=f'MTT-{i}', daemon=True)
+                worker = Thread(target=cls.process, args=(cls._queues[i],), name=f'MTT-{i}', daemon=True)
             else:
-                worker = Thread(target=cls.dummy_process, name=f'MTT-{i}', daemon=True)
+                worker = Thread(target=cls.dummy_process, args=(cls._queues[i],), name=f'MTT-{i}', daemon=True)
             cls._log.debug(f'Worker thread {worker.name} has been initialized')
             cls._worker_list.append(worker)
 
+        # CPU-bound tagging runs in worker processes when configured, so it is not limited by the GIL
+        if cls.processes > 0:
+            cls._process_pool = ProcessPoolExecutor(max_workers=cls.processes,
+                                                    mp_context=multiprocessing.get_context('spawn'))
+            cls._log.debug(f'Process pool with {cls.processes} processes has been initialized')
+        else:
+            cls._process_pool = None
+
         if cls.is_library_network_path:
-            cls._observer = PollingObserver()
+            cls._observer = DirectoryPollingObserver(cls.poll_interval, cls.poll_workers)
+            cls._log.debug(f'Polling "{cls.download_dir}" every {cls.poll_interval}s')
         else:
             cls._observer = Observer()
 
-        cls._observer.schedule(SeriesHandler(cls._queue), cls.download_dir, True)
+        # The series of a new download directory is looked up while its first chapter is still settling
+        prefetch = MangaTaggerLib.prefetch_chapter_series if cls.speculative_prefetch else None
+        cls._observer.schedule(SeriesHandler(cls._settler, prefetch), cls.download_dir, True)
 
     @classmethod
     def load_task_queue(cls):
+        """
+        Replays the journal of chapters that were queued or being processed when Manga Tagger last stopped.
+        """
         TaskQueueTable.load(cls.task_list)
 
         for task in cls.task_list.values():
             event = QueueEvent(task, QueueEventOrigin.FROM_DB)
-            cls._log.info(f'{event} has been added to the task queue')
-            cls._queue.put(event)
+            if not event.file_path.exists():
+                cls._log.info(f'"{event.file_path}" no longer exists and has been removed from the task queue')
+                TaskQueueTable.record_completed([event])
+                continue
 
-        TaskQueueTable.delete_all()
+            if task.get('state') == 'started':
+                cls._log.info(f'{event} was interrupted and will be processed again')
+            cls._log.info(f'{event} has been added to the task queue')
+            cls._settler.add(event)
 
     @classmethod
     def save_task_queue(cls):
-        TaskQueueTable.save(cls._queue)
-        with cls._queue.mutex:
-            cls._queue.queue.clear()
+        """
+        Empties the task queue. Queued chapters are already in the journal, so only the files that are still settling
+        have to be recorded before the journal is flushed.
+        """
+        TaskQueueTable.record_pending(cls._settler.pending())
+
+        for queue in cls._queues:
+            while True:
+                try:
+                    priority, _, event = queue.get_nowait()
+                except Empty:
+                    break
+                cls._dequeued(priority)
+                cls._released([event])
+                queue.task_done()
+
+        if cls._engine is not None:
+            cls._released(cls._engine.drain())
+
+        TaskQueueTable.flush()
+
+    @classmethod
+    def enqueue(cls, event: QueueEvent):
+        priority, worker_index = cls._classify(event)
+        with cls._depth_lock:
+            cls._depths[priority] += 1
+
+        TaskQueueTable.record_pending([event])
+        if cls._engine is not None:
+            cls._engine.put((priority, next(cls._sequence), event))
+        else:
+            cls._queues[worker_index].put((priority, next(cls._sequence), event))
+        cls._log.debug(f'"{event.file_path}" has been queued as {priority.name}; queue depths: {cls.queue_depths()}')
+
+    @classmethod
+    def _classify(cls, event: QueueEvent):
+        """
+        Returns the priority class of an event and the index of the worker queue it goes to, which is None for the
+        asyncio engine. Chapters of a series that already has events queued or being processed share its class and
+        worker, so the database is only consulted once per series and a series is never split across workers. A new
+        series that needs Anilist goes to the worker its title hashes to, while a cached series goes to the least
+        loaded worker, so that its chapters do not wait behind the lookup of another series.
+        """
+        series_key = event.series_title.casefold()
+        with cls._depth_lock:
+            queued = cls._queued_series.get(series_key)
+            if queued is not None:
+                queued[1] += 1
+                return queued[0], queued[2]
+
+        priority = EventPriority.NETWORK
+        try:
+            if MangaTaggerLib.is_series_cached(event.series_title):
+                priority = EventPriority.CACHED
+        except Exception as e:
+            cls._log.exception(e)
+
+        worker_index = None
+        if cls._queues:
+            if priority == EventPriority.CACHED:
+                worker_index = cls._least_loaded_worker()
+            else:
+                worker_index = cls._worker_index(event)
+
+        with cls._depth_lock:
+            queued = cls._queued_series.setdefault(series_key, [priority, 0, worker_index])
+            queued[1] += 1
+            return queued[0], queued[2]
+
+    @classmethod
+    def _dequeued(cls, priority):
+        with cls._depth_lock:
+            cls._depths[priority] -= 1
+
+    @classmethod
+    def _completed(cls, events: List[QueueEvent]):
+        TaskQueueTable.record_completed(events)
+        cls._released(events)
+
+    @classmethod
+    def _released(cls, events: List[QueueEvent]):
+        # A series is classified again, and may go to another worker, once none of its events are queued or processed
+        with cls._depth_lock:
+            for event in events:
+                series_key = event.series_title.casefold()
+                queued = cls._queued_series.get(series_key)
+                if queued is not None:
+                    queued[1] -= 1
+                    if queued[1] <= 0:
+                        del cls._queued_series[series_key]
+
+    @classmethod
+    def queue_depths(cls) -> Dict[str, int]:
+        """
+        Returns the number of queued events per priority class.
+        """
+        with cls._depth_lock:
+            return {priority.name.lower(): cls._depths[priority] for priority in EventPriority}
+
+    @classmethod
+    def busy(cls) -> bool:
+        """
+        Returns whether chapters are waiting to be processed.
+        """
+        return any(cls.queue_depths().values())
+
+    @classmethod
+    def _least_loaded_worker(cls):
+        # Events still waiting in a queue or being processed by its worker
+        return min(range(len(cls._queues)), key=lambda i: cls._queues[i].unfinished_tasks)
+
+    @classmethod
+    def _worker_index(cls, event: QueueEvent):
+        series_key = event.series_title.casefold().encode('utf-8')
+        return zlib.crc32(series_key) % len(cls._queues)
+
+    @classmethod
+    def join(cls):
+        """
+        Blocks until every queued event has been processed.
+        """
+        if cls._engine is not None:
+            cls._engine.join()
+
+        for queue in cls._queues:
+            queue.join()
+
+    @classmethod
+    def run_cpu_bound(cls, function, *args):
+        """
+        Runs a CPU-bound function in the process pool if one is configured, otherwise in the calling thread. The
+        function and its arguments must be picklable.
+        """
+        if cls._process_pool is None:
+            return function(*args)
+        return cls._process_pool.submit(function, *args).result()
 
     @classmethod
     def add_to_task_queue(cls, manga_chapter):
         event = QueueEvent(manga_chapter, QueueEventOrigin.SCAN)
         cls._log.info(f'{event} has been added to the task queue')
-        cls._queue.put(event)
+        # Journaled right away, as the startup scan will not list this directory again unless it changes
+        TaskQueueTable.record_pending([event])
+        cls._settler.add(event)
+
+    @classmethod
+    def journaled_paths(cls):
+        """
+        Returns the paths of the chapters that were loaded from the task journal.
+        """
+        return {str(QueueEvent(task, QueueEventOrigin.FROM_DB).file_path.absolute())
+                for task in cls.task_list.values()}
 
     @classmethod
     def exit(cls):
-        # Stop worker threads from picking new items from the queue in process()
+        # Stop the main loop in run()
         cls._log.info('Stopping processing...')
         cls._running = False
 
@@ -132,20 +527,43 @@ class QueueWorker:
         cls._observer.stop()
         cls._observer.join()
 
+        # Stop handing settled files to the workers
+        cls._settler.stop()
+
         # Save and empty task queue
         cls.save_task_queue()
 
-        # Finish current running jobs and stop worker threads
+        # Finish current running jobs and stop worker threads; each worker exits once it pulls a sentinel
         cls._log.info('Stopping worker threads...')
+        for queue in cls._queues:
+            queue.put((_SHUTDOWN_PRIORITY, next(cls._sequence), None))
+
         for worker in cls._worker_list:
             worker.join()
             cls._log.debug(f'Worker thread {worker.name} has been shut down')
 
+        if cls._engine is not None:
+            cls._log.debug('Stopping event loop...')
+            cls._engine.stop(lambda: (_SHUTDOWN_PRIORITY, next(cls._sequence), None))
+            cls._engine = None
+
+        if cls._process_pool is not None:
+            cls._log.debug('Stopping process pool...')
+            cls._process_pool.shutdown()
+            cls._process_pool = None
+
+        # Write the records of the chapters processed last
+        ProcFilesTable.flush()
+
     @classmethod
     def run(cls):
         for worker in cls._worker_list:
             worker.start()
 
+        if cls._engine is not None:
+            cls._engine.start()
+
+        cls._settler.start()
         cls._observer.start()
 
         cls._log.info(f'Watching "{cls.download_dir}" for new downloads')
@@ -154,49 +572,85 @@ class QueueWorker:
             time.sleep(1)
 
     @classmethod
-    def dummy_process(cls):
+    def dummy_process(cls, queue: PriorityQueue):
         pass
 
     @classmethod
-    def process(cls):
-        while cls._running:
-            if not cls._queue.empty():
-                event = cls._queue.get()
-
-                if event.event_type in ('created', 'existing'):
-                    cls._log.info(f'Pulling "file {event.event_type}" event from the queue for "{event.src_path}"')
-                    path = Path(event.src_path)
-                elif event.event_type == 'moved':
-                    cls._log.info(f'Pulling "file {event.event_type}" event from the queue for "{event.dest_path}"')
-                    path = Path(event.dest_path)
+    def process(cls, queue: PriorityQueue):
+        while True:
+            # Block until an event is available instead of polling the queue
+            priority, _, event = queue.get()
+
+            # A shutdown sentinel is queued once per worker by exit()
+            if event is None:
+                queue.task_done()
+                break
+
+            cls._dequeued(priority)
+            batch = [event] + cls._take_series_batch(queue, event)
+
+            try:
+                cls._process_events(batch)
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    @classmethod
+    def _take_series_batch(cls, queue: PriorityQueue, event: QueueEvent):
+        """
+        Removes up to batch_size - 1 queued events of the same series as the given event from the queue.
+        """
+        series_key = event.series_title.casefold()
+        taken = []
+        kept = []
+
+        with queue.mutex:
+            for item in queue.queue:
+                if len(taken) < cls.batch_size - 1 and item[2] is not None \
+                        and item[2].series_title.casefold() == series_key:
+                    taken.append(item)
                 else:
-                    cls._log.error('Event was passed, but Manga Tagger does not know how to handle it. Please open an '
-                                   'issue for further investigation.')
-                    cls._queue.task_done()
-                    return
+                    kept.append(item)
 
-                current_size = -1
-                try:
-                    destination_size = path.stat().st_size
-                    while current_size != destination_size:
-                        current_size = destination_size
-                        time.sleep(1)
-                except FileNotFoundError as fnfe:
-                    cls._log.exception(fnfe)
+            if taken:
+                heapq.heapify(kept)
+                queue.queue[:] = kept
+                queue.not_full.notify(len(taken))
 
-                try:
-                    MangaTaggerLib.process_manga_chapter(path, uuid.uuid1())
-                except Exception as e:
-                    cls._log.exception(e)
-                    cls._log.warning('Manga Tagger is unfamiliar with this error. Please log an issue for '
-                                     'investigation.')
+        taken.sort()
+        for priority, _, _ in taken:
+            cls._dequeued(priority)
+        return [item[2] for item in taken]
+
+    @classmethod
+    def _process_events(cls, events: List[QueueEvent]):
+        chapters = []
+        for event in events:
+            if event.event_type in ('created', 'existing', 'moved'):
+                cls._log.info(f'Pulling "file {event.event_type}" event from the queue for "{event.file_path}"')
+                chapters.append((Path(event.file_path), uuid.uuid1()))
+            else:
+                cls._log.error('Event was passed, but Manga Tagger does not know how to handle it. Please open an '
+                               'issue for further investigation.')
+
+        # Files only reach the queue once FileSettler has seen them stop changing
+        TaskQueueTable.record_started(events)
+        try:
+            MangaTaggerLib.process_manga_batch(chapters)
+        except Exception as e:
+            cls._log.exception(e)
+            cls._log.warning('Manga Tagger is unfamiliar with this error. Please log an issue for '
+                             'investigation.')
+        finally:
+            cls._completed(events)
 
-                cls._queue.task_done()
-            time.sleep(1)
 
 class SeriesHandler(PatternMatchingEventHandler):
     _log = None
 
+    # Download directories remembered so that their series is only prefetched once
+    max_prefetched_dirs = 1024
+
     @classmethod
     def class_name(cls):
         return cls.__name__
@@ -205,24 +659,53 @@ class SeriesHandler(PatternMatchingEventHandler):
     def fully_qualified_class_name(cls):
         return f'{cls.__module__}.{cls.__name__}'
 
-    def __init__(self, queue):
+    def __init__(self, settler: FileSettler, prefetch: Callable[[Path], None] = None):
         self._log = logging.getLogger(self.fully_qualified_class_name())
         super().__init__(patterns=['*.cbz'])
-        self.queue = queue
+        self.settler = settler
+        self.prefetch = prefetch
+        self._prefetched_dirs = OrderedDict()
         self._log.debug(f'{self.class_name()} class has been initialized')
 
     def on_created(self, event):
         self._log.debug(f'Event Type: {event.event_type}')
         self._log.debug(f'Event Path: {event.src_path}')
 
-        self.queue.put(QueueEvent(event, QueueEventOrigin.WATCHDOG))
+        self.settler.add(QueueEvent(event, QueueEventOrigin.WATCHDOG))
         self._log.info(f'Creation event for "{event.src_path}" will be added to the queue')
 
+        if self.prefetch is not None:
+            self._prefetch(Path(event.src_path))
+
+    def _prefetch(self, file_path: Path):
+        """
+        Starts looking up the series of the first chapter of a download directory, in the background so that events
+        keep being handled.
+        """
+        directory = file_path.parent
+        if directory in self._prefetched_dirs:
+            self._prefetched_dirs.move_to_end(directory)
+            return
+
+        self._prefetched_dirs[directory] = None
+        if len(self._prefetched_dirs) > self.max_prefetched_dirs:
+            self._prefetched_dirs.popitem(last=False)
+
+        self._log.debug(f'Prefetching the series of "{directory.name}"')
+        Thread(target=self.prefetch, args=(file_path,), name='MTT-Prefetch', daemon=True).start()
+
+    def on_closed(self, event):
+        self._log.debug(f'Event Type: {event.event_type}')
+        self._log.debug(f'Event Path: {event.src_path}')
+
+        # Only emitted where the platform reports close-after-write (inotify), so the file is complete
+        self.settler.mark_stable(Path(event.src_path))
+
     def on_moved(self, event):
         self._log.debug(f'Event Type: {event.event_type}')
         self._log.debug(f'Event Source Path: {event.src_path}')
         self._log.debug(f'Event Destination Path: {event.dest_path}')
 
         if Path(event.src_path) == Path(event.dest_path) and '-.-' in event.dest_path:
-            self.queue.put(QueueEvent(event, QueueEventOrigin.WATCHDOG))
+            self.settler.add(QueueEvent(event, QueueEventOrigin.WATCHDOG))
         self._log.info(f'Moved event for "{event.dest_path}" will be added to the queue')
@@ -5,14 +5,19 @@ import subprocess
 import sys
 import os
 
+from datetime import timedelta
 from logging.handlers import RotatingFileHandler, SocketHandler
 from pathlib import Path
 
 from pythonjsonlogger import jsonlogger
 
-from MangaTaggerLib.database import Database
+from MangaTaggerLib import MangaTaggerLib
+from MangaTaggerLib.database import Database, MetadataTable, TaskQueueTable, UnmatchedSeriesTable
 from MangaTaggerLib.task_queue import QueueWorker
 from MangaTaggerLib.api import AniList
+from MangaTaggerLib.cache import ResponseCache
+from MangaTaggerLib.refresh import MetadataRefresher
+from MangaTaggerLib.scanner import DownloadScanner
 
 
 class AppSettings:
@@ -27,6 +32,8 @@ class AppSettings:
     library_dir = None
     data_dir = None
     is_network_path = None
+    scan_workers = 8
+    refresher = None
 
     processed_series = None
 
@@ -58,9 +65,21 @@ class AppSettings:
                 settings['database']['auth_source'] = os.getenv("MANGA_TAGGER_DB_AUTH_SOURCE")
             if os.getenv("MANGA_TAGGER_DB_SELECTION_TIMEOUT") is not None:
                 settings['database']['server_selection_timeout_ms'] = int(os.getenv("MANGA_TAGGER_DB_SELECTION_TIMEOUT"))
+            if os.getenv("MANGA_TAGGER_DB_METADATA_CACHE_SIZE") is not None:
+                settings['database']['metadata_cache_size'] = int(os.getenv("MANGA_TAGGER_DB_METADATA_CACHE_SIZE"))
+            if os.getenv("MANGA_TAGGER_DB_METADATA_CACHE_TTL") is not None:
+                settings['database']['metadata_cache_ttl'] = float(os.getenv("MANGA_TAGGER_DB_METADATA_CACHE_TTL"))
 
             if os.getenv("MANGA_TAGGER_DOWNLOAD_DIR") is not None:
                 settings['application']['library']['download_dir'] = os.getenv("MANGA_TAGGER_DOWNLOAD_DIR")
+            if os.getenv("MANGA_TAGGER_SETTLE_INTERVAL") is not None:
+                settings['application']['library']['settle_interval'] = float(os.getenv("MANGA_TAGGER_SETTLE_INTERVAL"))
+            if os.getenv("MANGA_TAGGER_SCAN_WORKERS") is not None:
+                settings['application']['library']['scan_workers'] = int(os.getenv("MANGA_TAGGER_SCAN_WORKERS"))
+            if os.getenv("MANGA_TAGGER_POLL_INTERVAL") is not None:
+                settings['application']['library']['poll_interval'] = float(os.getenv("MANGA_TAGGER_POLL_INTERVAL"))
+            if os.getenv("MANGA_TAGGER_POLL_WORKERS") is not None:
+                settings['application']['library']['poll_workers'] = int(os.getenv("MANGA_TAGGER_POLL_WORKERS"))
 
             if os.getenv("MANGA_TAGGER_DATA_DIR") is not None:
                 settings['application']['data_dir'] = os.getenv("MANGA_TAGGER_DATA_DIR")
@@ -91,8 +110,16 @@ class AppSettings:
 
             if os.getenv("MANGA_TAGGER_THREADS") is not None:
                 settings['application']['multithreading']['threads'] = int(os.getenv("MANGA_TAGGER_THREADS"))
+            if os.getenv("MANGA_TAGGER_PROCESSES") is not None:
+                settings['application']['multithreading']['processes'] = int(os.getenv("MANGA_TAGGER_PROCESSES"))
             if os.getenv("MANGA_TAGGER_MAX_QUEUE_SIZE") is not None:
                 settings['application']['multithreading']['max_queue_size'] = int(os.getenv("MANGA_TAGGER_MAX_QUEUE_SIZE"))
+            if os.getenv("MANGA_TAGGER_BATCH_SIZE") is not None:
+                settings['application']['multithreading']['batch_size'] = int(os.getenv("MANGA_TAGGER_BATCH_SIZE"))
+            if os.getenv("MANGA_TAGGER_ENGINE") is not None:
+                settings['application']['multithreading']['engine'] = os.getenv("MANGA_TAGGER_ENGINE").lower()
+            if os.getenv("MANGA_TAGGER_ASYNC_CONCURRENCY") is not None:
+                settings['application']['multithreading']['async_concurrency'] = int(os.getenv("MANGA_TAGGER_ASYNC_CONCURRENCY"))
 
             if os.getenv("MANGA_TAGGER_DEBUG_MODE") is not None:
                 if os.getenv("MANGA_TAGGER_DEBUG_MODE").lower() == 'true':
@@ -117,6 +144,44 @@ class AppSettings:
                 elif os.getenv("MANGA_TAGGER_ADULT_RESULT").lower() == 'false':
                     settings['application']['adult_result'] = False
 
+            if os.getenv("MANGA_TAGGER_ANILIST_URL") is not None:
+                settings['application'].setdefault('anilist', {})['url'] = os.getenv("MANGA_TAGGER_ANILIST_URL")
+            if os.getenv("MANGA_TAGGER_ANILIST_POOL_SIZE") is not None:
+                settings['application'].setdefault('anilist', {})['pool_size'] = int(os.getenv("MANGA_TAGGER_ANILIST_POOL_SIZE"))
+            if os.getenv("MANGA_TAGGER_ANILIST_CONNECT_TIMEOUT") is not None:
+                settings['application'].setdefault('anilist', {})['connect_timeout'] = float(os.getenv("MANGA_TAGGER_ANILIST_CONNECT_TIMEOUT"))
+            if os.getenv("MANGA_TAGGER_ANILIST_READ_TIMEOUT") is not None:
+                settings['application'].setdefault('anilist', {})['read_timeout'] = float(os.getenv("MANGA_TAGGER_ANILIST_READ_TIMEOUT"))
+            if os.getenv("MANGA_TAGGER_ANILIST_RATE_LIMIT") is not None:
+                settings['application'].setdefault('anilist', {})['rate_limit'] = int(os.getenv("MANGA_TAGGER_ANILIST_RATE_LIMIT"))
+            if os.getenv("MANGA_TAGGER_ANILIST_BATCH_SIZE") is not None:
+                settings['application'].setdefault('anilist', {})['batch_size'] = int(os.getenv("MANGA_TAGGER_ANILIST_BATCH_SIZE"))
+            if os.getenv("MANGA_TAGGER_ANILIST_CACHE_TTL_HOURS") is not None:
+                settings['application'].setdefault('anilist', {})['cache_ttl_hours'] = float(os.getenv("MANGA_TAGGER_ANILIST_CACHE_TTL_HOURS"))
+            if os.getenv("MANGA_TAGGER_ANILIST_CACHE_SIZE_MB") is not None:
+                settings['application'].setdefault('anilist', {})['cache_size_mb'] = float(os.getenv("MANGA_TAGGER_ANILIST_CACHE_SIZE_MB"))
+            if os.getenv("MANGA_TAGGER_ANILIST_UNMATCHED_TTL_HOURS") is not None:
+                settings['application'].setdefault('anilist', {})['unmatched_ttl_hours'] = float(os.getenv("MANGA_TAGGER_ANILIST_UNMATCHED_TTL_HOURS"))
+            if os.getenv("MANGA_TAGGER_ANILIST_SPECULATIVE_PREFETCH") is not None:
+                if os.getenv("MANGA_TAGGER_ANILIST_SPECULATIVE_PREFETCH").lower() == 'true':
+                    settings['application'].setdefault('anilist', {})['speculative_prefetch'] = True
+                elif os.getenv("MANGA_TAGGER_ANILIST_SPECULATIVE_PREFETCH").lower() == 'false':
+                    settings['application'].setdefault('anilist', {})['speculative_prefetch'] = False
+
+            if os.getenv("MANGA_TAGGER_REFRESH_ENABLED") is not None:
+                if os.getenv("MANGA_TAGGER_REFRESH_ENABLED").lower() == 'true':
+                    settings['application'].setdefault('refresh', {})['enabled'] = True
+                elif os.getenv("MANGA_TAGGER_REFRESH_ENABLED").lower() == 'false':
+                    settings['application'].setdefault('refresh', {})['enabled'] = False
+            if os.getenv("MANGA_TAGGER_REFRESH_INTERVAL_MINUTES") is not None:
+                settings['application'].setdefault('refresh', {})['interval_minutes'] = float(os.getenv("MANGA_TAGGER_REFRESH_INTERVAL_MINUTES"))
+            if os.getenv("MANGA_TAGGER_REFRESH_SERIES_PER_INTERVAL") is not None:
+                settings['application'].setdefault('refresh', {})['series_per_interval'] = int(os.getenv("MANGA_TAGGER_REFRESH_SERIES_PER_INTERVAL"))
+            if os.getenv("MANGA_TAGGER_REFRESH_MAX_AGE_DAYS") is not None:
+                settings['application'].setdefault('refresh', {})['max_age_days'] = float(os.getenv("MANGA_TAGGER_REFRESH_MAX_AGE_DAYS"))
+            if os.getenv("MANGA_TAGGER_REFRESH_QUOTA_SHARE") is not None:
+                settings['application'].setdefault('refresh', {})['quota_share'] = float(os.getenv("MANGA_TAGGER_REFRESH_QUOTA_SHARE"))
+
             if os.getenv("MANGA_TAGGER_LIBRARY_DIR") is not None:
                 settings['application']['library']['dir'] = os.getenv("MANGA_TAGGER_LIBRARY_DIR")
 
@@ -167,6 +232,12 @@ class AppSettings:
         Database.auth_source = settings['database']['auth_source']
         Database.server_selection_timeout_ms = settings['database']['server_selection_timeout_ms']
 
+        # Series looked up recently are kept in memory, so each chapter of a known series does not query the database
+        if settings['database'].get('metadata_cache_size') is not None:
+            MetadataTable.cache_size = max(0, settings['database']['metadata_cache_size'])
+        if settings['database'].get('metadata_cache_ttl') is not None:
+            MetadataTable.cache_ttl = settings['database']['metadata_cache_ttl']
+
         cls._log.debug('Database settings configured!')
         Database.initialize()
         Database.print_debug_settings()
@@ -180,6 +251,30 @@ class AppSettings:
                 cls.download_dir.mkdir()
             QueueWorker.download_dir = cls.download_dir
             cls._log.info(f'Download directory has been set as "{QueueWorker.download_dir}"')
+
+            # Time a new file's size must stay unchanged before it is processed
+            if settings['application']['library'].get('settle_interval') is not None:
+                QueueWorker.settle_interval = settings['application']['library']['settle_interval']
+            cls._log.debug(f'Settle Interval: {QueueWorker.settle_interval}')
+
+            # Look up the series of a new download directory while its first chapter is still settling
+            if settings['application'].get('anilist', {}).get('speculative_prefetch') is not None:
+                QueueWorker.speculative_prefetch = settings['application']['anilist']['speculative_prefetch']
+            cls._log.debug(f'Speculative Prefetch: {QueueWorker.speculative_prefetch}')
+
+            # Threads listing series directories during the startup scan
+            if settings['application']['library'].get('scan_workers') is not None:
+                cls.scan_workers = max(1, settings['application']['library']['scan_workers'])
+            cls._log.debug(f'Scan Workers: {cls.scan_workers}')
+
+            # Polling of download directories on network shares
+            if settings['application']['library'].get('poll_interval') is not None:
+                QueueWorker.poll_interval = max(0.1, settings['application']['library']['poll_interval'])
+            cls._log.debug(f'Poll Interval: {QueueWorker.poll_interval}')
+
+            if settings['application']['library'].get('poll_workers') is not None:
+                QueueWorker.poll_workers = max(1, settings['application']['library']['poll_workers'])
+            cls._log.debug(f'Poll Workers: {QueueWorker.poll_workers}')
         else:
             cls._log.critical('Manga Tagger cannot function without a download directory for moving processed '
                               'files into. Configure one in the "settings.json" and try again.')
@@ -206,6 +301,12 @@ class AppSettings:
 
         cls._log.debug(f'Threads: {QueueWorker.threads}')
 
+        # Processes used for CPU-bound tagging; 0 keeps tagging on the worker threads
+        if settings['application']['multithreading'].get('processes') is not None:
+            QueueWorker.processes = max(0, settings['application']['multithreading']['processes'])
+
+        cls._log.debug(f'Processes: {QueueWorker.processes}')
+
         if settings['application']['multithreading']['max_queue_size'] < 0:
             QueueWorker.max_queue_size = 0
         else:
@@ -213,6 +314,28 @@ class AppSettings:
 
         cls._log.debug(f'Max Queue Size: {QueueWorker.max_queue_size}')
 
+        # Number of queued chapters of one series that are processed with a single metadata lookup
+        if settings['application']['multithreading'].get('batch_size') is not None:
+            QueueWorker.batch_size = max(1, settings['application']['multithreading']['batch_size'])
+
+        cls._log.debug(f'Batch Size: {QueueWorker.batch_size}')
+
+        # Pipeline engine; "asyncio" runs the network stages on an event loop instead of the worker threads
+        if settings['application']['multithreading'].get('engine') is not None:
+            if settings['application']['multithreading']['engine'] in ('threads', 'asyncio'):
+                QueueWorker.engine = settings['application']['multithreading']['engine']
+            else:
+                cls._log.warning(f'Unknown engine "{settings["application"]["multithreading"]["engine"]}"; '
+                                 f'using "{QueueWorker.engine}" instead.')
+
+        cls._log.debug(f'Engine: {QueueWorker.engine}')
+
+        # Chapters in flight at once with the asyncio engine
+        if settings['application']['multithreading'].get('async_concurrency') is not None:
+            QueueWorker.async_concurrency = max(1, settings['application']['multithreading']['async_concurrency'])
+
+        cls._log.debug(f'Async Concurrency: {QueueWorker.async_concurrency}')
+
         # Debug Mode - Prevent application from processing files
         if settings['application']['debug_mode']:
             QueueWorker._debug_mode = True
@@ -257,6 +380,8 @@ class AppSettings:
             cls._log.debug(f'Library Directory: {cls.library_dir}')
 
             cls.is_network_path = settings['application']['library']['is_network_path']
+            QueueWorker.is_library_network_path = cls.is_network_path
+            cls._log.debug(f'Network Path: {cls.is_network_path}')
 
             if not Path(cls.library_dir).exists():
                 cls._log.info(f'Library directory "{AppSettings.library_dir}" does not exist; creating now.')
@@ -269,15 +394,73 @@ class AppSettings:
         # Load necessary database tables
         Database.load_database_tables()
 
+        # Anilist Connection Pool
+        anilist_settings = settings['application'].get('anilist', {})
+        # Another endpoint, such as a local stand-in for load tests
+        if anilist_settings.get('url'):
+            AniList.url = anilist_settings['url']
+        if anilist_settings.get('pool_size') is not None:
+            AniList.pool_size = max(1, anilist_settings['pool_size'])
+        if anilist_settings.get('connect_timeout') is not None:
+            AniList.connect_timeout = anilist_settings['connect_timeout']
+        if anilist_settings.get('read_timeout') is not None:
+            AniList.read_timeout = anilist_settings['read_timeout']
+
+        # Requests per minute until Anilist reports its own limit
+        if anilist_settings.get('rate_limit') is not None:
+            AniList.rate_limiter.set_limit(max(1, anilist_settings['rate_limit']))
+
+        # Number of series looked up per request when the chapters queued at startup are prefetched
+        if anilist_settings.get('batch_size') is not None:
+            AniList.batch_size = max(1, anilist_settings['batch_size'])
+
+        cls._log.debug(f'Anilist URL: {AniList.url}')
+        cls._log.debug(f'Anilist Pool Size: {AniList.pool_size}')
+        cls._log.debug(f'Anilist Rate Limit: {AniList.rate_limiter.limit} requests per minute')
+        cls._log.debug(f'Anilist Timeouts (connect, read): {AniList.timeout()}')
+        cls._log.debug(f'Anilist Batch Size: {AniList.batch_size}')
+
+        # Responses are kept in the data directory, so restarts and reprocessing do not query Anilist again
+        cache_ttl_hours = anilist_settings.get('cache_ttl_hours', 168)
+        cache_size_mb = anilist_settings.get('cache_size_mb', 64)
+        if cls.data_dir is not None and cache_ttl_hours > 0 and cache_size_mb > 0:
+            AniList.cache = ResponseCache(Path(cls.data_dir, 'anilist_cache.sqlite3'), cache_ttl_hours * 3600,
+                                          int(cache_size_mb * 1024 * 1024))
+            cls._log.debug(f'Anilist Response Cache: {cache_ttl_hours} hour(s), {cache_size_mb} MB')
+        else:
+            cls._log.debug('Anilist Response Cache: disabled')
+
+        # Series Anilist could not find are not looked up again for this long, unless exceptions.json changes
+        if anilist_settings.get('unmatched_ttl_hours') is not None:
+            UnmatchedSeriesTable.ttl = anilist_settings['unmatched_ttl_hours'] * 3600
+        cls._log.debug(f'Unmatched Series TTL: {UnmatchedSeriesTable.ttl / 3600} hour(s)')
+
+        # Initialize API before the asyncio engine sets up its session from these settings
+        AniList.initialize()
+
         # Initialize QueueWorker and load task queue
         QueueWorker.initialize()
         QueueWorker.load_task_queue()
 
         # Scan download directory for downloads not already in database upon loading
-        cls._scan_download_dir()
-
-        # Initialize API
-        AniList.initialize()
+        startup_chapters = cls._scan_download_dir()
+
+        # Look up the new series of every queued chapter together instead of one request per series
+        MangaTaggerLib.prefetch_series(QueueWorker.journaled_paths() | startup_chapters)
+
+        # Refresh the metadata of series scraped long ago whenever no chapters are waiting
+        refresh_settings = settings['application'].get('refresh', {})
+        if refresh_settings.get('enabled', True) and MangaTaggerLib.database_insert_enabled():
+            cls.refresher = MetadataRefresher(QueueWorker.busy,
+                                              interval=refresh_settings.get('interval_minutes', 60) * 60,
+                                              series_per_interval=max(1, refresh_settings.get('series_per_interval', 20)),
+                                              max_age=timedelta(days=refresh_settings.get('max_age_days', 30)),
+                                              quota_share=min(1.0, max(0.01, refresh_settings.get('quota_share', 0.1))))
+            cls.refresher.start()
+            cls._log.debug(f'Metadata Refresh: {cls.refresher.series_per_interval} series every '
+                           f'{cls.refresher.interval / 60} minute(s), older than {cls.refresher.max_age.days} day(s)')
+        else:
+            cls._log.debug('Metadata Refresh: disabled')
 
         # Register function to be run prior to application termination
         atexit.register(cls._exit_handler)
@@ -355,6 +538,8 @@ class AppSettings:
 
         # Stop worker threads
         QueueWorker.exit()
+        if cls.refresher is not None:
+            cls.refresher.stop()
 
         # Save necessary database tables
         Database.save_database_tables()
@@ -362,6 +547,9 @@ class AppSettings:
         # Close MongoDB connection
         Database.close_connection()
 
+        # Close pooled Anilist connections
+        AniList.close()
+
         cls._log.info('Now exiting Manga Tagger')
 
     @classmethod
@@ -377,10 +565,33 @@ class AppSettings:
                     "image_dir" : "cover"
                 },
                 "adult_result" : False,
+                "anilist": {
+                    "url": "https://graphql.anilist.co",
+                    "pool_size": 10,
+                    "connect_timeout": 5,
+                    "read_timeout": 30,
+                    "rate_limit": 90,
+                    "batch_size": 10,
+                    "cache_ttl_hours": 168,
+                    "cache_size_mb": 64,
+                    "unmatched_ttl_hours": 24,
+                    "speculative_prefetch": True
+                },
+                "refresh": {
+                    "enabled": True,
+                    "interval_minutes": 60,
+                    "series_per_interval": 20,
+                    "max_age_days": 30,
+                    "quota_share": 0.1
+                },
                 "library": {
                     "dir": "manga",
                     "is_network_path": False,
-                    "download_dir": "downloads"
+                    "download_dir": "downloads",
+                    "settle_interval": 1,
+                    "scan_workers": 8,
+                    "poll_interval": 5,
+                    "poll_workers": 4
                 },
                 "dry_run": {
                     "enabled": False,
@@ -390,7 +601,11 @@ class AppSettings:
                 },
                 "multithreading": {
                     "threads": 8,
-                    "max_queue_size": 0
+                    "processes": 0,
+                    "max_queue_size": 0,
+                    "batch_size": 100,
+                    "engine": "threads",
+                    "async_concurrency": 64
                 }
             },
             "database": {
@@ -400,7 +615,9 @@ class AppSettings:
                 "username": "manga_tagger",
                 "password": "Manga4LYFE",
                 "auth_source": "admin",
-                "server_selection_timeout_ms": 1
+                "server_selection_timeout_ms": 1,
+                "metadata_cache_size": 1024,
+                "metadata_cache_ttl": 600
             },
             "logger": {
                 "logging_level": "info",
@@ -436,10 +653,19 @@ class AppSettings:
 
     @classmethod
     def _scan_download_dir(cls):
-        for directory in QueueWorker.download_dir.iterdir():
-            for manga_chapter in directory.glob('*.cbz'):
-                if manga_chapter.name.strip('.cbz') not in QueueWorker.task_list.keys():
-                    QueueWorker.add_to_task_queue(manga_chapter)
+        state_path = Path(cls.data_dir, 'scan_state.json') if cls.data_dir is not None else None
+        scanner = DownloadScanner(QueueWorker.download_dir, state_path, cls.scan_workers)
+        manga_chapters = scanner.scan(QueueWorker.journaled_paths())
+        for manga_chapter in manga_chapters:
+            QueueWorker.add_to_task_queue(manga_chapter)
+
+        # Only skip these directories on the next startup once their chapters are in the journal
+        if TaskQueueTable.flush():
+            scanner.save_state()
+        else:
+            cls._log.warning('The task queue could not be saved; the download directory will be scanned in full on '
+                             'the next startup.')
+        return {str(manga_chapter.absolute()) for manga_chapter in manga_chapters}
 
 def levenshtein_distance_no_numpy(s1, s2):
     """
@@ -471,7 +697,7 @@ def compare(s1, s2):
 
     rows = len(s1) + 1
     cols = len(s2) + 1
-    distance = levenshtein_distance_no_numpy(s1, s2)
+    distance = [[0 for _ in range(cols)] for _ in range(rows)]
 
     for i in range(1, rows):
         distance[i][0] = i
@@ -0,0 +1,50 @@
+"""
+Rate limit benchmark for Anilist lookups.
+
+Sends series lookups from several threads to a local Anilist stub that enforces a per-minute limit the way
+graphql.anilist.co does, and reports the throughput together with the number of requests that were answered with 429.
+Pacing by the shared token bucket should keep that number at or near zero while using the whole budget.
+
+Usage:
+    python -m benchmarks.bench_anilist_rate_limit [--lookups 150] [--threads 8] [--rate-limit 120] [--latency-ms 20]
+"""
+import argparse
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from MangaTaggerLib import MangaTaggerLib
+from MangaTaggerLib.api import AniList, RateLimiter
+from tests.anilist_stub import AniListStub
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lookups', type=int, default=150)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--rate-limit', type=int, default=120, help='requests the stub allows per minute')
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='delay added to every request')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    AniList.initialize()
+    AniList.rate_limiter = RateLimiter()
+
+    with AniListStub(latency=args.latency_ms / 1000, rate_limit=args.rate_limit) as stub:
+        AniList.url = stub.url
+        ids = [stub.series[i % len(stub.series)]['id'] for i in range(args.lookups)]
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            results = list(executor.map(lambda series_id: AniList.search_for_manga_title_by_id(series_id, {}), ids))
+        elapsed = time.perf_counter() - start
+
+        print(f'{args.lookups} lookups from {args.threads} threads against a limit of {args.rate_limit} per minute')
+        print(f'  {elapsed:6.1f} s  {args.lookups / elapsed * 60:6.1f} lookups per minute  '
+              f'{stub.requests} requests  {stub.throttled} answered with 429  '
+              f'{sum(result is None for result in results)} failed')
+    AniList.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Latency benchmark for Anilist lookups.
+
+Resolves series against a local Anilist stub, once with a fresh requests.post() connection per query as before and
+once through the pooled AniList session. The stub delays every new connection to stand in for the TCP and TLS
+handshakes to graphql.anilist.co.
+
+Usage:
+    python -m benchmarks.bench_anilist_session [--lookups 40] [--threads 1 8] [--handshake-ms 60] [--latency-ms 20]
+"""
+import argparse
+import logging
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import requests
+
+from MangaTaggerLib import MangaTaggerLib
+from MangaTaggerLib.api import AniList
+from tests.anilist_stub import AniListStub
+
+
+def unpooled_post(url, json, timeout):
+    return requests.post(url, json=json, timeout=timeout)
+
+
+def lookup(title):
+    # Two back-to-back queries, so that the second one can reuse the connection of the first
+    start = time.perf_counter()
+    search = AniList.search_for_manga_title_by_manga_title(title, 'MANGA', {})
+    AniList.search_details_by_series_id(search['id'], 'MANGA', {})
+    return time.perf_counter() - start
+
+
+def bench(stub, titles, threads, pooled):
+    AniList.close()
+    connections = stub.connections
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        if pooled:
+            latencies = list(executor.map(lookup, titles))
+        else:
+            with patch.object(requests.Session, 'post', side_effect=unpooled_post):
+                latencies = list(executor.map(lookup, titles))
+    return latencies, time.perf_counter() - start, stub.connections - connections
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lookups', type=int, default=40)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--handshake-ms', type=float, default=60.0, help='delay added to every new connection')
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='delay added to every request')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    AniList.initialize()
+
+    with AniListStub(handshake_latency=args.handshake_ms / 1000, latency=args.latency_ms / 1000) as stub:
+        AniList.url = stub.url
+        titles = [stub.series[i % len(stub.series)]['title']['romaji'] for i in range(args.lookups)]
+
+        print(f'{args.lookups} series lookups, {args.handshake_ms} ms per handshake, {args.latency_ms} ms per request')
+        for threads in args.threads:
+            for label, pooled in (('new connection', False), ('pooled session', True)):
+                latencies, elapsed, connections = bench(stub, titles, threads, pooled)
+                print(f'  {threads:2} threads, {label:>14}: median {statistics.median(latencies) * 1000:7.1f} ms  '
+                      f'p95 {sorted(latencies)[int(len(latencies) * 0.95) - 1] * 1000:7.1f} ms  '
+                      f'total {elapsed:6.2f} s  {connections:3} connections')
+    AniList.close()
+
+
+if __name__ == '__main__':
+    main()
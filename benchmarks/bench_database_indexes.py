@@ -0,0 +1,138 @@
+"""
+Lookup latency benchmark for the manga_metadata and processed_files indexes.
+
+Fills a scratch database with generated series and processed chapters, then times the lookups Manga Tagger makes for
+every chapter, MetadataTable.search_by_search_value() and ProcFilesTable.search(), once without the declared indexes
+and once with them, and reports the plan MongoDB chose. Needs a MongoDB server; the scratch database is dropped
+afterwards.
+
+Usage:
+    python -m benchmarks.bench_database_indexes [--host localhost] [--port 27017] [--series 10000]
+                                                [--chapters 1000000] [--lookups 200]
+"""
+import argparse
+import logging
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from MangaTaggerLib import MangaTaggerLib
+from MangaTaggerLib.database import Database, MetadataTable, ProcFilesTable
+
+
+def series_document(i):
+    document = {
+        '_id': i,
+        'search_value': f'Series {i}',
+        'series_title': f'Romaji Title {i}',
+        'series_title_eng': f'English Title {i}',
+        'series_title_jap': f'Native Title {i}',
+        'synonyms': [f'Synonym {i} A', f'Synonym {i} B'],
+        'description': 'x' * 500,
+        'scrape_time': datetime.utcnow() - timedelta(minutes=i)
+    }
+    document['search_keys'] = MetadataTable.search_keys(document)
+    return document
+
+
+def chapter_document(i, series):
+    return {
+        'series_title': f'Romaji Title {i % series}',
+        'chapter_number': f'{i // series + 1:03d}',
+        'old_filename': f'Series {i % series} -.- Chapter {i // series + 1}.cbz',
+        'new_filename': f'Romaji Title {i % series} {i // series + 1:03d}.cbz',
+        'process_date': datetime.now().date().strftime('%Y-%m-%d @ %I:%M:%S %p')
+    }
+
+
+def populate(collection, documents, total, chunk_size=10000):
+    for start in range(0, total, chunk_size):
+        collection.insert_many([documents(i) for i in range(start, min(total, start + chunk_size))], ordered=False)
+
+
+def time_lookups(lookup, arguments):
+    timings = []
+    for args in arguments:
+        start = time.perf_counter()
+        lookup(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), sorted(timings)[int(len(timings) * 0.99) - 1]
+
+
+def plan(collection, query):
+    winning_plan = collection.find(query).explain()['queryPlanner']['winningPlan']
+    stages = []
+    while winning_plan:
+        stages.append(winning_plan['stage'])
+        winning_plan = winning_plan.get('inputStage') or (winning_plan.get('inputStages') or [None])[0]
+    return ' > '.join(stages)
+
+
+def measure(series_lookups, chapter_lookups):
+    metadata_query = MetadataTable._search_value_filter(series_lookups[0][0])
+    files_query = {'series_title': chapter_lookups[0][0], 'chapter_number': chapter_lookups[0][1]}
+    return {
+        'search_by_search_value': (time_lookups(MetadataTable.search_by_search_value, series_lookups),
+                                   plan(MetadataTable._database, metadata_query)),
+        'ProcFilesTable.search': (time_lookups(ProcFilesTable.search, chapter_lookups),
+                                  plan(ProcFilesTable._database, files_query))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=27017)
+    parser.add_argument('--username')
+    parser.add_argument('--password')
+    parser.add_argument('--series', type=int, default=10000)
+    parser.add_argument('--chapters', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=200, help='lookups timed per query')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    Database.database_name = 'manga_tagger_bench_indexes'
+    Database.host_address = args.host
+    Database.port = args.port
+    Database.username = args.username
+    Database.password = args.password
+    Database.server_selection_timeout_ms = 5000
+    Database.initialize()
+
+    try:
+        MetadataTable._database.drop()
+        ProcFilesTable._database.drop()
+        print(f'Inserting {args.series} series and {args.chapters} processed chapters...')
+        populate(MetadataTable._database, series_document, args.series)
+        populate(ProcFilesTable._database, lambda i: chapter_document(i, args.series), args.chapters)
+
+        # Lookups by every kind of title, in varying case, and by chapters spread over the whole collection
+        random.seed(0)
+        fields = ['Series {}', 'romaji title {}', 'English Title {}', 'Native Title {}', 'SYNONYM {} B']
+        series_lookups = [(random.choice(fields).format(random.randrange(args.series)),) for _ in range(args.lookups)]
+        chapters = [chapter_document(random.randrange(args.chapters), args.series) for _ in range(args.lookups)]
+        chapter_lookups = [(chapter['series_title'], chapter['chapter_number']) for chapter in chapters]
+
+        results = {}
+        for label in ('without indexes', 'with indexes'):
+            if label == 'with indexes':
+                MetadataTable.ensure_indexes()
+                ProcFilesTable.ensure_indexes()
+            results[label] = measure(series_lookups, chapter_lookups)
+
+        print(f'{args.series} series, {args.chapters} processed chapters, {args.lookups} lookups per query')
+        for query in ('search_by_search_value', 'ProcFilesTable.search'):
+            print(f'  {query}')
+            for label, measured in results.items():
+                (median, p99), stages = measured[query]
+                print(f'    {label:16} median {median:9.3f} ms   p99 {p99:9.3f} ms   {stages}')
+            speedup = results['without indexes'][query][0][0] / results['with indexes'][query][0][0]
+            print(f'    speedup          {speedup:9.1f}x')
+    finally:
+        Database._client.drop_database(Database.database_name)
+        Database.close_connection()
+
+
+if __name__ == '__main__':
+    main()
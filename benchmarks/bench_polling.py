@@ -0,0 +1,118 @@
+"""
+Filesystem call benchmark for download directory polling.
+
+Builds a download directory with one directory per series and counts the stat and directory listing calls, and the
+directory entries read, that one polling cycle costs with watchdog's PollingEmitter and with DirectoryPollingEmitter
+after a single chapter was added. On a network share every call is a round trip to the server.
+
+Usage:
+    python -m benchmarks.bench_polling [--series 500] [--chapters 20]
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+from watchdog.observers.api import EventQueue, ObservedWatch
+from watchdog.observers.polling import PollingEmitter
+
+from MangaTaggerLib.polling import DirectoryPollingEmitter
+
+
+class CallCounter:
+    def __init__(self):
+        self._stat = os.stat
+        self._scandir = os.scandir
+        self.reset()
+
+    def reset(self):
+        self.stat = 0
+        self.listdir = 0
+        self.entries = 0
+
+    def counting_stat(self, *args, **kwargs):
+        self.stat += 1
+        return self._stat(*args, **kwargs)
+
+    def counting_scandir(self, path):
+        self.listdir += 1
+        entries = list(self._scandir(path))
+        self.entries += len(entries)
+        return _Listing(entries)
+
+
+class _Listing(list):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+def create_tree(directory, series, chapters):
+    for i in range(series):
+        series_dir = Path(directory, f'Series {i}')
+        series_dir.mkdir()
+        for chapter in range(chapters):
+            Path(series_dir, f'Series {i} -.- Chapter {chapter}.cbz').write_bytes(b'0')
+
+
+def add_chapter(directory):
+    series_dir = Path(directory, 'Series 0')
+    Path(series_dir, 'Series 0 -.- Chapter new.cbz').write_bytes(b'0')
+    stat = series_dir.stat()
+    os.utime(series_dir, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def bench_watchdog(directory):
+    counter = CallCounter()
+    emitter = PollingEmitter(EventQueue(), ObservedWatch(directory, True),
+                             stat=counter.counting_stat, listdir=counter.counting_scandir)
+    emitter.on_thread_start()
+    add_chapter(directory)
+
+    counter.reset()
+    start = time.perf_counter()
+    emitter.queue_events(0)
+    return counter, time.perf_counter() - start
+
+
+def bench_directory_polling(directory):
+    counter = CallCounter()
+    emitter = DirectoryPollingEmitter(EventQueue(), ObservedWatch(directory, True))
+    with patch.object(os, 'stat', counter.counting_stat), patch.object(os, 'scandir', counter.counting_scandir):
+        emitter.on_thread_start()
+        # Let the post-snapshot recheck pass so that the measured cycle is a steady-state one
+        emitter.queue_events(0)
+        add_chapter(directory)
+
+        counter.reset()
+        start = time.perf_counter()
+        emitter.queue_events(0)
+        elapsed = time.perf_counter() - start
+    emitter.on_thread_stop()
+    return counter, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--series', type=int, default=500)
+    parser.add_argument('--chapters', type=int, default=20)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    print(f'{args.series} series directories, {args.chapters} chapters each')
+    for name, bench in (('watchdog PollingEmitter', bench_watchdog),
+                        ('DirectoryPollingEmitter', bench_directory_polling)):
+        with tempfile.TemporaryDirectory() as directory:
+            create_tree(directory, args.series, args.chapters)
+            counter, elapsed = bench(directory)
+        print(f'  {name:>24}: {counter.stat:7} stat  {counter.listdir:5} listings  {counter.entries:7} entries  '
+              f'{elapsed * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Throughput benchmark for QueueWorker.process.
+
+Compares the blocking queue consumer against the previous empty()/sleep(1) polling loop by draining a queue of
+chapters through each of them. Chapter processing is replaced with a fixed amount of simulated work so only the
+queue handling overhead is measured.
+
+Usage:
+    python -m benchmarks.bench_queue_worker [--chapters 80] [--threads 8] [--work-ms 5]
+"""
+import argparse
+import logging
+import tempfile
+import time
+from pathlib import Path
+from queue import Queue
+from threading import Thread
+from unittest.mock import patch
+
+from MangaTaggerLib import MangaTaggerLib
+from MangaTaggerLib.task_queue import QueueWorker, QueueEvent, QueueEventOrigin
+
+
+def legacy_process(queue: Queue, state: dict, work):
+    """The pre-existing polling loop, kept here for comparison."""
+    while state['running']:
+        if not queue.empty():
+            event = queue.get()
+            work([(event.src_path, None)])
+            queue.task_done()
+        time.sleep(1)
+
+
+def bench_legacy(chapters, threads, work):
+    queue = Queue()
+    state = {'running': True}
+    workers = [Thread(target=legacy_process, args=(queue, state, work), daemon=True) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+
+    start = time.perf_counter()
+    for chapter in chapters:
+        queue.put(QueueEvent(chapter, QueueEventOrigin.SCAN))
+    queue.join()
+    elapsed = time.perf_counter() - start
+
+    state['running'] = False
+    for worker in workers:
+        worker.join()
+    return elapsed
+
+
+def bench_blocking(chapters, threads, work):
+    with tempfile.TemporaryDirectory() as download_dir, \
+            patch.object(MangaTaggerLib, 'process_manga_batch', side_effect=work), \
+            patch.object(MangaTaggerLib, 'is_series_cached', return_value=True), \
+            patch('MangaTaggerLib.task_queue.TaskQueueTable'), \
+            patch('MangaTaggerLib.task_queue.ProcFilesTable'):
+        # No database is set up, so the task journal and processed_files records are not written
+        QueueWorker.threads = threads
+        QueueWorker.max_queue_size = 0
+        QueueWorker.download_dir = Path(download_dir)
+        QueueWorker.initialize()
+        for worker in QueueWorker._worker_list:
+            worker.start()
+        QueueWorker._observer.start()
+
+        start = time.perf_counter()
+        for chapter in chapters:
+            QueueWorker.enqueue(QueueEvent(chapter, QueueEventOrigin.SCAN))
+        QueueWorker.join()
+        elapsed = time.perf_counter() - start
+
+        QueueWorker.exit()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chapters', type=int, default=80)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--work-ms', type=float, default=5.0, help='simulated processing time per chapter')
+    args = parser.parse_args()
+
+    # Chapter processing is simulated, so the chapters do not need to exist on disk
+    logging.disable(logging.CRITICAL)
+    chapters = [Path(f'/nonexistent/Series {i % 16} -.- Chapter {i}.cbz') for i in range(args.chapters)]
+
+    def work(chapters):
+        time.sleep(len(chapters) * args.work_ms / 1000)
+
+    blocking = bench_blocking(chapters, args.threads, work)
+    legacy = bench_legacy(chapters, args.threads, work)
+
+    print(f'{args.chapters} chapters, {args.threads} threads, {args.work_ms} ms simulated work per chapter')
+    print(f'  polling loop:  {legacy:8.3f} s  {args.chapters / legacy:10.1f} chapters/s')
+    print(f'  blocking get:  {blocking:8.3f} s  {args.chapters / blocking:10.1f} chapters/s')
+    print(f'  speedup:       {legacy / blocking:8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
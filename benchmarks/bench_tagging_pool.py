@@ -0,0 +1,97 @@
+"""
+Scaling benchmark for CPU-bound chapter tagging.
+
+Tags a set of generated chapter archives through QueueWorker.run_cpu_bound() from a fixed number of worker threads,
+first on the threads themselves and then with process pools of increasing size.
+
+Usage:
+    python -m benchmarks.bench_tagging_pool [--chapters 400] [--threads 8] [--processes 1 2 4 8]
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from zipfile import ZipFile
+
+from MangaTaggerLib.MangaTaggerLib import write_chapter_tags
+from MangaTaggerLib.models import Metadata
+from MangaTaggerLib.task_queue import QueueWorker
+from MangaTaggerLib.utils import AppSettings
+
+
+def create_chapters(directory, count, pages):
+    template = Path(directory, 'template.cbz')
+    with ZipFile(template, 'w') as zipfile:
+        for page in range(pages):
+            zipfile.writestr(f'{page:03}.jpg', os.urandom(64 * 1024))
+
+    chapters = []
+    for i in range(count):
+        chapter = Path(directory, f'chapter {i:04}.cbz')
+        shutil.copyfile(template, chapter)
+        chapters.append(chapter)
+    return chapters
+
+
+def bench(chapters, metadata, threads, processes):
+    QueueWorker.processes = processes
+    if processes > 0:
+        QueueWorker._process_pool = None
+        QueueWorker.initialize()
+        # Start every process before timing
+        list(QueueWorker._process_pool.map(abs, range(processes * 4)))
+
+    def tag(chapter):
+        QueueWorker.run_cpu_bound(write_chapter_tags, metadata, '001', None, chapter, None, {})
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(tag, chapters))
+    elapsed = time.perf_counter() - start
+
+    if QueueWorker._process_pool is not None:
+        QueueWorker._process_pool.shutdown()
+        QueueWorker._process_pool = None
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chapters', type=int, default=400)
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4, os.cpu_count()])
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    AppSettings.timezone = 'UTC'
+    with open(Path('tests/data/BLEACH/data.json'), encoding='utf-8') as data:
+        metadata = Metadata('BLEACH', {}, json.load(data))
+
+    QueueWorker.threads = args.threads
+    QueueWorker.max_queue_size = 0
+
+    print(f'{args.chapters} chapters, {args.threads} worker threads, {os.cpu_count()} CPUs')
+    with tempfile.TemporaryDirectory() as download_dir:
+        QueueWorker.download_dir = Path(download_dir)
+
+        baseline = None
+        for processes in [0] + sorted(set(args.processes)):
+            chapter_dir = Path(download_dir, str(processes))
+            chapter_dir.mkdir()
+            chapters = create_chapters(chapter_dir, args.chapters, args.pages)
+            elapsed = bench(chapters, metadata, args.threads, processes)
+            baseline = baseline or elapsed
+
+            label = 'threads only' if processes == 0 else f'{processes} processes'
+            print(f'  {label:>14}: {elapsed:8.3f} s  {args.chapters / elapsed:8.1f} chapters/s  '
+                  f'{baseline / elapsed:5.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+"""
+Local stand-in for graphql.anilist.co.
+
+Answers Media queries, aliased batches included, from recorded fixtures and from the series in tests/data, so that
+Manga Tagger can be tested, load-tested and benchmarked without the live API. Latency can be added to every connection
+and request, and rate limiting is emulated with Anilist's headers and 429 responses.
+
+Usage:
+    python -m tests.anilist_stub [--port 8080] [--latency-ms 0] [--handshake-ms 0] [--rate-limit 90]
+                                 [--fixtures tests/fixtures/anilist.json] [--record https://graphql.anilist.co]
+
+Point Manga Tagger at it with application.anilist.url or MANGA_TAGGER_ANILIST_URL. With --record, queries the fixtures
+cannot answer are forwarded to the given endpoint and their responses are added to the fixtures file on exit.
+"""
+import argparse
+import json
+import math
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import requests
+
+from MangaTaggerLib.cache import ResponseCache
+
+# A Media field of a query, with the alias it is returned under if it has one
+MEDIA_FIELD = re.compile(r'(?:(\w+)\s*:\s*)?Media\s*\(([^)]*)\)')
+ARGUMENT = re.compile(r'(\w+)\s*:\s*\$(\w+)')
+
+
+class AniListStub:
+    """
+    Local stand-in for graphql.anilist.co that answers Media queries, aliased batches included, from recorded fixtures
+    and the series in data_dir. Every new connection is delayed by handshake_latency and every request by latency, to
+    mimic the cost of reaching the real API over TLS. With a rate_limit, requests beyond rate_limit per rate_window
+    seconds are answered with 429 like Anilist does.
+    """
+
+    def __init__(self, data_dir='tests/data', handshake_latency=0.0, latency=0.0, fixtures=None, upstream=None,
+                 rate_limit=None, rate_window=60.0, port=0):
+        self.handshake_latency = handshake_latency
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.upstream = upstream
+        self.connections = 0
+        self.requests = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._window_requests = 0
+        self._injected = []
+
+        self.series = []
+        if data_dir is not None:
+            for series_dir in sorted(Path(data_dir).iterdir()):
+                with open(Path(series_dir, 'data.json'), encoding='utf-8') as data:
+                    self.series.append(json.load(data))
+
+        # Recorded responses, by the same key as the response cache
+        self.fixtures_path = Path(fixtures) if fixtures is not None else None
+        self.fixtures = {}
+        self._recorded = False
+        if self.fixtures_path is not None and self.fixtures_path.exists():
+            with open(self.fixtures_path, encoding='utf-8') as fixtures_file:
+                for fixture in json.load(fixtures_file):
+                    self.fixtures[ResponseCache.key(fixture['query'], fixture['variables'])] = fixture
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='AniListStub', daemon=True)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self._server.server_address[1]}'
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self.save()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def inject_429(self, count=1, retry_after=1):
+        """
+        Answers the next count requests with 429 and the given Retry-After, regardless of the rate limit.
+        """
+        with self._lock:
+            self._injected.extend([retry_after] * count)
+
+    def save(self):
+        """
+        Writes the fixtures file if responses were recorded from the upstream endpoint.
+        """
+        if self.fixtures_path is None or not self._recorded:
+            return
+        self.fixtures_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.fixtures_path, 'w', encoding='utf-8') as fixtures_file:
+            json.dump(list(self.fixtures.values()), fixtures_file, ensure_ascii=False, indent=2)
+        self._recorded = False
+
+    def answer(self, query, variables):
+        """
+        Returns the data of the response to a query: the recorded one if there is one, else the response of the
+        upstream endpoint, which is recorded, else an answer built from data_dir.
+        """
+        key = ResponseCache.key(query, variables)
+        fixture = self.fixtures.get(key)
+        if fixture is not None:
+            return fixture['data']
+
+        if self.upstream is not None:
+            response = requests.post(self.upstream, json={'query': query, 'variables': variables}, timeout=30)
+            data = response.json().get('data')
+            # Anilist answers 404 for a series it does not have, which is worth replaying too
+            if response.status_code in (200, 404):
+                with self._lock:
+                    self.fixtures[key] = {'query': query, 'variables': variables, 'data': data}
+                    self._recorded = True
+            return data
+
+        return self.data(query, variables)
+
+    def data(self, query, variables):
+        """
+        Answers every Media field of a query from data_dir.
+        """
+        data = {}
+        for alias, arguments in MEDIA_FIELD.findall(query):
+            field_variables = {}
+            for argument, variable in ARGUMENT.findall(arguments):
+                if argument == 'id':
+                    field_variables['series_id'] = variables.get(variable)
+                elif argument == 'search':
+                    field_variables['manga_title'] = variables.get(variable)
+                elif argument == 'format':
+                    field_variables['format'] = variables.get(variable)
+            data[alias or 'Media'] = self.media(field_variables)
+        return data
+
+    def media(self, variables):
+        """
+        Returns the stored series matching the query variables, or None. Like Anilist, a title search also matches
+        titles that merely contain the searched words, but exact matches come first.
+        """
+        series_id = variables.get('manga_id') or variables.get('series_id')
+        title = variables.get('manga_title')
+        format = variables.get('format')
+
+        candidates = [series for series in self.series if format is None or series.get('format', 'MANGA') == format]
+        if series_id is not None:
+            return next((series for series in candidates if series['id'] == series_id), None)
+        if title is None:
+            return None
+
+        search = self._normalize(title)
+        for exact in (True, False):
+            for series in candidates:
+                titles = [self._normalize(title) for title in self._titles(series)]
+                if any(search == title if exact else search in title for title in titles):
+                    return series
+        return None
+
+    @staticmethod
+    def _titles(series):
+        return [title for title in series['title'].values() if title] + series.get('synonyms', [])
+
+    @staticmethod
+    def _normalize(title):
+        return re.sub(r'[\W_]+', '', title.casefold())
+
+    def _admit(self):
+        """
+        Counts a request against the rate limit. Returns its status code and rate limit headers.
+        """
+        now = time.monotonic()
+        if now - self._window_start >= self.rate_window:
+            self._window_start = now
+            self._window_requests = 0
+        reset_in = self.rate_window - (now - self._window_start)
+
+        if self._injected:
+            self.throttled += 1
+            return 429, {'Retry-After': str(self._injected.pop(0)), 'X-RateLimit-Remaining': '0'}
+        if self.rate_limit is None:
+            return 200, {}
+
+        self._window_requests += 1
+        remaining = self.rate_limit - self._window_requests
+        headers = {'X-RateLimit-Limit': str(self.rate_limit), 'X-RateLimit-Remaining': str(max(0, remaining))}
+        if remaining < 0:
+            self.throttled += 1
+            headers.update({'Retry-After': str(math.ceil(reset_in)),
+                            'X-RateLimit-Reset': str(math.ceil(time.time() + reset_in))})
+            return 429, headers
+        return 200, headers
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are written separately; without this the body waits for a delayed ACK
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+                time.sleep(stub.handshake_latency)
+
+            def do_POST(self):
+                with stub._lock:
+                    stub.requests += 1
+                    status, headers = stub._admit()
+                time.sleep(stub.latency)
+
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if status == 429:
+                    response = {'data': None, 'errors': [{'message': 'Too Many Requests.', 'status': 429}]}
+                else:
+                    response = {'data': stub.answer(request['query'], request.get('variables') or {})}
+                body = json.dumps(response).encode('utf-8')
+
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--data-dir', default='tests/data', help='series answered when no fixture matches')
+    parser.add_argument('--fixtures', help='JSON file of recorded responses')
+    parser.add_argument('--record', metavar='URL', help='forward unrecorded queries to URL and record the responses')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='delay added to every request')
+    parser.add_argument('--handshake-ms', type=float, default=0.0, help='delay added to every new connection')
+    parser.add_argument('--rate-limit', type=int, help='requests allowed per minute before answering 429')
+    args = parser.parse_args()
+
+    stub = AniListStub(args.data_dir, args.handshake_ms / 1000, args.latency_ms / 1000, args.fixtures, args.record,
+                       args.rate_limit, port=args.port)
+    stub.start()
+    print(f'Anilist stub listening on {stub.url}')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub.stop()
+        print(f'{stub.requests} requests, {stub.throttled} throttled')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,410 @@
+import logging
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import requests
+
+from MangaTaggerLib import MangaTaggerLib
+from MangaTaggerLib.api import AniList, AniListRateLimit, RateLimiter
+from MangaTaggerLib.errors import MangaNotFoundError
+from tests.anilist_stub import AniListStub
+
+
+class TestAniListSession(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.stub = AniListStub().start()
+        self.addCleanup(self.stub.stop)
+
+        self.url = AniList.url
+        AniList.url = self.stub.url
+        AniList.initialize()
+
+    def tearDown(self) -> None:
+        AniList.close()
+        AniList.url = self.url
+
+    def test_connection_is_reused(self):
+        """
+        Tests that consecutive queries are sent over one kept-alive connection.
+        """
+        search = AniList.search_for_manga_title_by_manga_title('BLEACH', 'MANGA', {})
+        details = AniList.search_details_by_series_id(search['id'], 'MANGA', {})
+
+        self.assertEqual('BLEACH', details['title']['romaji'])
+        self.assertEqual(2, self.stub.requests)
+        self.assertEqual(1, self.stub.connections)
+
+    def test_session_is_shared_between_threads(self):
+        """
+        Tests that concurrent threads share the pool instead of opening a connection per query.
+        """
+        AniList.pool_size = 2
+        self.addCleanup(setattr, AniList, 'pool_size', 10)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda _: AniList.search_for_manga_title_by_id(30012, {}), range(40)))
+
+        self.assertTrue(all(result['id'] == 30012 for result in results))
+        self.assertLessEqual(self.stub.connections, 2)
+
+
+class TestBatchLookup(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.stub = AniListStub().start()
+        self.addCleanup(self.stub.stop)
+
+        self.url = AniList.url
+        AniList.url = self.stub.url
+        AniList.batch_size = 2
+        AniList.initialize()
+
+    def tearDown(self) -> None:
+        AniList.close()
+        AniList.url = self.url
+        AniList.batch_size = 10
+
+    def test_searches_share_requests(self):
+        """
+        Tests that series are looked up batch_size at a time and the results come back in the order of the searches.
+        """
+        searches = [('BLEACH', 'MANGA', False, None), ('Nonexistent', 'MANGA', False, None),
+                    (None, 'MANGA', False, 30011)]
+
+        results = AniList.search_batch(searches, {})
+
+        self.assertEqual(2, self.stub.requests)
+        self.assertEqual('BLEACH', results[0]['title']['romaji'])
+        self.assertIsNone(results[1])
+        self.assertEqual(30011, results[2]['id'])
+
+
+class TestAniListStub(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        self.url = AniList.url
+        self.rate_limiter = AniList.rate_limiter
+        AniList.rate_limiter = RateLimiter()
+        AniList.initialize()
+
+    def tearDown(self) -> None:
+        AniList.close()
+        AniList.url = self.url
+        AniList.rate_limiter = self.rate_limiter
+
+    def test_injected_429_is_retried(self):
+        """
+        Tests that a 429 from the stub is waited out and the query retried.
+        """
+        with AniListStub() as stub:
+            AniList.url = stub.url
+            stub.inject_429(retry_after=0)
+
+            self.assertEqual(30012, AniList.search_for_manga_title_by_id(30012, {})['id'])
+            self.assertEqual((2, 1), (stub.requests, stub.throttled))
+
+    def test_rate_limit_headers(self):
+        """
+        Tests that the stub reports its limit like Anilist and answers 429 once it is used up.
+        """
+        with AniListStub(rate_limit=2) as stub:
+            statuses = []
+            for _ in range(3):
+                response = requests.post(stub.url, json={'query': 'query { Media (id: $id) { id } }',
+                                                          'variables': {'id': 30012}})
+                statuses.append((response.status_code, response.headers['X-RateLimit-Remaining']))
+
+        self.assertEqual([(200, '1'), (200, '0'), (429, '0')], statuses)
+        self.assertGreater(int(response.headers['Retry-After']), 0)
+
+    def test_recorded_responses_are_replayed(self):
+        """
+        Tests that responses recorded from an upstream endpoint are replayed without it.
+        """
+        fixtures = Path(self.directory, 'fixtures.json')
+        with AniListStub() as upstream:
+            with AniListStub(data_dir=None, fixtures=fixtures, upstream=upstream.url) as recorder:
+                AniList.url = recorder.url
+                recorded = AniList.search_for_manga_title_by_manga_title('Bastard', 'MANGA', {})
+                AniList.close()
+
+        with AniListStub(data_dir=None, fixtures=fixtures) as replay:
+            AniList.url = replay.url
+            self.assertEqual(recorded, AniList.search_for_manga_title_by_manga_title('Bastard', 'MANGA', {}))
+            self.assertIsNone(AniList.search_for_manga_title_by_manga_title('Naruto', 'MANGA', {}))
+
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self) -> None:
+        self.now = 0.0
+        self.sleeps = []
+        self.limiter = RateLimiter(limit=60, period=60.0, clock=lambda: self.now, sleep=self.sleeps.append)
+
+    def test_burst_then_sustained_rate(self):
+        """
+        Tests that requests beyond the bucket are spaced out at the sustained rate rather than released together.
+        """
+        self.limiter.update(200, {'X-RateLimit-Limit': '60', 'X-RateLimit-Remaining': '2'})
+
+        delays = [self.limiter.reserve() for _ in range(5)]
+
+        self.assertEqual([0.0, 0.0, 1.0, 2.0, 3.0], delays)
+
+    def test_retry_after_pauses_every_caller(self):
+        """
+        Tests that a 429 holds back every request until Retry-After has passed.
+        """
+        self.limiter.update(429, {'Retry-After': '30', 'X-RateLimit-Remaining': '0'})
+
+        self.assertEqual(30.0, self.limiter.reserve())
+        self.assertEqual(31.0, self.limiter.reserve())
+
+        self.now = 40.0
+        self.assertEqual(0.0, self.limiter.reserve())
+
+    def test_pause_during_wait_is_waited_out(self):
+        """
+        Tests that a caller which was already waiting when another caller got a 429 also waits for the pause to end.
+        """
+        self.limiter.update(200, {'X-RateLimit-Remaining': '0'})
+
+        def sleep(delay):
+            self.sleeps.append(delay)
+            if len(self.sleeps) == 1:
+                self.limiter.update(429, {'Retry-After': '30'})
+            self.now += delay
+
+        self.limiter._sleep = sleep
+        self.assertEqual(30.0, self.limiter.acquire())
+        self.assertEqual([1.0, 29.0], self.sleeps)
+
+    def test_limit_header_changes_rate(self):
+        """
+        Tests that the refill rate follows X-RateLimit-Limit, e.g. when Anilist runs in degraded mode.
+        """
+        self.limiter.update(200, {'X-RateLimit-Limit': '30', 'X-RateLimit-Remaining': '0'})
+
+        self.assertEqual(2.0, self.limiter.reserve())
+
+
+class TestAniListRateLimit(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        AniList.initialize()
+        self.sleeps = []
+        self.rate_limiter = AniList.rate_limiter
+        AniList.rate_limiter = RateLimiter(sleep=self.sleeps.append)
+
+    def tearDown(self) -> None:
+        AniList.rate_limiter = self.rate_limiter
+
+    @staticmethod
+    def _response(status_code, headers=None, media=None):
+        return MagicMock(status_code=status_code, headers=headers or {},
+                         json=MagicMock(return_value={'data': {'Media': media}}))
+
+    def test_request_is_retried_after_429(self):
+        """
+        Tests that a rate limited request waits for Retry-After and is sent again.
+        """
+        responses = [self._response(429, {'Retry-After': '2'}), self._response(200, media={'id': 1})]
+        with patch.object(AniList, 'session') as session:
+            session.return_value.post.side_effect = responses
+            result = AniList.search_for_manga_title_by_id(1, {})
+
+        self.assertEqual({'id': 1}, result)
+        self.assertEqual(1, len(self.sleeps))
+        self.assertAlmostEqual(2, self.sleeps[0], delta=0.1)
+
+    def test_rate_limit_raised_after_retries(self):
+        """
+        Tests that AniListRateLimit is only raised once every retry was rate limited.
+        """
+        with patch.object(AniList, 'session') as session:
+            session.return_value.post.return_value = self._response(429, {'Retry-After': '1'})
+            with self.assertRaises(AniListRateLimit):
+                AniList.search_for_manga_title_by_id(1, {})
+
+        self.assertEqual(AniList.max_retries + 1, session.return_value.post.call_count)
+
+
+class TestResolveSeries(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.stub = AniListStub().start()
+        self.addCleanup(self.stub.stop)
+
+        self.url = AniList.url
+        AniList.url = self.stub.url
+        AniList.initialize()
+
+        patch1 = patch('MangaTaggerLib.MangaTaggerLib.AppSettings')
+        self.AppSettings = patch1.start()
+        self.addCleanup(patch1.stop)
+        self.AppSettings.adult_result = False
+        self.AppSettings.image = True
+        self.AppSettings.image_dir = 'tests/nonexistent'
+        self.AppSettings.mode_settings = {'database_insert': True}
+
+        patch2 = patch('MangaTaggerLib.MangaTaggerLib.MetadataTable')
+        self.MetadataTable = patch2.start()
+        self.addCleanup(patch2.stop)
+
+        patch3 = patch('MangaTaggerLib.MangaTaggerLib.ProcSeriesTable')
+        patch3.start().processed_series = set()
+        self.addCleanup(patch3.stop)
+
+        patch4 = patch('MangaTaggerLib.MangaTaggerLib.download_cover_image')
+        self.download_cover_image = patch4.start()
+        self.addCleanup(patch4.stop)
+
+        patch5 = patch('MangaTaggerLib.models.AppSettings')
+        patch5.start().timezone = 'America/New_York'
+        self.addCleanup(patch5.stop)
+
+        patch6 = patch.object(MangaTaggerLib, 'load_exceptions', return_value={})
+        patch6.start()
+        self.addCleanup(patch6.stop)
+
+        patch7 = patch('MangaTaggerLib.MangaTaggerLib.UnmatchedSeriesTable')
+        self.UnmatchedSeriesTable = patch7.start()
+        self.UnmatchedSeriesTable.search.return_value = False
+        self.addCleanup(patch7.stop)
+
+    def tearDown(self) -> None:
+        AniList.close()
+        AniList.url = self.url
+        MangaTaggerLib._prefetched.clear()
+
+    def test_new_series_takes_one_request(self):
+        """
+        Tests that a series missing from the database is resolved, cover included, with a single Anilist request.
+        """
+        self.MetadataTable.search_by_search_value.return_value = None
+
+        series = MangaTaggerLib.resolve_series('BLEACH', 'MANGA', {})
+
+        self.assertEqual(1, self.stub.requests)
+        self.assertEqual('BLEACH', series.series_title)
+        self.assertTrue(series.metadata.cover_url.startswith('https://'))
+        self.MetadataTable.insert.assert_called_once()
+
+    def test_cached_series_cover_from_database(self):
+        """
+        Tests that the cover of a series in the database is downloaded from the stored URL without querying Anilist.
+        """
+        self.MetadataTable.search_by_search_value.return_value = None
+        document = dict(MangaTaggerLib.resolve_series('BLEACH', 'MANGA', {}).metadata.__dict__)
+        self.stub.requests = 0
+        self.MetadataTable.search_by_search_value.return_value = document
+
+        series = MangaTaggerLib.resolve_series('BLEACH', 'MANGA', {})
+
+        self.assertEqual(0, self.stub.requests)
+        self.download_cover_image.assert_called_with('BLEACH', document['cover_url'])
+        self.assertEqual(document['cover_url'], series.metadata.cover_url)
+
+    def test_legacy_document_gets_cover_url(self):
+        """
+        Tests that a document stored without a cover URL is looked up once and updated with it.
+        """
+        self.MetadataTable.search_by_search_value.return_value = None
+        document = dict(MangaTaggerLib.resolve_series('BLEACH', 'MANGA', {}).metadata.__dict__)
+        cover_url = document.pop('cover_url')
+        self.stub.requests = 0
+        self.MetadataTable.search_by_search_value.return_value = document
+
+        MangaTaggerLib.resolve_series('BLEACH', 'MANGA', {})
+
+        self.assertEqual(1, self.stub.requests)
+        self.MetadataTable.update.assert_called_once()
+        self.assertEqual(({'_id': document['_id']}, {'$set': {'cover_url': cover_url}}),
+                         self.MetadataTable.update.call_args.args[:2])
+        self.download_cover_image.assert_called_with('BLEACH', cover_url)
+
+    def test_prefetched_series_are_not_searched_again(self):
+        """
+        Tests that the series of queued chapters are looked up in one batch and then resolved without a request.
+        """
+        self.MetadataTable.search_by_search_value.return_value = None
+
+        MangaTaggerLib.prefetch_series(['downloads/BLEACH/BLEACH -.- Chapter 1.cbz',
+                                        'downloads/BLEACH/BLEACH -.- Chapter 2.cbz',
+                                        'downloads/Naruto/Naruto -.- Chapter 1.cbz',
+                                        'downloads/Unknown/Unknown Series -.- Chapter 1.cbz'])
+        self.assertEqual(1, self.stub.requests)
+
+        self.assertEqual('BLEACH', MangaTaggerLib.resolve_series('BLEACH', 'MANGA', {}).series_title)
+        self.assertEqual('NARUTO', MangaTaggerLib.resolve_series('Naruto', 'MANGA', {}).series_title)
+        self.assertEqual(1, self.stub.requests)
+
+        # Not found series are remembered like any other failed lookup, and results are only used once
+        self.assertEqual(('Unknown Series', 'MANGA'), self.UnmatchedSeriesTable.insert.call_args.args[:2])
+        self.assertEqual({}, MangaTaggerLib._prefetched)
+
+    def test_failed_prefetch_falls_back_to_single_lookups(self):
+        """
+        Tests that a batched lookup that fails in any way does not raise, and the series is then looked up on its own.
+        """
+        self.MetadataTable.search_by_search_value.return_value = None
+        for error in (AniListRateLimit(), ValueError('Expecting value: line 1 column 1 (char 0)')):
+            with patch.object(AniList, 'search_batch', side_effect=error):
+                MangaTaggerLib.prefetch_series(['downloads/BLEACH/BLEACH -.- Chapter 1.cbz'])
+
+        self.assertEqual('BLEACH', MangaTaggerLib.resolve_series('BLEACH', 'MANGA', {}).series_title)
+        self.assertEqual(1, self.stub.requests)
+
+    def test_prefetched_results_expire(self):
+        """
+        Tests that a prefetched result is looked up again once it is older than PREFETCH_TTL.
+        """
+        self.MetadataTable.search_by_search_value.return_value = None
+        MangaTaggerLib.prefetch_series(['downloads/BLEACH/BLEACH -.- Chapter 1.cbz'])
+
+        with patch.object(MangaTaggerLib, 'PREFETCH_TTL', 0):
+            MangaTaggerLib.resolve_series('BLEACH', 'MANGA', {})
+
+        self.assertEqual(2, self.stub.requests)
+
+    def test_speculative_prefetch_is_joined(self):
+        """
+        Tests that resolving a series waits for the prefetch started when its chapter appeared instead of repeating it.
+        """
+        self.MetadataTable.search_by_search_value.return_value = None
+        self.stub.latency = 0.3
+
+        prefetch = threading.Thread(target=MangaTaggerLib.prefetch_chapter_series,
+                                    args=('downloads/BLEACH/BLEACH -.- Chapter 1.cbz',))
+        prefetch.start()
+        self.addCleanup(prefetch.join)
+        while not MangaTaggerLib.SERIES_PREFETCHES.running(('BLEACH', 'MANGA')):
+            time.sleep(0.01)
+
+        self.assertEqual('BLEACH', MangaTaggerLib.resolve_series('BLEACH', 'MANGA', {}).series_title)
+        self.assertEqual(1, self.stub.requests)
+
+    def test_unmatched_series_is_remembered(self):
+        """
+        Tests that a series Anilist cannot find is recorded, and not looked up again while it is recorded.
+        """
+        self.MetadataTable.search_by_search_value.return_value = None
+        with self.assertRaises(MangaNotFoundError):
+            MangaTaggerLib.resolve_series('Unknown Series', 'MANGA', {})
+        self.assertEqual(1, self.stub.requests)
+        self.assertEqual(('Unknown Series', 'MANGA'), self.UnmatchedSeriesTable.insert.call_args.args[:2])
+
+        self.UnmatchedSeriesTable.search.return_value = True
+        with self.assertRaises(MangaNotFoundError):
+            MangaTaggerLib.resolve_series('Unknown Series', 'MANGA', {})
+        self.assertEqual(1, self.stub.requests)
+        self.MetadataTable.search_by_search_value.assert_called_once()
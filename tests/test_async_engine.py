@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import shutil
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from MangaTaggerLib import MangaTaggerLib
+from MangaTaggerLib.api import AniList, AsyncAniList
+from MangaTaggerLib.async_engine import AsyncEngine
+from MangaTaggerLib.task_queue import QueueWorker, QueueEvent, QueueEventOrigin
+from tests.anilist_stub import AniListStub
+
+
+class TestAsyncEngine(unittest.TestCase):
+    download_dir = Path('tests/downloads')
+
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.download_dir.mkdir()
+
+        patch1 = patch.object(MangaTaggerLib, 'tag_manga_chapter')
+        self.tag_manga_chapter = patch1.start()
+        self.addCleanup(patch1.stop)
+
+        patch2 = patch.object(MangaTaggerLib, 'remove_download_directory')
+        patch2.start()
+        self.addCleanup(patch2.stop)
+
+        patch3 = patch('MangaTaggerLib.task_queue.TaskQueueTable')
+        self.TaskQueueTable = patch3.start()
+        self.addCleanup(patch3.stop)
+
+        patch4 = patch.object(MangaTaggerLib, 'is_series_cached', return_value=False)
+        patch4.start()
+        self.addCleanup(patch4.stop)
+
+        self.resolved = []
+
+        async def resolve_series(engine, manga_title, format, logging_info):
+            self.resolved.append(manga_title)
+            await asyncio.sleep(0.1)
+            return manga_title
+
+        patch5 = patch.object(AsyncEngine, '_resolve_series', resolve_series)
+        patch5.start()
+        self.addCleanup(patch5.stop)
+
+        QueueWorker.engine = 'asyncio'
+        QueueWorker.async_concurrency = 8
+        QueueWorker.threads = 2
+        QueueWorker.max_queue_size = 0
+        QueueWorker.download_dir = self.download_dir
+        QueueWorker.initialize()
+
+    def tearDown(self) -> None:
+        QueueWorker.engine = 'threads'
+        shutil.rmtree(self.download_dir)
+
+    def _start(self):
+        QueueWorker._engine.start()
+        QueueWorker._settler.start()
+        QueueWorker._observer.start()
+
+    def _enqueue(self, name):
+        QueueWorker.enqueue(QueueEvent(Path('/nonexistent', name), QueueEventOrigin.SCAN))
+
+    def test_concurrent_chapters_share_lookup(self):
+        """
+        Tests that chapters of the same series in flight at the same time share a single metadata lookup.
+        """
+        for i in range(5):
+            self._enqueue(f'Naruto -.- Chapter {i}.cbz')
+        self._enqueue('BLEACH -.- Chapter 1.cbz')
+
+        self._start()
+        QueueWorker.join()
+
+        self.assertEqual(['BLEACH', 'Naruto'], sorted(self.resolved))
+        self.assertEqual(6, self.tag_manga_chapter.call_count)
+        self.assertEqual({'cached': 0, 'network': 0}, QueueWorker.queue_depths())
+        QueueWorker.exit()
+
+    def test_exit_saves_queued_events(self):
+        """
+        Tests that events which were never picked up stay in the journal when the engine stops.
+        """
+        self._enqueue('Naruto -.- Chapter 1.cbz')
+        self._enqueue('Naruto -.- Chapter 2.cbz')
+        QueueWorker._settler.start()
+        QueueWorker._observer.start()
+
+        QueueWorker.exit()
+
+        pending = [call.args[0][0].src_path.name for call in self.TaskQueueTable.record_pending.call_args_list
+                   if call.args[0]]
+        self.assertEqual(['Naruto -.- Chapter 1.cbz', 'Naruto -.- Chapter 2.cbz'], pending)
+        self.TaskQueueTable.record_completed.assert_not_called()
+        self.TaskQueueTable.flush.assert_called_once()
+        self.tag_manga_chapter.assert_not_called()
+        self.assertIsNone(QueueWorker._engine)
+
+
+class TestAsyncAniList(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.stub = AniListStub().start()
+        self.addCleanup(self.stub.stop)
+
+        patch1 = patch.multiple(AniList, url=self.stub.url, pool_size=3, read_timeout=7, cache=None)
+        patch1.start()
+        self.addCleanup(patch1.stop)
+
+        self.engine = AsyncEngine(4, 0, 1, lambda priority, event: None, lambda events: None, lambda events: None)
+        self.addCleanup(self.engine.stop, lambda: (2, 0, None))
+
+    def test_session_uses_anilist_settings(self):
+        """
+        Tests that the aiohttp session of the engine follows the configured connection pool size and timeouts.
+        """
+        self.assertEqual(3, AsyncAniList._session.connector.limit)
+        self.assertEqual(7, AsyncAniList._session.timeout.sock_read)
+        self.assertEqual(AniList.connect_timeout, AsyncAniList._session.timeout.sock_connect)
+
+    def test_searches(self):
+        """
+        Tests that series are looked up on Anilist through aiohttp, and that a series Anilist does not have is None.
+        """
+        bleach = self.engine._call(AsyncAniList.search_for_manga_title_by_id(30012, {}))
+        found = self.engine._call(AsyncAniList.search_for_manga_title_by_manga_title('BLEACH', 'MANGA', {}))
+        missing = self.engine._call(AsyncAniList.search_for_manga_title_by_manga_title('Nonexistent', 'MANGA', {}))
+
+        self.assertEqual('BLEACH', bleach['title']['romaji'])
+        self.assertEqual(30012, found['id'])
+        self.assertIsNone(missing)
+        self.assertEqual(3, self.stub.requests)
+
+    def test_search_batch(self):
+        """
+        Tests that a batch of series is looked up with one request, with None for the series Anilist does not have.
+        """
+        results = self.engine._call(AsyncAniList.search_batch([('BLEACH', 'MANGA', False, None),
+                                                               ('Nonexistent', 'MANGA', False, None)], {}))
+
+        self.assertEqual([30012, None], [result and result['id'] for result in results])
+        self.assertEqual(1, self.stub.requests)
@@ -0,0 +1,100 @@
+import logging
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from MangaTaggerLib import MangaTaggerLib
+from MangaTaggerLib.api import AniList
+from MangaTaggerLib.cache import ResponseCache
+from tests.anilist_stub import AniListStub
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.now = 1000.0
+        self.cache = self._open(ttl=60, max_size=10000)
+
+    def _open(self, ttl, max_size):
+        cache = ResponseCache(Path(self.directory, 'cache.sqlite3'), ttl, max_size, clock=lambda: self.now)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_hit_and_miss_are_counted(self):
+        """
+        Tests that a stored response is returned for the same query and variables, and that lookups are counted.
+        """
+        self.cache.put('query { Media }', {'id': 1}, {'Media': {'id': 1}})
+
+        self.assertEqual((True, {'Media': {'id': 1}}), self.cache.get('query  {\n Media }', {'id': 1}))
+        self.assertEqual((False, None), self.cache.get('query { Media }', {'id': 2}))
+        self.assertEqual({'hits': 1, 'misses': 1}, {key: self.cache.stats()[key] for key in ('hits', 'misses')})
+
+    def test_entries_expire(self):
+        """
+        Tests that a response is no longer returned once it is older than the TTL.
+        """
+        self.cache.put('query', {'id': 1}, {'Media': None})
+
+        self.now += 59
+        self.assertTrue(self.cache.get('query', {'id': 1})[0])
+        self.now += 1
+        self.assertFalse(self.cache.get('query', {'id': 1})[0])
+
+    def test_least_recently_used_are_evicted(self):
+        """
+        Tests that the least recently used responses are evicted once the cache grows past its size.
+        """
+        cache = self._open(ttl=60, max_size=150)
+        for i in range(3):
+            cache.put('query', {'id': i}, {'Media': {'description': 'x' * 20}})
+            self.now += 1
+        cache.get('query', {'id': 0})
+
+        cache.put('query', {'id': 3}, {'Media': {'description': 'x' * 20}})
+
+        self.assertTrue(cache.get('query', {'id': 0})[0])
+        self.assertFalse(cache.get('query', {'id': 1})[0])
+        self.assertLessEqual(cache.stats()['size'], 150)
+
+    def test_responses_persist(self):
+        """
+        Tests that responses survive reopening the cache file.
+        """
+        self.cache.put('query', {'id': 1}, {'Media': {'id': 1}})
+        self.cache.close()
+
+        self.assertEqual((True, {'Media': {'id': 1}}), self._open(ttl=60, max_size=10000).get('query', {'id': 1}))
+
+
+class TestAniListCache(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.stub = AniListStub().start()
+        self.addCleanup(self.stub.stop)
+
+        self.url = AniList.url
+        AniList.url = self.stub.url
+        AniList.cache = ResponseCache(Path(self.directory, 'cache.sqlite3'), 3600, 1024 * 1024)
+        AniList.initialize()
+
+    def tearDown(self) -> None:
+        AniList.close()
+        AniList.url = self.url
+
+    def test_repeated_queries_are_answered_from_cache(self):
+        """
+        Tests that id lookups are only sent to Anilist once, while failed matches are not cached, as
+        UnmatchedSeriesTable decides how long those are remembered.
+        """
+        for _ in range(3):
+            self.assertIsNone(AniList.search_for_manga_title_by_manga_title('Nonexistent', 'MANGA', {}))
+            self.assertEqual(30012, AniList.search_for_manga_title_by_id(30012, {})['id'])
+
+        self.assertEqual(4, self.stub.requests)
+        self.assertEqual(2, AniList.cache.stats()['hits'])
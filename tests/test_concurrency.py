@@ -0,0 +1,130 @@
+import threading
+import time
+import unittest
+
+from MangaTaggerLib.concurrency import KeyedLock, SingleFlight
+
+
+class TestKeyedLock(unittest.TestCase):
+    def test_same_key_is_exclusive(self):
+        """
+        Tests that a second thread waits for the holder of the same key and is handed the lock on release.
+        """
+        locks = KeyedLock()
+        acquired = threading.Event()
+
+        def waiter():
+            with locks.hold('key'):
+                acquired.set()
+
+        locks.acquire('key')
+        thread = threading.Thread(target=waiter)
+        thread.start()
+
+        self.assertFalse(acquired.wait(0.1))
+        released_at = time.perf_counter()
+        locks.release('key')
+
+        self.assertTrue(acquired.wait(1))
+        self.assertLess(time.perf_counter() - released_at, 0.5)
+        thread.join()
+
+    def test_different_keys_do_not_block(self):
+        """
+        Tests that holding one key does not block another key.
+        """
+        locks = KeyedLock()
+        locks.acquire('a')
+
+        self.assertTrue(locks.acquire('b', blocking=False))
+        self.assertFalse(locks.acquire('a', blocking=False))
+
+        locks.release('a')
+        locks.release('b')
+
+    def test_unused_locks_are_discarded(self):
+        """
+        Tests that a key's lock is dropped once nobody holds or waits on it.
+        """
+        locks = KeyedLock()
+        with locks.hold('key'):
+            self.assertTrue(locks.locked('key'))
+
+        self.assertFalse(locks.locked('key'))
+        self.assertEqual(0, len(locks))
+
+
+class TestSingleFlight(unittest.TestCase):
+    def _run_concurrently(self, flight, function, count=8):
+        barrier = threading.Barrier(count)
+        results = [None] * count
+
+        def caller(i):
+            barrier.wait()
+            try:
+                results[i] = flight.do('key', function)
+            except Exception as e:
+                results[i] = e
+
+        threads = [threading.Thread(target=caller, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_calls_share_result(self):
+        """
+        Tests that threads asking for the same key at once share a single call and its result.
+        """
+        flight = SingleFlight()
+        calls = []
+
+        def lookup():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'result'
+
+        results = self._run_concurrently(flight, lookup)
+
+        self.assertEqual(1, len(calls))
+        self.assertEqual(['result'] * 8, results)
+        self.assertEqual(0, len(flight))
+
+    def test_exception_is_shared(self):
+        """
+        Tests that every waiting thread receives the exception of the call, and that the next call runs again.
+        """
+        flight = SingleFlight()
+        error = ValueError('not found')
+
+        def lookup():
+            time.sleep(0.2)
+            raise error
+
+        results = self._run_concurrently(flight, lookup)
+
+        self.assertTrue(all(result is error for result in results))
+        self.assertEqual('again', flight.do('key', lambda: 'again'))
+
+    def test_wait_joins_running_call(self):
+        """
+        Tests that wait() returns once the running call of a key is done, and at once when none is running.
+        """
+        flight = SingleFlight()
+        started = threading.Event()
+        finished = []
+
+        def lookup():
+            started.set()
+            time.sleep(0.2)
+            finished.append(1)
+
+        thread = threading.Thread(target=flight.do, args=('key', lookup))
+        thread.start()
+        started.wait()
+        flight.wait('key')
+
+        self.assertEqual([1], finished)
+        flight.wait('other')
+        thread.join()
@@ -0,0 +1,558 @@
+import logging
+import time
+import unittest
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from pymongo import UpdateOne, DeleteOne
+from pymongo.errors import AutoReconnect, BulkWriteError, OperationFailure
+
+from MangaTaggerLib import MangaTaggerLib
+from MangaTaggerLib.database import MetadataTable, ProcFilesTable, ProcSeriesTable, TaskQueueTable, \
+    UnmatchedSeriesTable, _BulkWriter, _DocumentCache
+from MangaTaggerLib.task_queue import QueueEvent, QueueEventOrigin
+
+
+class TestBulkWriter(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.collection = MagicMock()
+
+    def test_flushes_after_interval(self):
+        """
+        Tests that buffered operations are written together once the flush interval has passed.
+        """
+        writer = _BulkWriter(self.collection, 'Test', flush_interval=0.05)
+        writer.start()
+        writer.append(DeleteOne({'_id': 1}), DeleteOne({'_id': 2}))
+        writer.append(DeleteOne({'_id': 3}))
+        time.sleep(0.2)
+
+        self.collection.bulk_write.assert_called_once()
+        self.assertEqual(3, len(self.collection.bulk_write.call_args.args[0]))
+        writer.stop()
+
+    def test_flushes_when_full(self):
+        """
+        Tests that the buffer is written without waiting for the interval once it holds max_operations.
+        """
+        writer = _BulkWriter(self.collection, 'Test', max_operations=2, flush_interval=60)
+        writer.start()
+        writer.append(DeleteOne({'_id': 1}), DeleteOne({'_id': 2}))
+        time.sleep(0.1)
+
+        self.collection.bulk_write.assert_called_once()
+        writer.stop()
+
+    def test_stop_flushes_remaining_operations(self):
+        """
+        Tests that stopping the writer saves whatever is still buffered, in order.
+        """
+        writer = _BulkWriter(self.collection, 'Test', flush_interval=60)
+        writer.start()
+        operations = [DeleteOne({'_id': 1}), DeleteOne({'_id': 1})]
+        writer.append(*operations)
+        writer.stop()
+
+        self.collection.bulk_write.assert_called_once_with(operations, ordered=True)
+
+    def test_rejected_write_drops_only_that_operation(self):
+        """
+        Tests that when the server rejects an operation of a bulk write, the operations after it are written again and
+        only the rejected one is dropped.
+        """
+        flushed = MagicMock()
+        rejected = MagicMock()
+        writer = _BulkWriter(self.collection, 'Test', flush_interval=60, flushed=flushed, rejected=rejected)
+        operations = [DeleteOne({'_id': 1}), DeleteOne({'_id': 2}), DeleteOne({'_id': 3}), DeleteOne({'_id': 4})]
+        self.collection.bulk_write.side_effect = [
+            BulkWriteError({'writeErrors': [{'index': 1, 'code': 11000, 'errmsg': 'duplicate key'}]}),
+            None
+        ]
+        writer.append(*operations)
+        writer.flush()
+
+        self.assertEqual(operations[2:], self.collection.bulk_write.call_args.args[0])
+        self.assertEqual([operations[:1], operations[2:]], [call.args[0] for call in flushed.call_args_list])
+        rejected.assert_called_once_with(operations[1:2])
+
+    def test_write_concern_error_keeps_writer_running(self):
+        """
+        Tests that a bulk write that was applied but not acknowledged as requested counts as saved, and that the
+        writer keeps writing afterwards.
+        """
+        flushed = MagicMock()
+        writer = _BulkWriter(self.collection, 'Test', flush_interval=0.05, flushed=flushed)
+        write_concern_error = {'code': 64, 'errmsg': 'waiting for replication timed out'}
+        self.collection.bulk_write.side_effect = [
+            BulkWriteError({'writeErrors': [], 'writeConcernErrors': [write_concern_error]}),
+            None
+        ]
+        writer.start()
+        writer.append(DeleteOne({'_id': 1}))
+        time.sleep(0.2)
+        writer.append(DeleteOne({'_id': 2}))
+        time.sleep(0.2)
+
+        self.assertEqual([[DeleteOne({'_id': 1})], [DeleteOne({'_id': 2})]],
+                         [call.args[0] for call in flushed.call_args_list])
+        writer.stop()
+
+    def test_connection_failure_keeps_operations(self):
+        """
+        Tests that operations which could not be sent because of a connection failure are written, in order, by the
+        next flush.
+        """
+        flushed = MagicMock()
+        writer = _BulkWriter(self.collection, 'Test', flush_interval=60, flushed=flushed)
+        self.collection.bulk_write.side_effect = [AutoReconnect('connection closed'), None]
+        writer.append(DeleteOne({'_id': 1}), DeleteOne({'_id': 2}))
+        writer.flush()
+        flushed.assert_not_called()
+
+        writer.append(DeleteOne({'_id': 3}))
+        writer.flush()
+
+        operations = [DeleteOne({'_id': 1}), DeleteOne({'_id': 2}), DeleteOne({'_id': 3})]
+        self.assertEqual(operations, self.collection.bulk_write.call_args.args[0])
+        flushed.assert_called_once_with(operations)
+
+
+class TestIndexes(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.collection = MagicMock()
+        for table in (MetadataTable, ProcFilesTable):
+            patcher = patch.multiple(table, _database=self.collection, _log=MagicMock())
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_lookups_are_indexed(self):
+        """
+        Tests that every field of the series search and the processed chapter lookup is covered by an index.
+        """
+        MetadataTable.ensure_indexes()
+        ProcFilesTable.ensure_indexes()
+
+        metadata_keys, files_keys = [[index.document['key'] for index in call.args[0]]
+                                     for call in self.collection.create_indexes.call_args_list]
+        self.assertIn({field: 1 for field in MetadataTable._search_value_filter('Title')}, metadata_keys)
+        self.assertIn({'series_title': 1, 'chapter_number': 1}, files_keys)
+        self.assertEqual(['series_title', 'chapter_number'], list(files_keys[0]))
+
+    def test_failure_is_not_fatal(self):
+        """
+        Tests that a table whose indexes cannot be created is still usable.
+        """
+        self.collection.create_indexes.side_effect = OperationFailure('Index with name: title already exists')
+
+        MetadataTable.ensure_indexes()
+
+        MetadataTable._log.warning.assert_called_once()
+
+    def test_tables_without_indexes_are_skipped(self):
+        """
+        Tests that no index is requested for tables that declare none.
+        """
+        with patch.object(ProcSeriesTable, '_database', self.collection):
+            ProcSeriesTable.ensure_indexes()
+
+        self.collection.create_indexes.assert_not_called()
+
+
+class TestSearchKeys(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.collection = MagicMock()
+        patcher = patch.multiple(MetadataTable, _database=self.collection, _log=MagicMock(),
+                                 _cache=_DocumentCache(16, 60))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_titles_are_normalized(self):
+        """
+        Tests that case, punctuation, whitespace and compatibility characters do not change the search key.
+        """
+        key = MetadataTable.search_key('Kaguya-sama: Love Is War')
+
+        self.assertEqual(key, MetadataTable.search_key('kaguya sama love is war'))
+        self.assertEqual(key, MetadataTable.search_key('ＫＡＧＵＹＡ－ＳＡＭＡ　ＬＯＶＥ ＩＳ ＷＡＲ'))
+        self.assertEqual('進撃の巨人', MetadataTable.search_key('進撃の巨人'))
+        self.assertEqual('!!', MetadataTable.search_key(' !! '))
+
+    def test_every_title_is_a_key(self):
+        """
+        Tests that the search keys cover the search value, every title and every synonym, once each.
+        """
+        document = {'search_value': 'bleach', 'series_title': 'BLEACH', 'series_title_eng': 'Bleach',
+                    'series_title_jap': 'BLEACH', 'synonyms': ['Burīchi', 'Bleach!'], 'description': 'Ichigo'}
+
+        self.assertEqual(['bleach', 'burīchi'], MetadataTable.search_keys(document))
+
+    def test_lookup_is_one_equality(self):
+        """
+        Tests that a series is looked up by the search key of the title alone.
+        """
+        MetadataTable.search_by_search_value('Naruto ')
+
+        self.collection.find_one.assert_called_once_with({'search_keys': 'naruto'})
+
+    def test_legacy_documents_are_migrated(self):
+        """
+        Tests that documents without search keys get them in bulk.
+        """
+        self.collection.find.return_value = [{'_id': i, 'search_value': f'Series {i}', 'series_title': 'Title',
+                                              'series_title_eng': None, 'synonyms': []} for i in range(3)]
+
+        MetadataTable.migrate_search_keys(chunk_size=2)
+
+        batches = [call.args[0] for call in self.collection.bulk_write.call_args_list]
+        self.assertEqual([2, 1], [len(batch) for batch in batches])
+        self.assertEqual(UpdateOne({'_id': 2}, {'$set': {'search_keys': ['series2', 'title']}}), batches[1][0])
+
+
+class TestMetadataCache(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.now = 0.0
+        self.collection = MagicMock()
+        self.collection.find_one.side_effect = lambda query, *args: {
+            '_id': 30012, 'series_title': 'BLEACH', 'search_keys': ['bleach'], 'staff': {'story': {}}}
+        self.cache = _DocumentCache(2, 60, clock=lambda: self.now)
+        patcher = patch.multiple(MetadataTable, _database=self.collection, _log=MagicMock(), _cache=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_chapters_of_known_series_share_one_read(self):
+        """
+        Tests that the chapters of a series already in the database cost one read between them, whichever way the
+        series is looked up.
+        """
+        for _ in range(200):
+            self.assertEqual('BLEACH', MetadataTable.search_by_search_value('Bleach')['series_title'])
+        MetadataTable.search_by_search_id(30012)
+        MetadataTable.search_series_title('BLEACH')
+
+        self.assertEqual(1, self.collection.find_one.call_count)
+        self.assertEqual({'hits': 201, 'misses': 1, 'entries': 1}, MetadataTable.cache_stats())
+
+    def test_returned_documents_are_copies(self):
+        """
+        Tests that modifying a returned document does not change the cached one.
+        """
+        MetadataTable.search_by_search_value('BLEACH')['staff']['story']['Tite Kubo'] = 1
+
+        self.assertEqual({}, MetadataTable.search_by_search_value('BLEACH')['staff']['story'])
+
+    def test_entries_expire(self):
+        """
+        Tests that a document is read again once it is older than the TTL.
+        """
+        MetadataTable.search_by_search_value('BLEACH')
+        self.now += 60
+        MetadataTable.search_by_search_value('BLEACH')
+
+        self.assertEqual(2, self.collection.find_one.call_count)
+
+    def test_least_recently_used_are_evicted(self):
+        """
+        Tests that the least recently used document is dropped, with its lookup keys, once the cache is full.
+        """
+        for document_id in (1, 2, 1, 3):
+            self.cache.put({'_id': document_id}, f'key {document_id}')
+
+        self.assertIsNone(self.cache.get('key 2'))
+        self.assertEqual({'_id': 1}, self.cache.get('key 1'))
+        self.assertNotIn('key 2', self.cache._keys)
+
+    def test_writes_invalidate(self):
+        """
+        Tests that updating or inserting a series makes the next lookup read it again.
+        """
+        MetadataTable.search_by_search_value('BLEACH')
+        MetadataTable.update({'_id': 30012}, {'$set': {'cover_url': 'url'}}, {})
+        MetadataTable.search_by_search_value('BLEACH')
+        MetadataTable.insert({'_id': 30012}, {})
+        MetadataTable.search_by_search_value('BLEACH')
+
+        self.assertEqual(3, self.collection.find_one.call_count)
+
+
+class TestProcFilesTable(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.collection = MagicMock()
+        self.collection.find_one.return_value = None
+        self.collection.find.return_value = []
+        patcher = patch.multiple(ProcFilesTable, _database=self.collection, _log=MagicMock(), _pending={})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        ProcFilesTable._writer = _BulkWriter(self.collection, 'Test', flush_interval=60,
+                                             flushed=ProcFilesTable._flushed, rejected=ProcFilesTable._flushed)
+        self.addCleanup(setattr, ProcFilesTable, '_writer', None)
+
+    def _insert(self, chapter, old_filename):
+        ProcFilesTable.insert_record(Path(old_filename), Path(f'BLEACH {chapter}.cbz'), 'BLEACH', chapter, {})
+
+    def test_records_are_written_in_bulk(self):
+        """
+        Tests that the records of processed chapters are written together rather than one write per chapter.
+        """
+        self._insert('001', 'BLEACH -.- Chapter 1.cbz')
+        self._insert('002', 'BLEACH -.- Chapter 2.cbz')
+        self.collection.insert_one.assert_not_called()
+
+        ProcFilesTable.flush()
+
+        self.collection.bulk_write.assert_called_once()
+        self.assertEqual(2, len(self.collection.bulk_write.call_args.args[0]))
+
+    def test_unwritten_records_are_found(self):
+        """
+        Tests that records still waiting to be written are returned by the searches, and read from the database
+        once written.
+        """
+        self._insert('001', 'BLEACH -.- Chapter 1.cbz')
+
+        self.assertEqual('BLEACH 001.cbz', ProcFilesTable.search('BLEACH', '001')['new_filename'])
+        self.assertEqual({'BLEACH -.- Chapter 1.cbz'},
+                         ProcFilesTable.search_old_filenames(['BLEACH -.- Chapter 1.cbz', 'Other.cbz']))
+        self.collection.find_one.assert_not_called()
+
+        ProcFilesTable.flush()
+
+        self.assertIsNone(ProcFilesTable.search('BLEACH', '001'))
+        self.collection.find_one.assert_called_once()
+
+    def test_update_of_unwritten_record(self):
+        """
+        Tests that a record updated before it was written is updated by its chapter after being inserted.
+        """
+        self._insert('001', 'BLEACH -.- Chapter 1.cbz')
+        record = ProcFilesTable.search('BLEACH', '001')
+        ProcFilesTable.update_record(record, Path('BLEACH -.- Chapter 1 v2.cbz'), Path('BLEACH 001.cbz'), {})
+
+        self.assertEqual('BLEACH -.- Chapter 1 v2.cbz', ProcFilesTable.search('BLEACH', '001')['old_filename'])
+        ProcFilesTable.flush()
+
+        insert, update = self.collection.bulk_write.call_args.args[0]
+        self.assertEqual({'series_title': 'BLEACH', 'chapter_number': '001'}, update._filter)
+        self.assertEqual({}, ProcFilesTable._pending)
+
+    def test_failed_write_keeps_records(self):
+        """
+        Tests that records which could not be written are still found for the rest of the run.
+        """
+        self.collection.bulk_write.side_effect = OperationFailure('not primary')
+        self._insert('001', 'BLEACH -.- Chapter 1.cbz')
+
+        ProcFilesTable.flush()
+
+        self.assertIsNotNone(ProcFilesTable.search('BLEACH', '001'))
+
+    def test_rejected_records_are_forgotten(self):
+        """
+        Tests that a record the server refused is no longer kept in memory, while the records after it are written.
+        """
+        self.collection.bulk_write.side_effect = [
+            BulkWriteError({'writeErrors': [{'index': 0, 'code': 11000, 'errmsg': 'duplicate key'}]}),
+            None
+        ]
+        self._insert('001', 'BLEACH -.- Chapter 1.cbz')
+        self._insert('002', 'BLEACH -.- Chapter 2.cbz')
+
+        ProcFilesTable.flush()
+
+        self.assertEqual(2, self.collection.bulk_write.call_count)
+        self.assertEqual({}, ProcFilesTable._pending)
+
+    def test_records_are_written_after_reconnecting(self):
+        """
+        Tests that records which could not be written while the connection was down are written by the next flush,
+        and read from the database from then on.
+        """
+        self.collection.bulk_write.side_effect = [AutoReconnect('connection closed'), None]
+        self._insert('001', 'BLEACH -.- Chapter 1.cbz')
+
+        ProcFilesTable.flush()
+        self.assertIn(('BLEACH', '001'), ProcFilesTable._pending)
+
+        ProcFilesTable.flush()
+        self.assertEqual(2, self.collection.bulk_write.call_count)
+        self.assertEqual({}, ProcFilesTable._pending)
+
+
+class TestProcSeriesTable(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.collection = MagicMock()
+        self.writer = _BulkWriter(self.collection, 'Test', flush_interval=60)
+        patcher = patch.multiple(ProcSeriesTable, _database=self.collection, _log=MagicMock(), _writer=self.writer,
+                                 processed_series=set())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_only_new_series_are_written(self):
+        """
+        Tests that saving writes one upsert per series processed since the last save.
+        """
+        ProcSeriesTable.add('BLEACH')
+        ProcSeriesTable.add('BLEACH')
+        ProcSeriesTable.add('NARUTO')
+        ProcSeriesTable.save()
+        ProcSeriesTable.add('NARUTO')
+        ProcSeriesTable.save()
+
+        self.collection.bulk_write.assert_called_once()
+        operations = self.collection.bulk_write.call_args.args[0]
+        self.assertEqual([{'_id': 'BLEACH'}, {'_id': 'NARUTO'}], [operation._filter for operation in operations])
+        self.assertTrue(all(operation._upsert for operation in operations))
+
+    def test_legacy_document_is_split(self):
+        """
+        Tests that the single document of a previous version is loaded, rewritten as one document per series and
+        then deleted.
+        """
+        legacy_id = object()
+        self.collection.find.return_value = [{'_id': 'BLEACH'}, {'_id': legacy_id, 'NARUTO': True, 'BLEACH': True}]
+
+        ProcSeriesTable.load()
+
+        self.assertEqual({'BLEACH', 'NARUTO'}, ProcSeriesTable.processed_series)
+        upserts = self.collection.bulk_write.call_args.args[0]
+        self.assertEqual([{'_id': 'NARUTO'}, {'_id': 'BLEACH'}], [operation._filter for operation in upserts])
+        self.collection.delete_one.assert_called_once_with({'_id': legacy_id})
+
+    def test_failed_migration_keeps_legacy_document(self):
+        """
+        Tests that the old document is kept when the series could not be written, so no series is lost.
+        """
+        self.collection.find.return_value = [{'_id': object(), 'NARUTO': True}]
+        self.collection.bulk_write.side_effect = OperationFailure('not primary')
+
+        ProcSeriesTable.load()
+
+        self.assertEqual({'NARUTO'}, ProcSeriesTable.processed_series)
+        self.collection.delete_one.assert_not_called()
+
+
+class TestTaskQueueTable(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.collection = MagicMock()
+        TaskQueueTable._log = logging.getLogger(TaskQueueTable.__name__)
+        TaskQueueTable._database = self.collection
+        TaskQueueTable._writer = _BulkWriter(self.collection, 'Test', flush_interval=60)
+
+    def tearDown(self) -> None:
+        TaskQueueTable._writer = None
+
+    def test_event_lifecycle(self):
+        """
+        Tests that journal records are keyed by the chapter path and removed once the chapter is completed.
+        """
+        event = QueueEvent(Path('/downloads/Series/Series -.- Chapter 1.cbz'), QueueEventOrigin.SCAN)
+        TaskQueueTable.record_pending([event])
+        TaskQueueTable.record_started([event])
+        TaskQueueTable.record_completed([event])
+        TaskQueueTable.flush()
+
+        key = str(Path('/downloads/Series/Series -.- Chapter 1.cbz').absolute())
+        pending, started, completed = self.collection.bulk_write.call_args.args[0]
+        self.assertEqual(UpdateOne({'_id': key}, {'$set': dict(event.dictionary(), state='pending')}, upsert=True),
+                         pending)
+        self.assertEqual(UpdateOne({'_id': key}, {'$set': {'state': 'started'}}), started)
+        self.assertEqual(DeleteOne({'_id': key}), completed)
+
+    def test_journal_is_kept_while_disconnected(self):
+        """
+        Tests that journal records which could not be sent while the connection was down are reported as unsaved and
+        written, in order, once it is back.
+        """
+        self.collection.bulk_write.side_effect = [AutoReconnect('connection closed'), None]
+        event = QueueEvent(Path('/downloads/Series/Series -.- Chapter 1.cbz'), QueueEventOrigin.SCAN)
+        TaskQueueTable.record_pending([event])
+        self.assertFalse(TaskQueueTable.flush())
+
+        TaskQueueTable.record_started([event])
+        self.assertTrue(TaskQueueTable.flush())
+
+        key = str(Path('/downloads/Series/Series -.- Chapter 1.cbz').absolute())
+        self.assertEqual([UpdateOne({'_id': key}, {'$set': dict(event.dictionary(), state='pending')}, upsert=True),
+                          UpdateOne({'_id': key}, {'$set': {'state': 'started'}})],
+                         self.collection.bulk_write.call_args.args[0])
+
+    def test_load_migrates_legacy_tasks(self):
+        """
+        Tests that tasks saved by the previous save-on-exit format are loaded and removed in favour of the journal.
+        """
+        self.collection.find.return_value = [
+            {'_id': 'legacy', 'event_type': 'existing', 'src_path': '/downloads/a.cbz', 'manga_chapter': 'a'},
+            {'_id': '/downloads/b.cbz', 'event_type': 'existing', 'src_path': '/downloads/b.cbz',
+             'manga_chapter': 'b', 'state': 'pending'},
+        ]
+        task_list = {}
+        TaskQueueTable.load(task_list)
+        TaskQueueTable.flush()
+
+        self.assertEqual([str(Path('/downloads/a.cbz').absolute()), '/downloads/b.cbz'], sorted(task_list))
+        self.collection.bulk_write.assert_called_once_with([DeleteOne({'_id': 'legacy'})], ordered=True)
+
+    def test_load_keeps_chapters_with_the_same_name(self):
+        """
+        Tests that chapters of different series with the same file name are both restored.
+        """
+        self.collection.find.return_value = [
+            {'_id': f'/downloads/{series}/Chapter 1.cbz', 'event_type': 'existing',
+             'src_path': f'/downloads/{series}/Chapter 1.cbz', 'manga_chapter': 'Chapter 1', 'state': 'pending'}
+            for series in ('A', 'B')
+        ]
+        task_list = {}
+        TaskQueueTable.load(task_list)
+
+        self.assertEqual(['/downloads/A/Chapter 1.cbz', '/downloads/B/Chapter 1.cbz'], sorted(task_list))
+
+
+class TestUnmatchedSeriesTable(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.collection = MagicMock()
+        UnmatchedSeriesTable._log = logging.getLogger(UnmatchedSeriesTable.__name__)
+        UnmatchedSeriesTable._database = self.collection
+        UnmatchedSeriesTable._entries = {}
+
+    def test_entry_matches_same_exception(self):
+        """
+        Tests that a recorded series is found for the same format and exceptions.json fingerprint only.
+        """
+        UnmatchedSeriesTable.insert('Unknown', 'MANGA', 'fingerprint')
+
+        self.assertTrue(UnmatchedSeriesTable.search('Unknown', 'MANGA', 'fingerprint'))
+        self.assertFalse(UnmatchedSeriesTable.search('Unknown', 'ONE_SHOT', 'fingerprint'))
+        document = self.collection.update_one.call_args.args[1]['$set']
+        self.assertEqual('fingerprint', document['exception'])
+
+    def test_changed_exception_invalidates_entry(self):
+        """
+        Tests that an entry is dropped once the exceptions.json entry of its series changes.
+        """
+        UnmatchedSeriesTable.insert('Unknown', 'MANGA', 'fingerprint')
+
+        self.assertFalse(UnmatchedSeriesTable.search('Unknown', 'MANGA', 'new fingerprint'))
+        self.assertFalse(UnmatchedSeriesTable.search('Unknown', 'MANGA', 'fingerprint'))
+        self.collection.delete_one.assert_called_once_with({'_id': 'MANGA:Unknown'})
+
+    def test_expired_entries_are_ignored(self):
+        """
+        Tests that an entry loaded from the database is ignored once it has expired.
+        """
+        now = datetime.utcnow()
+        self.collection.find.return_value = [
+            {'_id': 'MANGA:Fresh', 'exception': 'fingerprint', 'expires': now + timedelta(hours=1)},
+            {'_id': 'MANGA:Stale', 'exception': 'fingerprint', 'expires': now - timedelta(seconds=1)},
+        ]
+        UnmatchedSeriesTable.load()
+
+        self.assertTrue(UnmatchedSeriesTable.search('Fresh', 'MANGA', 'fingerprint'))
+        self.assertFalse(UnmatchedSeriesTable.search('Stale', 'MANGA', 'fingerprint'))
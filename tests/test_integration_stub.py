@@ -0,0 +1,34 @@
+import logging
+
+from MangaTaggerLib.api import AniList
+from MangaTaggerLib.MangaTaggerLib import metadata_tagger
+from MangaTaggerLib.errors import MangaNotFoundError
+from tests import test_integration
+from tests.anilist_stub import AniListStub
+
+
+# noinspection DuplicatedCode
+class TestMetadataStub(test_integration.TestMetadata):
+    """
+    The integration tests of test_integration, with lookups answered by the local Anilist stand-in from the series in
+    tests/data instead of the live API.
+    """
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.stub = AniListStub(self.data_dir).start()
+        self.addCleanup(self.stub.stop)
+        self.addCleanup(setattr, AniList, 'url', AniList.url)
+        AniList.url = self.stub.url
+        self.addCleanup(AniList.close)
+        super().setUp()
+
+    def test_metadata_case_5(self):
+        title = 'Naruto'
+
+        self.MangaTaggerLib_AppSettings.mode_settings = {'write_comicinfo': False}
+        self.MangaTaggerLib_AppSettings.mode_settings = {'rename_file': False}
+
+        # The stand-in has no one-shot of the series; the manga itself must not be returned for it
+        with self.assertRaises(MangaNotFoundError):
+            metadata_tagger("NOWHERE", title, '001', "ONE_SHOT", {}, None)
+
@@ -1,11 +1,13 @@
 import unittest
 import logging
 import shutil
+import threading
+import time
 from pathlib import Path
-from typing import List
 from unittest.mock import patch
 
-from MangaTaggerLib.MangaTaggerLib import filename_parser, rename_action
+from MangaTaggerLib.MangaTaggerLib import filename_parser, rename_action, locked_rename_action, RENAME_LOCKS, \
+    process_manga_batch, metadata_tagger
 from MangaTaggerLib.errors import FileAlreadyProcessedError, FileUpdateNotRequiredError
 from tests.database import ProcFilesTable as ProcFilesTableTest
 
@@ -83,16 +85,13 @@ class TestMangaRenameAction(unittest.TestCase):
         shutil.rmtree(self.library_dir)
 
     @patch('MangaTaggerLib.MangaTaggerLib.ProcFilesTable')
-    @patch('MangaTaggerLib.MangaTaggerLib.CURRENTLY_PENDING_RENAME', new_callable=list)
-    def test_rename_action_initial(self, CURRENTLY_PENDING_RENAME: List, ProcFilesTable):
+    def test_rename_action_initial(self, ProcFilesTable):
         """
         Tests for initial file rename when no results are returned from the database. Test should execute without error.
         """
         self.current_file.touch()
         ProcFilesTable.search = ProcFilesTableTest.search_return_no_results
 
-        CURRENTLY_PENDING_RENAME.append(self.new_file)
-
         self.assertFalse(rename_action(self.current_file, self.new_file, 'Absolute Boyfriend', '01', {}))
 
     @patch('MangaTaggerLib.MangaTaggerLib.ProcFilesTable')
@@ -134,8 +133,7 @@ class TestMangaRenameAction(unittest.TestCase):
             rename_action(self.current_file, self.new_file, 'Absolute Boyfriend', '01', {})
 
     @patch('MangaTaggerLib.MangaTaggerLib.ProcFilesTable')
-    @patch('MangaTaggerLib.MangaTaggerLib.CURRENTLY_PENDING_RENAME', new_callable=list)
-    def test_rename_action_upgrade(self, CURRENTLY_PENDING_RENAME: List, ProcFilesTable):
+    def test_rename_action_upgrade(self, ProcFilesTable):
         """
         Tests for version in file rename when results are returned from the database. Since the current file is a
         higher version than the exisitng file, test should execute without error.
@@ -144,11 +142,59 @@ class TestMangaRenameAction(unittest.TestCase):
         self.current_file.touch()
 
         self.new_file.touch()
-        CURRENTLY_PENDING_RENAME.append(self.new_file)
 
         ProcFilesTable.search = ProcFilesTableTest.search_return_results_version
 
         self.assertFalse(rename_action(self.current_file, self.new_file, 'Absolute Boyfriend', '01', {}))
 
+    @patch('MangaTaggerLib.MangaTaggerLib.ProcFilesTable')
+    def test_locked_rename_action_releases_lock(self, ProcFilesTable):
+        """
+        Tests that the target filename is unlocked once the rename has finished, even when the rename fails.
+        """
+        self.current_file.touch()
+        ProcFilesTable.search = ProcFilesTableTest.search_return_results
+
+        with self.assertRaises(FileAlreadyProcessedError):
+            locked_rename_action(self.current_file, self.new_file, 'Absolute Boyfriend', '01', {})
+
+        self.assertFalse(RENAME_LOCKS.locked(self.new_file))
+
+
+class TestProcessMangaBatch(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+
+    @patch('MangaTaggerLib.MangaTaggerLib.AppSettings')
+    @patch('MangaTaggerLib.MangaTaggerLib.tag_manga_chapter')
+    @patch('MangaTaggerLib.MangaTaggerLib.resolve_series')
+    def test_metadata_resolved_once_per_series(self, resolve_series, tag_manga_chapter, AppSettings):
+        """
+        Tests that a batch of chapters from one series resolves the series metadata only once.
+        """
+        chapters = [(Path(f'tests/downloads/Naruto/Naruto -.- Chapter {i}.cbz'), i) for i in range(1, 4)]
+        chapters.append((Path('tests/downloads/Bleach/BLEACH -.- Chapter 1.cbz'), 4))
+
+        process_manga_batch(chapters)
+
+        self.assertEqual([('Naruto', 'MANGA'), ('BLEACH', 'MANGA')],
+                         [call.args[:2] for call in resolve_series.call_args_list])
+        self.assertEqual(4, tag_manga_chapter.call_count)
+
+    @patch('MangaTaggerLib.MangaTaggerLib.tag_manga_chapter')
+    @patch('MangaTaggerLib.MangaTaggerLib.resolve_series')
+    def test_concurrent_chapters_share_lookup(self, resolve_series, tag_manga_chapter):
+        """
+        Tests that threads tagging chapters of the same series at once wait for a single metadata lookup.
+        """
+        resolve_series.side_effect = lambda *args: time.sleep(0.2) or 'series'
 
+        threads = [threading.Thread(target=metadata_tagger, args=(f'Naruto -.- Chapter {i}.cbz', 'Naruto', i,
+                                                                  'MANGA', {}, None)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
 
+        resolve_series.assert_called_once()
+        self.assertEqual(['series'] * 4, [call.args[1] for call in tag_manga_chapter.call_args_list])
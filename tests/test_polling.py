@@ -0,0 +1,97 @@
+import logging
+import os
+import shutil
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from watchdog.observers.api import EventQueue, ObservedWatch
+
+from MangaTaggerLib.polling import DirectoryPollingEmitter
+
+
+class TestDirectoryPollingEmitter(unittest.TestCase):
+    download_dir = Path('tests/downloads')
+
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.download_dir.mkdir()
+        for series in ('BLEACH', 'Naruto', 'One Piece'):
+            Path(self.download_dir, series).mkdir()
+            Path(self.download_dir, series, f'{series} -.- Chapter 1.cbz').write_bytes(b'0')
+
+        self.queue = EventQueue()
+        self.emitter = DirectoryPollingEmitter(self.queue, ObservedWatch(str(self.download_dir), True), workers=2)
+        self.emitter.on_thread_start()
+
+    def tearDown(self) -> None:
+        self.emitter.on_thread_stop()
+        shutil.rmtree(self.download_dir)
+
+    def _touch(self, path: Path):
+        # Moves the modification time forward so the change is seen on filesystems with a coarse mtime resolution
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    def _events(self):
+        self.emitter.queue_events(0)
+        events = []
+        while not self.queue.empty():
+            event, _ = self.queue.get_nowait()
+            events.append((event.event_type, Path(event.src_path).name))
+        return events
+
+    def test_no_events_without_changes(self):
+        """
+        Tests that polling an unchanged directory does not report anything.
+        """
+        self.assertEqual([], self._events())
+
+    def test_new_chapter_is_reported(self):
+        """
+        Tests that a chapter added to an existing series directory is reported as created.
+        """
+        Path(self.download_dir, 'Naruto', 'Naruto -.- Chapter 2.cbz').write_bytes(b'0')
+        Path(self.download_dir, 'Naruto', 'Naruto -.- Chapter 2.part').write_bytes(b'0')
+        self._touch(Path(self.download_dir, 'Naruto'))
+
+        self.assertEqual([('created', 'Naruto -.- Chapter 2.cbz')], self._events())
+
+    def test_new_series_directory_is_reported(self):
+        """
+        Tests that the chapters of a new series directory are reported as created.
+        """
+        Path(self.download_dir, 'Berserk').mkdir()
+        Path(self.download_dir, 'Berserk', 'Berserk -.- Chapter 1.cbz').write_bytes(b'0')
+        self._touch(self.download_dir)
+
+        self.assertEqual([('created', 'Berserk -.- Chapter 1.cbz')], self._events())
+
+    def test_only_changed_directories_are_listed(self):
+        """
+        Tests that directories whose modification time did not change are not listed again.
+        """
+        # Every directory is listed once more after the initial snapshot
+        self._events()
+
+        Path(self.download_dir, 'BLEACH', 'BLEACH -.- Chapter 2.cbz').write_bytes(b'0')
+        self._touch(Path(self.download_dir, 'BLEACH'))
+
+        with patch.object(DirectoryPollingEmitter, '_list', wraps=DirectoryPollingEmitter._list) as listing:
+            self._events()
+        self.assertEqual([str(Path(self.download_dir, 'BLEACH'))], [call.args[0] for call in listing.call_args_list])
+
+        with patch.object(DirectoryPollingEmitter, '_list', wraps=DirectoryPollingEmitter._list) as listing:
+            self._events()
+            # Listed once more after a change, then left alone
+            self._events()
+        self.assertEqual(1, listing.call_count)
+
+    def test_removed_series_directory_is_reported(self):
+        """
+        Tests that the chapters of a removed series directory are reported as deleted.
+        """
+        shutil.rmtree(Path(self.download_dir, 'One Piece'))
+        self._touch(self.download_dir)
+
+        self.assertEqual([('deleted', 'One Piece -.- Chapter 1.cbz'), ('deleted', 'One Piece')], self._events())
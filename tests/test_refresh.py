@@ -0,0 +1,79 @@
+import logging
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+
+from MangaTaggerLib import MangaTaggerLib
+from MangaTaggerLib.api import AniList
+from MangaTaggerLib.refresh import MetadataRefresher
+from tests.anilist_stub import AniListStub
+
+
+class TestMetadataRefresher(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.stub = AniListStub().start()
+        self.addCleanup(self.stub.stop)
+
+        self.url = AniList.url
+        AniList.url = self.stub.url
+        AniList.initialize()
+
+        patch1 = patch('MangaTaggerLib.refresh.MetadataTable')
+        self.MetadataTable = patch1.start()
+        self.addCleanup(patch1.stop)
+
+        patch2 = patch('MangaTaggerLib.models.AppSettings')
+        patch2.start().timezone = 'America/New_York'
+        self.addCleanup(patch2.stop)
+
+        self.documents = [
+            {'_id': 30012, 'search_value': 'BLEACH', 'series_title': 'Old Title'},
+            {'_id': 99999999, 'search_value': 'Removed', 'series_title': 'Removed'}
+        ]
+        self.MetadataTable.search_stale.return_value = self.documents
+        self.refresher = MetadataRefresher(lambda: False, series_per_interval=2, quota_share=1.0)
+        self.refresher.request_spacing = lambda: 0
+
+    def tearDown(self) -> None:
+        AniList.close()
+        AniList.url = self.url
+
+    def test_stale_series_are_refreshed(self):
+        """
+        Tests that the oldest series are refreshed from Anilist without changing their titles, and that series Anilist
+        no longer has only get a new scrape time.
+        """
+        self.assertEqual(1, self.refresher.refresh_stale())
+        self.assertEqual(2, self.MetadataTable.search_stale.call_args.args[1])
+
+        refreshed, removed = self.MetadataTable.update.call_args_list
+        self.assertEqual({'_id': 30012}, refreshed.args[0])
+        fields = refreshed.args[1]['$set']
+        self.assertNotIn('series_title', fields)
+        self.assertNotIn('search_value', fields)
+        self.assertEqual('https://anilist.co/manga/30012', fields['anilist_url'])
+        self.assertIsInstance(fields['scrape_time'], datetime)
+        self.assertEqual(['scrape_time'], list(removed.args[1]['$set']))
+
+    def test_waits_while_chapters_are_queued(self):
+        """
+        Tests that nothing is refreshed while chapters are queued, and that refreshing stops with the refresher.
+        """
+        refresher = MetadataRefresher(lambda: True, idle_check=0.01)
+        refresher.request_spacing = lambda: 0
+        patcher = patch.object(refresher._stopped, 'wait', side_effect=[False, True])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.assertEqual(0, refresher.refresh_stale())
+        self.assertEqual(0, self.stub.requests)
+        self.MetadataTable.update.assert_not_called()
+
+    def test_requests_are_spaced_by_quota_share(self):
+        """
+        Tests that refreshing is limited to its share of the Anilist rate limit.
+        """
+        refresher = MetadataRefresher(lambda: False, quota_share=0.1)
+        with patch.object(AniList.rate_limiter, 'limit', 90):
+            self.assertAlmostEqual(60 / 9, refresher.request_spacing())
@@ -0,0 +1,95 @@
+import logging
+import os
+import shutil
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from MangaTaggerLib import MangaTaggerLib
+from MangaTaggerLib.scanner import DownloadScanner
+
+
+class TestDownloadScanner(unittest.TestCase):
+    download_dir = Path('tests/downloads')
+    state_path = Path('tests/scan_state.json')
+
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.download_dir.mkdir()
+        for series in ('BLEACH', 'Naruto'):
+            Path(self.download_dir, series).mkdir()
+            for chapter in range(1, 3):
+                Path(self.download_dir, series, f'{series} -.- Chapter {chapter}.cbz').write_bytes(b'0')
+        # Names ending in c/b/z used to be mangled by strip('.cbz')
+        Path(self.download_dir, 'Naruto', 'cover.jpg').write_bytes(b'0')
+
+        patch1 = patch('MangaTaggerLib.scanner.ProcFilesTable')
+        self.ProcFilesTable = patch1.start()
+        self.ProcFilesTable.search_old_filenames.return_value = set()
+        self.addCleanup(patch1.stop)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.download_dir)
+        if self.state_path.exists():
+            self.state_path.unlink()
+
+    def _scan(self, known_paths=frozenset()):
+        scanner = DownloadScanner(self.download_dir, self.state_path, workers=2)
+        chapters = scanner.scan(set(known_paths))
+        scanner.save_state()
+        return sorted(chapter.name for chapter in chapters)
+
+    def test_first_scan_finds_every_chapter(self):
+        """
+        Tests that every chapter is found when there is no scan state yet.
+        """
+        self.assertEqual(['BLEACH -.- Chapter 1.cbz', 'BLEACH -.- Chapter 2.cbz',
+                          'Naruto -.- Chapter 1.cbz', 'Naruto -.- Chapter 2.cbz'], self._scan())
+
+    def test_unchanged_directories_are_skipped(self):
+        """
+        Tests that a later scan only lists directories whose modification time changed, and returns nothing for
+        unchanged directories whose chapters are all queued.
+        """
+        self._scan()
+        queued = {str(chapter.absolute()) for chapter in self.download_dir.glob('*/*.cbz')}
+        with patch.object(DownloadScanner, '_list_chapters', autospec=True,
+                          side_effect=DownloadScanner._list_chapters) as list_chapters:
+            self.assertEqual([], self._scan(queued))
+            list_chapters.assert_not_called()
+
+            # Added without changing the modification time, so the directory is not listed
+            naruto = Path(self.download_dir, 'Naruto')
+            stat = naruto.stat()
+            Path(naruto, 'Naruto -.- Chapter 3.cbz').write_bytes(b'0')
+            os.utime(naruto, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            self.assertEqual([], self._scan(queued))
+            list_chapters.assert_not_called()
+
+            os.utime(naruto, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+            self.assertEqual(['Naruto -.- Chapter 3.cbz'], self._scan(queued))
+            self.assertEqual([str(naruto)], [call.args[1] for call in list_chapters.call_args_list])
+
+    def test_failed_chapters_are_found_again(self):
+        """
+        Tests that chapters left in an unchanged directory, because processing them failed, are found by the next
+        scan once they are no longer in the task journal, without listing the directory again.
+        """
+        self._scan()
+        Path(self.download_dir, 'Naruto', 'Naruto -.- Chapter 1.cbz').unlink()
+        Path(self.download_dir, 'Naruto', 'Naruto -.- Chapter 2.cbz').unlink()
+        self._scan()
+
+        with patch.object(DownloadScanner, '_list_chapters') as list_chapters:
+            self.assertEqual(['BLEACH -.- Chapter 1.cbz', 'BLEACH -.- Chapter 2.cbz'], self._scan())
+        list_chapters.assert_not_called()
+
+    def test_known_and_processed_chapters_are_skipped(self):
+        """
+        Tests that chapters already in the task journal or in processed_files are not returned.
+        """
+        self.ProcFilesTable.search_old_filenames.return_value = {'BLEACH -.- Chapter 1.cbz'}
+        known = {str(Path(self.download_dir, 'Naruto', 'Naruto -.- Chapter 2.cbz').absolute())}
+
+        self.assertEqual(['BLEACH -.- Chapter 2.cbz', 'Naruto -.- Chapter 1.cbz'], self._scan(known))
+        self.ProcFilesTable.search_old_filenames.assert_called_once()
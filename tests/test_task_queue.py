@@ -0,0 +1,380 @@
+import json
+import logging
+import os
+import shutil
+import time
+import unittest
+from pathlib import Path
+from queue import Queue
+from unittest.mock import Mock, patch
+from zipfile import ZipFile
+
+from watchdog.events import FileCreatedEvent
+
+from MangaTaggerLib import MangaTaggerLib
+from MangaTaggerLib.models import Metadata
+from MangaTaggerLib.task_queue import QueueWorker, QueueEvent, QueueEventOrigin, FileSettler, SeriesHandler
+
+
+class TestQueueWorker(unittest.TestCase):
+    download_dir = Path('tests/downloads')
+
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.download_dir.mkdir()
+
+        patch1 = patch.object(MangaTaggerLib, 'process_manga_batch')
+        self.process_manga_batch = patch1.start()
+        self.addCleanup(patch1.stop)
+
+        patch2 = patch('MangaTaggerLib.task_queue.TaskQueueTable')
+        self.TaskQueueTable = patch2.start()
+        self.addCleanup(patch2.stop)
+
+        patch3 = patch.object(MangaTaggerLib, 'is_series_cached', return_value=False)
+        self.is_series_cached = patch3.start()
+        self.addCleanup(patch3.stop)
+
+        patch4 = patch('MangaTaggerLib.task_queue.ProcFilesTable')
+        self.ProcFilesTable = patch4.start()
+        self.addCleanup(patch4.stop)
+
+        QueueWorker.threads = 4
+        QueueWorker.max_queue_size = 0
+        QueueWorker.download_dir = self.download_dir
+        QueueWorker.initialize()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.download_dir)
+
+    def _start(self):
+        for worker in QueueWorker._worker_list:
+            worker.start()
+        QueueWorker._settler.start()
+        QueueWorker._observer.start()
+
+    def test_process_drains_queue(self):
+        """
+        Tests that queued events are picked up by the workers without waiting between items.
+        """
+        self._start()
+        for i in range(20):
+            QueueWorker.enqueue(QueueEvent(Path(f'/nonexistent/Series {i} -.- Chapter 1.cbz'), QueueEventOrigin.SCAN))
+
+        start = time.perf_counter()
+        QueueWorker.join()
+
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertEqual(20, self.process_manga_batch.call_count)
+        QueueWorker.exit()
+
+    def test_exit_finishes_in_flight_jobs(self):
+        """
+        Tests that exit() waits for running jobs to finish, stops every worker thread and writes the records of the
+        processed chapters.
+        """
+        def slow_process(chapters):
+            time.sleep(0.2)
+
+        self.process_manga_batch.side_effect = slow_process
+        self._start()
+        QueueWorker.enqueue(QueueEvent(Path('/nonexistent/Series -.- Chapter 1.cbz'), QueueEventOrigin.SCAN))
+        time.sleep(0.05)
+
+        QueueWorker.exit()
+
+        self.assertEqual(1, self.process_manga_batch.call_count)
+        self.assertFalse(any(worker.is_alive() for worker in QueueWorker._worker_list))
+        self.ProcFilesTable.flush.assert_called_once()
+
+    def test_exit_empties_queue(self):
+        """
+        Tests that exit() removes the chapters that are still queued, which stay in the journal, and shuts down
+        cleanly.
+        """
+        def slow_process(chapters):
+            time.sleep(0.2)
+
+        QueueWorker.threads = 1
+        QueueWorker.initialize()
+        self.process_manga_batch.side_effect = slow_process
+        self._start()
+        QueueWorker.enqueue(QueueEvent(Path('/nonexistent/A -.- Chapter 1.cbz'), QueueEventOrigin.SCAN))
+        time.sleep(0.05)
+        QueueWorker.enqueue(QueueEvent(Path('/nonexistent/B -.- Chapter 1.cbz'), QueueEventOrigin.SCAN))
+
+        QueueWorker.exit()
+
+        self.assertEqual(1, self.process_manga_batch.call_count)
+        self.assertEqual({'cached': 0, 'network': 0}, QueueWorker.queue_depths())
+        self.assertEqual({}, QueueWorker._queued_series)
+        self.assertFalse(any(worker.is_alive() for worker in QueueWorker._worker_list))
+        self.TaskQueueTable.flush.assert_called()
+        self.ProcFilesTable.flush.assert_called_once()
+
+    def test_cached_series_processed_first(self):
+        """
+        Tests that chapters of series already in the database are processed ahead of series that need Anilist.
+        """
+        QueueWorker.threads = 1
+        QueueWorker.initialize()
+        self.is_series_cached.side_effect = lambda manga_title: manga_title == 'Cached'
+
+        QueueWorker.enqueue(QueueEvent(Path('/nonexistent/Network -.- Chapter 1.cbz'), QueueEventOrigin.SCAN))
+        QueueWorker.enqueue(QueueEvent(Path('/nonexistent/Cached -.- Chapter 1.cbz'), QueueEventOrigin.SCAN))
+        self.assertEqual({'cached': 1, 'network': 1}, QueueWorker.queue_depths())
+
+        self._start()
+        QueueWorker.join()
+
+        processed = [call.args[0][0][0].name for call in self.process_manga_batch.call_args_list]
+        self.assertEqual(['Cached -.- Chapter 1.cbz', 'Network -.- Chapter 1.cbz'], processed)
+        self.assertEqual({'cached': 0, 'network': 0}, QueueWorker.queue_depths())
+        QueueWorker.exit()
+
+    def test_cached_series_skip_busy_worker(self):
+        """
+        Tests that chapters of a cached series go to an idle worker rather than waiting behind the Anilist lookup of
+        another series that hashes to the same worker.
+        """
+        QueueWorker.threads = 2
+        QueueWorker.initialize()
+        self.is_series_cached.side_effect = lambda manga_title: manga_title == 'Cached'
+        finished = []
+
+        def process(chapters):
+            if chapters[0][0].name.startswith('Network'):
+                time.sleep(0.3)
+            finished.append(chapters[0][0].name)
+
+        self.process_manga_batch.side_effect = process
+        with patch.object(QueueWorker, '_worker_index', return_value=0):
+            self._start()
+            QueueWorker.enqueue(QueueEvent(Path('/nonexistent/Network -.- Chapter 1.cbz'), QueueEventOrigin.SCAN))
+            time.sleep(0.05)
+            QueueWorker.enqueue(QueueEvent(Path('/nonexistent/Cached -.- Chapter 1.cbz'), QueueEventOrigin.SCAN))
+            QueueWorker.join()
+
+        self.assertEqual(['Cached -.- Chapter 1.cbz', 'Network -.- Chapter 1.cbz'], finished)
+        QueueWorker.exit()
+
+    def test_series_classified_once(self):
+        """
+        Tests that the database is only consulted for the first queued chapter of a series, and again once the series
+        has left the queue.
+        """
+        QueueWorker.threads = 1
+        QueueWorker.initialize()
+
+        for chapter in range(1, 4):
+            QueueWorker.enqueue(QueueEvent(Path(f'/nonexistent/A -.- Chapter {chapter}.cbz'), QueueEventOrigin.SCAN))
+        self.is_series_cached.assert_called_once_with('A')
+        self.assertEqual({'cached': 0, 'network': 3}, QueueWorker.queue_depths())
+
+        self._start()
+        QueueWorker.join()
+        QueueWorker.enqueue(QueueEvent(Path('/nonexistent/A -.- Chapter 4.cbz'), QueueEventOrigin.SCAN))
+        QueueWorker.join()
+
+        self.assertEqual(2, self.is_series_cached.call_count)
+        self.assertEqual({}, QueueWorker._queued_series)
+        QueueWorker.exit()
+
+    def test_cpu_bound_work_runs_in_process_pool(self):
+        """
+        Tests that chapter tagging runs in a spawned worker process when processes are configured, with its arguments
+        pickled across, and in the calling thread when they are not.
+        """
+        with patch('MangaTaggerLib.models.AppSettings') as AppSettings:
+            AppSettings.timezone = 'America/New_York'
+            with open(Path('tests/data/BLEACH/data.json'), encoding='utf-8') as data:
+                metadata = Metadata('BLEACH', {}, json.load(data))
+        chapter_path = Path(self.download_dir, 'BLEACH 001.cbz')
+        with ZipFile(chapter_path, 'w') as chapter:
+            chapter.writestr('001.jpg', b'')
+
+        QueueWorker.processes = 1
+        self.addCleanup(setattr, QueueWorker, 'processes', 0)
+        QueueWorker.initialize()
+        self.addCleanup(QueueWorker._process_pool.shutdown)
+
+        self.assertEqual('spawn', QueueWorker._process_pool._mp_context.get_start_method())
+        self.assertNotEqual(os.getpid(), QueueWorker.run_cpu_bound(os.getpid))
+        QueueWorker.run_cpu_bound(MangaTaggerLib.write_chapter_tags, metadata, '001', None, chapter_path, None, {})
+        with ZipFile(chapter_path) as chapter:
+            self.assertIn('<Series>BLEACH</Series>', chapter.read('ComicInfo.xml').decode('utf-8'))
+
+        QueueWorker.processes = 0
+        QueueWorker.initialize()
+        self.assertIsNone(QueueWorker._process_pool)
+        self.assertEqual(os.getpid(), QueueWorker.run_cpu_bound(os.getpid))
+
+    def test_series_batching(self):
+        """
+        Tests that queued chapters of the same series are handed over as one batch.
+        """
+        QueueWorker.threads = 1
+        QueueWorker.initialize()
+
+        for name in ('A -.- Chapter 1.cbz', 'B -.- Chapter 1.cbz', 'A -.- Chapter 2.cbz', 'A -.- Chapter 3.cbz'):
+            QueueWorker.enqueue(QueueEvent(Path('/nonexistent', name), QueueEventOrigin.SCAN))
+
+        self._start()
+        QueueWorker.join()
+
+        batches = [[chapter[0].name for chapter in call.args[0]]
+                   for call in self.process_manga_batch.call_args_list]
+        self.assertEqual([['A -.- Chapter 1.cbz', 'A -.- Chapter 2.cbz', 'A -.- Chapter 3.cbz'],
+                          ['B -.- Chapter 1.cbz']], batches)
+        QueueWorker.exit()
+
+    def test_journal_records_event_lifecycle(self):
+        """
+        Tests that a chapter is journaled as pending when queued, as started when picked up and removed once processed.
+        """
+        self._start()
+        event = QueueEvent(Path('/nonexistent/Series -.- Chapter 1.cbz'), QueueEventOrigin.SCAN)
+        QueueWorker.enqueue(event)
+        QueueWorker.join()
+
+        journal = [(name, call_args[0]) for name, call_args, _ in self.TaskQueueTable.method_calls
+                   if name.startswith('record_')]
+        self.assertEqual([('record_pending', [event]), ('record_started', [event]), ('record_completed', [event])],
+                         journal)
+        QueueWorker.exit()
+
+    def test_load_replays_journal(self):
+        """
+        Tests that journaled chapters are queued again on startup and chapters that no longer exist are dropped.
+        """
+        chapter = Path(self.download_dir, 'Series -.- Chapter 1.cbz')
+        chapter.write_bytes(b'0')
+        missing = Path(self.download_dir, 'Series -.- Chapter 2.cbz')
+
+        def load(task_list):
+            for path, state in ((chapter, 'started'), (missing, 'pending')):
+                task_list[path.stem] = {'event_type': 'existing', 'src_path': str(path.absolute()),
+                                        'manga_chapter': path.stem, 'state': state}
+
+        self.TaskQueueTable.load.side_effect = load
+        QueueWorker.task_list = {}
+        QueueWorker.load_task_queue()
+
+        self.assertEqual([chapter.absolute()], [event.src_path for event in QueueWorker._settler.pending()])
+        completed = self.TaskQueueTable.record_completed.call_args.args[0]
+        self.assertEqual([missing.absolute()], [event.src_path for event in completed])
+        self.TaskQueueTable.delete_all.assert_not_called()
+        QueueWorker.task_list = {}
+
+    def test_series_affinity(self):
+        """
+        Tests that chapters of the same series are routed to the same worker, whatever the folder name's case.
+        """
+        indexes = {QueueWorker._worker_index(QueueEvent(Path(f'/downloads/{folder}/{folder} -.- Chapter {i}.cbz'),
+                                                        QueueEventOrigin.SCAN))
+                   for i in range(20) for folder in ('Naruto', 'NARUTO')}
+
+        self.assertEqual(1, len(indexes))
+        self._start()
+        QueueWorker.exit()
+
+
+class TestFileSettler(unittest.TestCase):
+    download_dir = Path('tests/downloads')
+
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.download_dir.mkdir()
+        self.queue = Queue()
+        self.settler = FileSettler(self.queue.put, settle_interval=0.1, tick=0.02, slots=4)
+        self.settler.start()
+
+    def tearDown(self) -> None:
+        self.settler.stop()
+        shutil.rmtree(self.download_dir)
+
+    def _event(self, name):
+        path = Path(self.download_dir, name)
+        path.write_bytes(b'0')
+        return QueueEvent(path, QueueEventOrigin.SCAN)
+
+    def test_settled_file_is_released(self):
+        """
+        Tests that a file whose size does not change is passed to the queue after the settle interval.
+        """
+        event = self._event('Series -.- Chapter 1.cbz')
+        self.settler.add(event)
+
+        self.assertIs(event, self.queue.get(timeout=1))
+
+    def test_growing_file_is_held(self):
+        """
+        Tests that a file which is still being written to is not passed to the queue.
+        """
+        event = self._event('Series -.- Chapter 1.cbz')
+        self.settler.add(event)
+
+        for i in range(5):
+            with open(event.src_path, 'ab') as chapter:
+                chapter.write(b'0' * (i + 1))
+            time.sleep(0.06)
+        self.assertTrue(self.queue.empty())
+
+        self.assertIs(event, self.queue.get(timeout=1))
+
+    def test_mark_stable_releases_immediately(self):
+        """
+        Tests that a close-write notification releases a file without waiting for the settle interval.
+        """
+        self.settler.settle_interval = 60
+        event = self._event('Series -.- Chapter 1.cbz')
+        self.settler.add(event)
+        self.settler.mark_stable(event.src_path)
+
+        self.assertIs(event, self.queue.get_nowait())
+
+    def test_pending_returns_unsettled_files(self):
+        """
+        Tests that files still waiting to settle are returned so they can be saved on exit.
+        """
+        self.settler.settle_interval = 60
+        event = self._event('Series -.- Chapter 1.cbz')
+        self.settler.add(event)
+
+        self.assertEqual([event], self.settler.pending())
+        self.assertEqual([], self.settler.pending())
+
+
+class TestSeriesHandler(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.disable(logging.CRITICAL)
+        self.settler = Mock()
+        self.prefetched = Queue()
+        self.handler = SeriesHandler(self.settler, self.prefetched.put)
+
+    def _created(self, path):
+        self.handler.on_created(FileCreatedEvent(path))
+
+    def test_first_chapter_of_directory_is_prefetched(self):
+        """
+        Tests that the series is prefetched when the first chapter of a download directory appears, and only then.
+        """
+        self._created('tests/downloads/Series/Series -.- Chapter 1.cbz')
+        self._created('tests/downloads/Series/Series -.- Chapter 2.cbz')
+        self._created('tests/downloads/Other/Other -.- Chapter 1.cbz')
+
+        prefetched = {self.prefetched.get(timeout=1), self.prefetched.get(timeout=1)}
+        self.assertEqual({Path('tests/downloads/Series/Series -.- Chapter 1.cbz'),
+                          Path('tests/downloads/Other/Other -.- Chapter 1.cbz')}, prefetched)
+        self.assertEqual(3, self.settler.add.call_count)
+        time.sleep(0.05)
+        self.assertTrue(self.prefetched.empty())
+
+    def test_prefetch_can_be_disabled(self):
+        """
+        Tests that creation events are only queued when no prefetch is configured.
+        """
+        handler = SeriesHandler(self.settler)
+        handler.on_created(FileCreatedEvent('tests/downloads/Series/Series -.- Chapter 1.cbz'))
+
+        self.settler.add.assert_called_once()